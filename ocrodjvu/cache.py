@@ -0,0 +1,202 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Persistent content-addressed cache of OCR results.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger('ocrodjvu.main')
+
+
+def make_key(*items):
+    """
+    Return cache key for the items, which are either bytes or strings.
+    """
+    digest = hashlib.sha256()
+    for item in items:
+        if isinstance(item, str):
+            item = item.encode('UTF-8')
+        digest.update(len(item).to_bytes(8, 'big'))
+        digest.update(item)
+    return digest.hexdigest()
+
+
+class Cache:
+    """
+    Directory of cache entries, with size-bounded LRU eviction.
+
+    Entries are written to temporary files, which are then atomically renamed,
+    so the cache can be shared between concurrent processes. Modification
+    time of an entry is updated whenever the entry is used; when the total
+    size exceeds the limit, the least recently used entries are removed.
+
+    Hit and miss counters are shared with worker processes forked after the
+    cache was created.
+
+    The cache is only an optimization, so I/O errors are logged, but
+    otherwise ignored.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hits = multiprocessing.Value('L', 0)
+        self._misses = multiprocessing.Value('L', 0)
+        self._size = self._scan_size()
+
+    @property
+    def hits(self):
+        return self._hits.value
+
+    @property
+    def misses(self):
+        return self._misses.value
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.startswith('.'):
+                    # temporary file
+                    continue
+                try:
+                    yield entry.path, entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    # removed by another process
+                    pass
+
+    def _scan_size(self):
+        return sum(stat.st_size for _, stat in self._entries())
+
+    @staticmethod
+    def _count(counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def get(self, key):
+        """
+        Return data stored under the key, or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError as ex:
+            if not isinstance(ex, FileNotFoundError):
+                logger.warning(f'warning: cannot read cache entry {path!r}: {ex.strerror}')
+            self._count(self._misses)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # The entry was just evicted by another process, or the cache
+            # directory is read-only. Either way, only the eviction order is
+            # affected.
+            pass
+        self._count(self._hits)
+        return data
+
+    def discard(self, key):
+        """
+        Remove the entry that get() has just returned, because it turned out
+        to be malformed. The lookup is counted as a miss.
+        """
+        path = self._path(key)
+        logger.warning(f'warning: removing malformed cache entry {path!r}')
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            logger.warning(f'warning: cannot remove cache entry {path!r}: {ex.strerror}')
+        with self._hits.get_lock():
+            self._hits.value -= 1
+        self._count(self._misses)
+
+    def put(self, key, data):
+        """
+        Store data under the key.
+        """
+        try:
+            self._put(key, data)
+        except OSError as ex:
+            logger.warning(f'warning: cannot write to cache {self.directory!r}: {ex.strerror}')
+
+    def _put(self, key, data):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            # Size of the entry being overwritten, if any:
+            try:
+                old_size = os.stat(path).st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._size += len(data) - old_size
+            if self._size <= self.max_size:
+                return
+            self._evict()
+
+    def _evict(self):
+        # Other processes might have added or removed entries in the meantime,
+        # so rescan the directory. Only one process at a time does that.
+        with open(os.path.join(self.directory, '.lock'), 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = sorted(self._entries(), key=lambda item: item[1].st_mtime_ns)
+            size = sum(stat.st_size for _, stat in entries)
+            if size <= self.max_size:
+                # The size counter is per-process, so it was off.
+                self._size = size
+                return
+            # Leave some room, so that eviction doesn't happen on every put().
+            target_size = self.max_size * 9 // 10
+            for path, stat in entries:
+                if size <= target_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                size -= stat.st_size
+            self._size = size
+
+
+__all__ = ['Cache', 'make_key']
+
+# vim:ts=4 sts=4 sw=4 et
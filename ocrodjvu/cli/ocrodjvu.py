@@ -14,26 +14,44 @@
 # for more details.
 
 import argparse
+import concurrent.futures
 import contextlib
+import errno
 import inspect
+import io
 import locale
+import multiprocessing
+import multiprocessing.connection
 import os
+import queue
 import shutil
+import signal
+import socket
 import string
+import struct
 import sys
 import threading
+import time
 import traceback
 from typing import Union
 
+from ocrodjvu import cache
 from ocrodjvu import cli
 from ocrodjvu import engines
 from ocrodjvu import errors
 from ocrodjvu import ipc
+from ocrodjvu import journal
 from ocrodjvu import logger
+from ocrodjvu import progress
+from ocrodjvu import report
+from ocrodjvu import scheduling
+from ocrodjvu import status
 from ocrodjvu import temporary
 from ocrodjvu import text_zones
+from ocrodjvu import trace
 from ocrodjvu import utils
 from ocrodjvu import version
+from ocrodjvu.engines import common as engines_common
 
 # Import this after local modules, so that they can take care of a showing a nice ImportError message.
 import djvu.decode
@@ -45,10 +63,17 @@ SYSTEM_ENCODING = locale.getpreferredencoding()
 
 LOGGER = logger.setup()
 
+# How often --status-file is refreshed, in seconds:
+STATUS_INTERVAL = 5
+
+# Images larger than this (in bytes) are not piped to the OCR engine:
+MAX_PIPED_IMAGE_SIZE = 32 << 20
+
 
 class Saver:
 
     in_place = False
+    _save_path = None
 
     def __init__(self):
         pass
@@ -61,6 +86,43 @@ class Saver:
     def check(self):
         pass
 
+    def check_batch(self, djvu_paths):
+        # In the batch mode, the output path is a directory.
+        if self._save_path is not None and not os.path.isdir(self._save_path):
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), self._save_path)
+        # Documents must not overwrite each other's results (or journals).
+        documents = {}
+        for n, djvu_path in enumerate(djvu_paths):
+            output_path = self.get_output_path(djvu_path)
+            if output_path is None:
+                continue
+            other_n = documents.setdefault(output_path, n)
+            if other_n != n:
+                other_path = djvu_paths[other_n]
+                raise ValueError(f'results for {other_path!r} and {djvu_path!r} would be saved to the same file {output_path!r}')
+
+    def get_output_path(self, djvu_path):
+        """
+        Return path of the file with results for the document in the batch
+        mode, or None if there is no such file.
+        """
+        return self._save_path
+
+    def for_document(self, djvu_path):
+        """
+        Return saver for the document in the batch mode.
+        """
+        return self
+
+    def get_journal_path(self, djvu_path):
+        """
+        Return path of the journal of recognized pages, or None if there
+        should be no journal.
+        """
+        if self._save_path is None:
+            return None
+        return self._save_path + '.ocrodjvu-journal'
+
     @utils.not_overridden
     def save(self, document, pages, djvu_path, sed_file):
         raise NotImplementedError('Cannot save results in this format')  # no coverage
@@ -80,6 +142,12 @@ class BundledSaver(Saver):
     def check(self):
         self._ips.check()
 
+    def get_output_path(self, djvu_path):
+        return os.path.join(self._save_path, os.path.basename(djvu_path))
+
+    def for_document(self, djvu_path):
+        return BundledSaver(self.get_output_path(djvu_path))
+
     def save(self, document, pages, djvu_path, sed_file):
         file = open(self._save_path, 'wb')
         try:
@@ -103,6 +171,17 @@ class IndirectSaver(Saver):
     def check(self):
         self._ips.check()
 
+    def get_output_path(self, djvu_path):
+        # Component files of different documents could clash,
+        # so put each document into a separate directory.
+        basename = os.path.basename(djvu_path)
+        return os.path.join(self._save_path, os.path.splitext(basename)[0], basename)
+
+    def for_document(self, djvu_path):
+        output_path = self.get_output_path(djvu_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return IndirectSaver(output_path)
+
     def save(self, document, pages, djvu_path, sed_file):
         document.save(indirect=self._save_path, pages=pages)
         self._ips.save(None, pages, self._save_path, sed_file)
@@ -118,6 +197,13 @@ class ScriptSaver(Saver):
         super(ScriptSaver, self).__init__()
         self._save_path = os.path.abspath(save_path)
 
+    def get_output_path(self, djvu_path):
+        basename = os.path.basename(djvu_path)
+        return os.path.join(self._save_path, os.path.splitext(basename)[0] + '.djvused')
+
+    def for_document(self, djvu_path):
+        return ScriptSaver(self.get_output_path(djvu_path))
+
     def save(self, document, pages, djvu_path, sed_file):
         shutil.copyfile(sed_file.name, self._save_path)
 
@@ -132,6 +218,12 @@ class InPlaceSaver(Saver):
     def check(self):
         ipc.require('djvused')
 
+    def get_output_path(self, djvu_path):
+        return os.path.abspath(djvu_path)
+
+    def get_journal_path(self, djvu_path):
+        return os.path.abspath(djvu_path) + '.ocrodjvu-journal'
+
     def save(self, document, pages, djvu_path, sed_file):
         sed_file_name = os.path.abspath(sed_file.name)
         djvu_path = os.path.abspath(djvu_path)
@@ -152,11 +244,12 @@ class DryRunSaver(Saver):
         pass
 
 
-def expand_template(template, pageno, pageid):
+def expand_template(template, pageno, pageid, djvu_path=''):
     d = {
         'page': pageno,
         'id': pageid,
         'id-ext': os.path.splitext(pageid)[0],
+        'name': os.path.splitext(os.path.basename(djvu_path))[0],
     }
     formatter = string.Formatter()
     for _, var, _, _ in formatter.parse(template):
@@ -189,22 +282,41 @@ class EngineChoices:
     default = 'tesseract'
 
     def __init__(self):
-        self._data = data = {}
-        for eng in engines.get_engines():
-            data[eng.name] = eng
+        # Engine modules are imported only when needed:
+        self._data = {}
+        self._complete = False
+
+    def _get_all(self):
+        if not self._complete:
+            for eng in engines.get_engines():
+                self._data[eng.name] = eng
+            self._complete = True
+        return self._data
+
+    def _get(self, key):
+        try:
+            return self._data[key]
+        except LookupError:
+            if self._complete:
+                return None
+        eng = self._data[key] = engines.get_engine(key)
+        return eng
 
     def __iter__(self):
         return iter(sorted(
             key
-            for key in self._data
-            if key[0] != '_'
+            for key, eng in self._get_all().items()
+            if eng is not None and key[0] != '_'
         ))
 
     def __contains__(self, key):
-        return key in self._data
+        return self._get(key) is not None
 
     def __getitem__(self, key):
-        return self._data[key]
+        eng = self._get(key)
+        if eng is None:
+            raise KeyError(key)
+        return eng
 
 
 class HelpFormatter(argparse.HelpFormatter):
@@ -220,7 +332,7 @@ class HelpFormatter(argparse.HelpFormatter):
         actions += [argparse.Action(['options'], 'options', nargs=0, required=False)]
         actions += [
             act for act in orig_actions
-            if (act.required or isinstance(act, ArgumentParser.SetOutput))
+            if (act.required or not act.option_strings or isinstance(act, ArgumentParser.SetOutput))
         ]
         return argparse.HelpFormatter.add_usage(self, usage, actions, groups, prefix)
 
@@ -275,6 +387,10 @@ class ArgumentParser(cli.ArgumentParser):
             '--render', dest='render_layers', choices=list(self._render_map.keys()), action='store', default='mask',
             help='image layers to render'
         )
+        self.add_argument(
+            '--colour', dest='colour', choices=('gray', 'rgb'), default='gray',
+            help='render images in grayscale or in colour (with --render=foreground or --render=all)'
+        )
 
         def pages(x):
             return utils.parse_page_numbers(x)
@@ -289,8 +405,51 @@ class ArgumentParser(cli.ArgumentParser):
                 raise ValueError
             return n
 
+        def rows(s):
+            n = int(s)
+            if n <= 0:
+                raise ValueError
+            return n
+
+        self.add_argument(
+            '--render-band-height', dest='render_band_height', metavar='N', type=rows, default=1024,
+            help='render images for the OCR engine in bands of at most N rows (default: 1024)'
+        )
         self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=jobs, default=1, help='start N OCR threads')
-        self.add_argument('path', metavar='FILE', help='DjVu file to process')
+        self.add_argument(
+            '--executor', dest='executor', choices=('thread', 'process', 'pipeline'), default='thread',
+            help='run OCR jobs in threads, in separate processes, or as a pipeline of stages'
+        )
+        self.add_argument(
+            '--render-jobs', dest='render_jobs', metavar='N', type=jobs, default=1,
+            help='start N page rendering threads (with --executor=pipeline)'
+        )
+        self.add_argument(
+            '--ocr-jobs', dest='ocr_jobs', metavar='N', type=jobs, default=None,
+            help='start N OCR engine threads (with --executor=pipeline; default: same as -j)'
+        )
+        self.add_argument(
+            '--parse-jobs', dest='parse_jobs', metavar='N', type=jobs, default=1,
+            help='start N OCR output parsing threads (with --executor=pipeline)'
+        )
+        self.add_argument(
+            '--schedule', dest='schedule', choices=('document', 'cost'), default='document',
+            help='process pages in document order, or the most expensive ones first'
+        )
+        self.add_argument(
+            '--max-buffered-pages', dest='max_buffered_pages', metavar='N', type=jobs, default=None,
+            help='maximum number of recognized pages waiting to be written (default: 4 × number of OCR jobs)'
+        )
+        self.add_argument('paths', metavar='FILE', nargs='*', help='DjVu file to process')
+        group = self.add_argument_group(title='batch mode options')
+        group.add_argument(
+            '--batch', dest='batch', action='store_true', default=False,
+            help='process multiple DjVu files with a shared pool of OCR jobs'
+        )
+        group.add_argument(
+            '--batch-list', dest='batch_list', metavar='LISTFILE',
+            help='process DjVu files listed in LISTFILE (one per line); implies --batch'
+        )
         group = self.add_argument_group(title='text segmentation options')
         group.add_argument(
             '-t', '--details', dest='details', choices=('lines', 'words', 'chars'), action='store', default='words',
@@ -306,18 +465,83 @@ class ArgumentParser(cli.ArgumentParser):
             '-X', dest='properties', metavar='KEY=VALUE', help='set an engine-specific property', action='append', default=[]
         )
         group.add_argument('--on-error', choices=('abort', 'resume'), default='abort', help='error handling strategy')
+
+        def seconds(s):
+            n = float(s)
+            if not n > 0:
+                raise ValueError
+            return n
+
+        def count(s):
+            n = int(s)
+            if n < 0:
+                raise ValueError
+            return n
+
+        group.add_argument(
+            '--page-timeout', dest='page_timeout', metavar='SECONDS', type=seconds, default=None,
+            help='kill the OCR engine if it takes longer than SECONDS to recognize a page'
+        )
+        group.add_argument(
+            '--retries', dest='retries', metavar='N', type=count, default=0,
+            help='recognize a page up to N more times if the OCR engine timed out (default: 0)'
+        )
+        group.add_argument(
+            '--resume', dest='resume', action='store_true', default=False,
+            help='record recognized pages in a journal, and reuse pages recorded by an interrupted run'
+        )
         group.add_argument('--html5', dest='html5', action='store_true', help='use HTML5 parser')
+        group.add_argument(
+            '--report', dest='report', metavar='FILE', default=None,
+            help='write timing statistics to FILE (in the JSON format)'
+        )
+        group.add_argument(
+            '--trace', dest='trace', metavar='FILE', default=None,
+            help='write timeline of the processing to FILE (in the Chrome trace event format)'
+        )
+
+        def progress(s):
+            format_, colon, fd = s.partition(':')
+            if format_ != 'jsonl':
+                raise ValueError
+            if not colon:
+                return 1
+            fd = int(fd)
+            if fd < 0:
+                raise ValueError
+            return fd
+
+        group.add_argument(
+            '--progress', dest='progress_fd', metavar='jsonl[:FD]', type=progress, default=None,
+            help='write progress of every page as JSON lines to file descriptor FD (default: standard output)'
+        )
+        group.add_argument(
+            '--status-file', dest='status_file', metavar='FILE', default=None,
+            help=f'write what every worker is doing to FILE, every {STATUS_INTERVAL} seconds'
+        )
+        group.add_argument('--cache-dir', dest='cache_dir', metavar='DIRECTORY', help='cache OCR results in DIRECTORY')
+        group.add_argument(
+            '--cache-size', dest='cache_size', metavar='N', type=jobs, default=1024,
+            help='maximum size of the OCR cache, in MiB (default: 1024)'
+        )
 
     class ListEngines(argparse.Action):
         def __call__(self, parser, namespace, values, option_string=None):
-            for engine_name in parser.engines:
-                engine = parser.engines[engine_name]
+            engine_types = [parser.engines[engine_name] for engine_name in parser.engines]
+
+            def is_available(engine):
                 try:
                     _ = engine()
                 except errors.EngineNotFoundError:
-                    pass
+                    return False
                 else:
-                    print(engine_name)
+                    return True
+
+            # Probing an engine usually means running it, so probe them all in parallel.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(engine_types), 1)) as executor:
+                for engine, available in zip(engine_types, executor.map(is_available, engine_types)):
+                    if available:
+                        print(engine.name)
             sys.exit(0)
 
     class ListLanguages(argparse.Action):
@@ -347,10 +571,32 @@ class ArgumentParser(cli.ArgumentParser):
         options.details = self._details_map[options.details]
         options.render_layers = self._render_map[options.render_layers]
         options.resume_on_error = options.on_error == 'resume'
+        if options.batch_list is not None:
+            options.batch = True
+            try:
+                with open(options.batch_list, 'rt') as file:
+                    options.paths += [line.rstrip('\n') for line in file if line.strip()]
+            except OSError as exc:
+                errors.fatal(f'cannot open {exc.filename!r}: {exc.strerror}')
+        if not options.paths:
+            self.error('the following arguments are required: FILE')
+        if options.batch:
+            options.path = None
+        elif len(options.paths) > 1:
+            self.error('only one FILE can be processed without --batch')
+        else:
+            [options.path] = options.paths
         try:
             options.saver.check()
         except OSError as exc:
             errors.fatal(f'cannot find {exc.filename!r}: {exc.strerror}')
+        if options.batch:
+            try:
+                options.saver.check_batch(options.paths)
+            except OSError as exc:
+                errors.fatal(f'cannot save results to {exc.filename!r}: {exc.strerror}')
+            except ValueError as exc:
+                errors.fatal(exc)
         if options.save_raw_ocr_dir is not None:
             try:
                 os.stat(os.path.join(options.save_raw_ocr_dir, ''))
@@ -397,31 +643,400 @@ class ArgumentParser(cli.ArgumentParser):
         except errors.UnknownLanguageListError:
             # For now, let's assume the language pack is installed.
             pass
+        batch_size = getattr(options.engine, 'batch_size', None) or 1
+        if batch_size > 1 and options.executor != 'thread':
+            self.error('-X batch_size=N is supported only with --executor=thread')
         options.uax29 = options.language if options.word_segmentation == 'uax29' else None
         if options.n_jobs is None:
             options.n_jobs = utils.get_cpu_count()
+        if options.ocr_jobs is None:
+            options.ocr_jobs = options.n_jobs
+        if options.cache_dir is not None:
+            try:
+                options.cache = cache.Cache(options.cache_dir, options.cache_size << 20)
+            except OSError as ex:
+                errors.fatal(f'cannot open {ex.filename!r}: {ex.strerror}')
+        else:
+            options.cache = None
+        options.progress_file = None
+        if options.progress_fd is None:
+            pass
+        elif options.progress_fd == 1:
+            options.progress_file = sys.stdout
+        else:
+            try:
+                options.progress_file = os.fdopen(options.progress_fd, 'wt', encoding='UTF-8', closefd=False)
+            except OSError as ex:
+                errors.fatal(f'cannot open file descriptor {options.progress_fd}: {ex.strerror}')
+        if options.max_buffered_pages is None and options.schedule == 'document':
+            # With --schedule=cost, many pages are expected to wait for pages
+            # preceding them, so don't limit their number by default.
+            options.max_buffered_pages = 4 * max(options.n_jobs, options.ocr_jobs)
         return options
 
 
-class Results(dict):
-    seen_exception = False
+class PipelineStage:
+    """
+    A stage of the page processing pipeline.
+
+    Items are (i, page, args) triples; the stage function is called as
+    function(page, *args), and its return value is passed as args to the next
+    stage. The first stage takes pages from the scheduler in the same way the
+    page_thread() does.
+    """
+
+    def __init__(self, name, function, n_threads):
+        self.name = name
+        self.function = function
+        self.n_threads = n_threads
+        self.input = None
+        self.first = True
+        self.next = None
+        self._n_running = n_threads
+        self._lock = threading.Lock()
+
+    def connect(self, next_stage):
+        # Bounded queues make sure that only a limited number of rendered
+        # images or OCR results is waiting to be processed at any time.
+        next_stage.input = queue.Queue(maxsize=next_stage.n_threads)
+        next_stage.first = False
+        self.next = next_stage
+
+    @property
+    def output(self):
+        if self.next is None:
+            return
+        return self.next.input
+
+    def thread_done(self):
+        with self._lock:
+            self._n_running -= 1
+            last = self._n_running == 0
+        if last and self.next is not None:
+            # Let the threads of the next stage know that no more items are coming.
+            for _ in range(self.next.n_threads):
+                self.output.put(None)
+
+
+class WorkerProcessError(Exception):
+
+    def __init__(self, message, by_user=False):
+        Exception.__init__(self, message)
+        self.by_user = by_user
+
+
+def _kill_engines(signal_id, frame):
+    # Signal handler for worker processes. Engines with a time limit run in
+    # their own process groups, so they wouldn't get the signal, and would
+    # outlive the worker.
+    ipc.kill_watched()
+    if signal_id == signal.SIGINT:
+        raise KeyboardInterrupt
+    signal.signal(signal_id, signal.SIG_DFL)
+    os.kill(os.getpid(), signal_id)
+
+
+def _page_process_main(connection, options, temp_dir, timeouts):
+    # This is the main function of a worker process. The process uses its own
+    # decoding context, so that page decoding, rendering and parsing of OCR
+    # results is not serialized with other workers.
+    if hasattr(signal, 'SIGUSR1'):
+        # Only the main process reports its status.
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    for signal_id in signal.SIGINT, signal.SIGTERM:
+        signal.signal(signal_id, _kill_engines)
+    context = Context()
+    context.init(options, temp_dir=temp_dir, timeouts=timeouts)
+    documents = {}
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            (path, label, n), n_threads = message
+            document = documents.get(path)
+            if document is None:
+                # In the batch mode, pages of at most two documents are
+                # interleaved, so there's no point in caching more of them.
+                while len(documents) > 1:
+                    context.forget_document(documents.pop(next(iter(documents))))
+                document = documents[path] = context.open_document(path, label)
+            page = document.pages[n]
+            try:
+                with ipc.local_env(OMP_THREAD_LIMIT=str(n_threads)):
+                    text = context.process_page(page)
+            except djvu.decode.NotAvailable:
+                connection.send(('unavailable', None, context.pop_page_stats(page)))
+            except KeyboardInterrupt:
+                connection.send(('error', (traceback.format_exc(), True), None))
+                break
+            except Exception as ex:
+                interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
+                connection.send(('error', (traceback.format_exc(), interrupted_by_user), context.pop_page_stats(page)))
+            else:
+                # Send the serialized S-expression, as the expression objects
+                # themselves cannot be pickled.
+                file = io.StringIO()
+                with context.timer(page, 'serialize'):
+                    text_zones.print_sexpr(text, file)
+                connection.send(('ok', file.getvalue(), context.pop_page_stats(page)))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        connection.close()
+
+
+def _worker_factory_main(sock, parent_sock, options, temp_dir, timeouts):
+    # This is the main function of the worker factory process. For every
+    # request, it forks a worker process, and sends back its PID and the
+    # parent's end of the connection to it.
+    pid_format = WorkerFactory.pid_format
+    # Otherwise the factory would never notice that the parent is gone.
+    parent_sock.close()
+    try:
+        while sock.recv(1):
+            while True:
+                # Reap workers that have already exited.
+                try:
+                    pid, _ = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+            parent_end, child_end = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 0
+                try:
+                    sock.close()
+                    parent_end.close()
+                    connection = multiprocessing.connection.Connection(child_end.detach())
+                    _page_process_main(connection, options, temp_dir, timeouts)
+                except BaseException:
+                    traceback.print_exc()
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            child_end.close()
+            sock.sendmsg(
+                [struct.pack(pid_format, pid)],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack('i', parent_end.fileno()))]
+            )
+            parent_end.close()
+    except (OSError, KeyboardInterrupt):
+        pass
+    finally:
+        sock.close()
+        # Workers exit as soon as their connections are closed.
+        while True:
+            try:
+                os.wait()
+            except ChildProcessError:
+                break
+            except KeyboardInterrupt:
+                pass
+
+
+class WorkerFactory:
+    """
+    Process that forks worker processes on request.
+
+    Forking a process that runs threads is not safe: locks held by other
+    threads at that time would stay locked in the child forever. The factory
+    is forked before any threads are started, so that workers (including
+    replacements for workers that died) can be forked later at any time.
+    """
+
+    pid_format = 'i'
+
+    def __init__(self, context):
+        self._context = context
+        self._lock = threading.Lock()
+        self._socket = None
+        self._process = None
+
+    def start(self):
+        # Worker processes must inherit the options (including the
+        # already-initialized OCR engine), which are not necessarily picklable.
+        # Hence the fork start method.
+        mp_context = multiprocessing.get_context('fork')
+        self._socket, child_socket = socket.socketpair()
+        self._process = mp_context.Process(
+            target=_worker_factory_main,
+            args=(child_socket, self._socket, self._context.options, self._context.temp_dir, self._context.timeouts),
+            daemon=True,
+        )
+        self._process.start()
+        child_socket.close()
+
+    def fork_worker(self):
+        """
+        Start a worker process; return its PID and a connection to it.
+        """
+        pid_size = struct.calcsize(self.pid_format)
+        fd_size = struct.calcsize('i')
+        with self._lock:
+            self._socket.sendall(b'F')
+            data, ancdata, _, _ = self._socket.recvmsg(pid_size, socket.CMSG_SPACE(fd_size))
+        if len(data) != pid_size or not ancdata:
+            raise WorkerProcessError('cannot start worker process')
+        [pid] = struct.unpack(self.pid_format, data)
+        [(_, _, fd_data)] = ancdata
+        [fd] = struct.unpack('i', fd_data[:fd_size])
+        return pid, multiprocessing.connection.Connection(fd)
+
+    def close(self):
+        if self._process is None:
+            return
+        self._socket.close()
+        self._process.join()
+        self._process = self._socket = None
+
+
+class PageProcess:
+    """
+    Proxy for a worker process that opens documents on its own.
+    """
+
+    def __init__(self, context, thread_budget, factory):
+        self._context = context
+        self._thread_budget = thread_budget
+        self._factory = factory
+        self._connection = None
+        self._pid = None
+
+    def start(self):
+        self._pid, self._connection = self._factory.fork_worker()
+
+    def _is_alive(self):
+        # Idle workers don't send anything, so the connection can become
+        # readable only if the worker exited.
+        return self._connection is not None and not self._connection.poll()
+
+    def process_page(self, page):
+        if not self._is_alive():
+            # Either this is the first page, or the previous worker died.
+            self.close()
+            self.start()
+        path, label = self._context.get_document_info(page)
+        try:
+            with self._thread_budget.reserve() as n_threads, self._context.working(page, 'worker process', pid=self._pid):
+                self._connection.send(((path, label, page.n), n_threads))
+                status, value, stats = self._connection.recv()
+        except (EOFError, OSError):
+            pid = self._pid
+            self.close()
+            raise WorkerProcessError(f'worker process {pid} died unexpectedly')
+        self._context.merge_page_stats(page, stats)
+        if status == 'unavailable':
+            raise djvu.decode.NotAvailable
+        if status == 'error':
+            message, by_user = value
+            raise WorkerProcessError(message, by_user=by_user)
+        return value
+
+    def close(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.send(None)
+        except (EOFError, OSError):
+            pass
+        self._connection.close()
+        self._pid = self._connection = None
+
+
+class DocumentJob:
+    """
+    A document to be processed, together with its pages.
+    """
 
-    def __missing__(self, key):
-        return
+    def __init__(self, path, label, saver):
+        self.path = path
+        # Label distinguishes files of this document in the temporary
+        # directory. It's None, unless in the batch mode.
+        self.label = label
+        self.saver = saver
+        self.document = None
+        self.pages = None
+        # Indices of pages in the scheduler, or None for pages replayed from
+        # the journal:
+        self.indices = None
+        self.journal = None
+        self.status = 0
 
 
 class Context(djvu.decode.Context):
 
-    def init(self, options):
+    def init(self, options, temp_dir=None, timeouts=None):
+        if temp_dir is None:
+            temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        if timeouts is None:
+            # Number of OCR engine timeouts. It's shared with worker processes
+            # (--executor=process), which inherit it when they are forked.
+            timeouts = multiprocessing.Value('i', 0)
         # noinspection PyAttributeOutsideInit
-        self._temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        self._timeouts = timeouts
+        # noinspection PyAttributeOutsideInit
+        self._temp_dir = temp_dir
         # noinspection PyAttributeOutsideInit
         self._debug = options.debug
         # noinspection PyAttributeOutsideInit
         self._options = options
-        bpp = 24 if self._options.render_layers != djvu.decode.RENDER_MASK_ONLY else 1
         # noinspection PyAttributeOutsideInit
-        self._image_format = self._options.engine.image_format(bpp)
+        self._engine = options.engine
+        if self._options.render_layers == djvu.decode.RENDER_MASK_ONLY:
+            bpp = 1
+        elif self._options.colour == 'gray':
+            bpp = 8
+        else:
+            bpp = 24
+        # noinspection PyAttributeOutsideInit
+        self._image_format = self._options.engine.image_format(bpp, band_height=self._options.render_band_height)
+        # noinspection PyAttributeOutsideInit
+        self._thread_budget = None
+        # noinspection PyAttributeOutsideInit
+        self._document_info = {}
+        # noinspection PyAttributeOutsideInit
+        self._failed_pages = set()
+        # noinspection PyAttributeOutsideInit
+        self._journals = {}
+        # noinspection PyAttributeOutsideInit
+        if options.report is not None:
+            self._report = report.Report(engine=options.engine.name, language=options.language)
+        else:
+            self._report = report.NullReport()
+        # noinspection PyAttributeOutsideInit
+        self._trace = trace.Trace() if options.trace is not None else trace.NullTrace()
+        # noinspection PyAttributeOutsideInit
+        if options.progress_file is not None:
+            self._progress = progress.Progress(options.progress_file)
+        else:
+            self._progress = progress.NullProgress()
+        # noinspection PyAttributeOutsideInit
+        self._page_start_times = {}
+        # noinspection PyAttributeOutsideInit
+        self._status = status.Status()
+        # noinspection PyAttributeOutsideInit
+        self._status_writer = None
+        # noinspection PyAttributeOutsideInit
+        self._old_sigusr1_handler = None
+        # noinspection PyAttributeOutsideInit
+        self._status_printer = None
+        # noinspection PyAttributeOutsideInit
+        self._schedule_times = {}
+
+    @property
+    def options(self):
+        return self._options
+
+    @property
+    def temp_dir(self):
+        return self._temp_dir
+
+    @property
+    def timeouts(self):
+        return self._timeouts
 
     def _temp_file(self, name, mode='w+', encoding: Union[str, None] = locale.getpreferredencoding(), auto_remove=True):
         path = os.path.join(self._temp_dir, name)
@@ -434,13 +1049,107 @@ class Context(djvu.decode.Context):
         if isinstance(message, djvu.decode.ErrorMessage):
             LOGGER.warning(message)
 
+    def open_document(self, path, label=None):
+        document = self.new_document(djvu.decode.FileURI(path))
+        document.decoding_job.wait()
+        self._document_info[document] = path, label
+        return document
+
+    def forget_document(self, document):
+        del self._document_info[document]
+        self._schedule_times.pop(document, None)
+
+    def get_document_info(self, page):
+        """
+        Return (path, label) of the document the page belongs to.
+        """
+        return self._document_info[page.document]
+
+    def _page_label(self, page):
+        _, label = self.get_document_info(page)
+        if label is None:
+            return f'{page.n:06}'
+        return f'{label}-{page.n:06}'
+
+    def _page_key(self, page):
+        path, _ = self.get_document_info(page)
+        return path, page.n + 1
+
     @contextlib.contextmanager
-    def get_output_image(self, nth, page_job):
+    def timer(self, page, stage):
+        """
+        Measure time of the stage of processing the page, for --report and
+        --trace.
+        """
+        key = self._page_key(page)
+        start = time.monotonic()
+        try:
+            with self.working(page, stage):
+                yield
+        finally:
+            end = time.monotonic()
+            self._report.add_time(key, stage, end - start)
+            path, page_number = key
+            self._trace.add_span(stage, start, end, path=path, page=page_number)
+
+    def working(self, page, stage, pid=None):
+        """
+        Record in the status that the current thread is at the stage of
+        processing the page.
+        """
+        return self._status.working(self._page_key(page), stage, pid=pid)
+
+    def _account_processes(self, page, processes, share=1.0):
+        """
+        Attribute resource usage of the subprocesses to the page.
+        """
+        rusages = [process.rusage for process in processes if process.rusage is not None]
+        self._report.add_rusage(self._page_key(page), rusages, share=share)
+
+    def pop_page_stats(self, page):
+        return self._report.pop(self._page_key(page)), self._trace.pop_events()
+
+    def merge_page_stats(self, page, stats):
+        if stats is None:
+            return
+        page_stats, trace_events = stats
+        self._report.merge(self._page_key(page), page_stats)
+        self._trace.merge_events(trace_events)
+
+    def write_output_image(self, page, page_job):
+        with self.timer(page, 'render'):
+            image = self._write_output_image(self._page_label(page), page_job)
+        if image.name is None:
+            n_bytes = len(image.data)
+        else:
+            n_bytes = image.tell()
+        self._report.add_image_bytes(self._page_key(page), n_bytes)
+        return image
+
+    def _write_output_image(self, name, page_job):
         output_format = self._image_format
-        temp_file = self._temp_file(f'{nth:06}.{output_format.extension}', mode='wb', encoding=None)
+        if output_format.in_memory:
+            # The engine takes the pixel data directly.
+            return output_format.render_image(page_job, self._options.render_layers)
+        if self._options.engine.uses_pipes() and not self._options.debug:
+            # The engine reads the image from its standard input.
+            # Piped images are kept in memory whole, so large ones are
+            # rendered band by band into a file instead.
+            if output_format.get_data_size(page_job.size) <= MAX_PIPED_IMAGE_SIZE:
+                return output_format.encode_image(page_job, self._options.render_layers)
+        temp_file = self._temp_file(f'{name}.{output_format.extension}', mode='wb', encoding=None)
         try:
             output_format.write_image(page_job, self._options.render_layers, temp_file)
             temp_file.flush()
+        except BaseException:
+            temp_file.close()
+            raise
+        return temp_file
+
+    @contextlib.contextmanager
+    def get_output_image(self, page, page_job):
+        temp_file = self.write_output_image(page, page_job)
+        try:
             yield temp_file
         finally:
             temp_file.close()
@@ -452,27 +1161,176 @@ class Context(djvu.decode.Context):
         template = self._options.raw_ocr_filename_template
         page_id = page.file.id
         page_number = page.n + 1
+        djvu_path, _ = self.get_document_info(page)
         prefix = os.path.join(
             output_dir,
-            expand_template(template, pageno=page_number, pageid=page_id),
+            expand_template(template, pageno=page_number, pageid=page_id, djvu_path=djvu_path),
         )
         result.save(prefix)
 
-    def process_page(self, page):
+    def estimate_page_cost(self, page):
+        """
+        Estimate relative cost of processing the page, without decoding it.
+        """
+        try:
+            info = page.get_info(wait=True)
+            return info.width * info.height
+        except (djvu.decode.NotAvailable, djvu.decode.JobFailed):
+            pass
+        try:
+            # Size of the component file is a poor man's substitute.
+            return max(page.file.size, 0)
+        except (djvu.decode.NotAvailable, djvu.decode.JobFailed):
+            return 0
+
+    def decode_page(self, page):
         LOGGER.info(f'- Page #{page.n + 1}')
-        page_job = page.decode(wait=True)
+        with self.timer(page, 'decode'):
+            page_job = page.decode(wait=True)
         # Because of a bug in python-djvulibre <= 0.3.9, sometimes the exception is not raised.
         # Raise in manually in such case.
         if issubclass(page_job.status, djvu.decode.JobFailed):
             raise page_job.status
-        size = page_job.size
-        with self.get_output_image(page.n, page_job) as pfile:
-            result = self._engine.recognize(
-                pfile, language=self._options.language, details=self._options.details, uax29=self._options.uax29
-            )
-            if self._debug:
-                result.save(os.path.join(self._temp_dir, f'{page.n:06}'))
-            self.save_raw_ocr(page, result)
+        return page_job
+
+    @contextlib.contextmanager
+    def _reserve_threads(self):
+        if self._thread_budget is None:
+            # Either this is a worker process, and the parent process takes
+            # care of it; or this is not a multi-page job at all.
+            yield
+            return
+        with self._thread_budget.reserve() as n_threads:
+            with ipc.local_env(OMP_THREAD_LIMIT=str(n_threads)):
+                yield
+
+    def _get_cache_key(self, image):
+        options = self._options
+        return cache.make_key(
+            image.digest() if image.name is None else utils.file_digest(image.name),
+            self._image_format.extension,
+            self._engine.name,
+            self._engine.get_version_stamp(),
+            options.language,
+            '\0'.join(sorted(options.properties)),
+            str(options.details),
+            str(options.uax29),
+        )
+
+    def _cache_lookup(self, image):
+        """
+        Return (key, result) pair; result is None on cache miss.
+        """
+        ocr_cache = self._options.cache
+        if ocr_cache is None:
+            return None, None
+        key = self._get_cache_key(image)
+        data = ocr_cache.get(key)
+        if data is None:
+            return key, None
+        # See _cache_store() for the format.
+        try:
+            header, contents = data.split(b'\n', 1)
+            format_, encoding = header.decode('UTF-8').split(' ')
+            if encoding != 'binary':
+                contents = contents.decode(encoding)
+        except (ValueError, LookupError):
+            ocr_cache.discard(key)
+            return key, None
+        return key, engines_common.Output(contents, format_=format_)
+
+    def _cache_store(self, key, result):
+        if key is None:
+            return
+        contents = result.contents
+        if isinstance(contents, str):
+            encoding = 'UTF-8'
+            contents = contents.encode(encoding)
+        else:
+            encoding = 'binary'
+        self._options.cache.put(key, f'{result.format} {encoding}\n'.encode('UTF-8') + contents)
+
+    def _save_recognized(self, page, result):
+        if self._debug:
+            result.save(os.path.join(self._temp_dir, self._page_label(page)))
+        self.save_raw_ocr(page, result)
+
+    def _count_timeout(self):
+        with self._timeouts.get_lock():
+            self._timeouts.value += 1
+
+    def _run_engine(self, n_pages, function, *args, **kwargs):
+        """
+        Call the engine function for n_pages pages, enforcing --page-timeout
+        and --retries.
+        """
+        timeout = self._options.page_timeout
+        if timeout is not None:
+            timeout *= n_pages
+        n_retries = self._options.retries
+        attempt = 0
+        while True:
+            try:
+                with ipc.timeout(timeout):
+                    return function(*args, **kwargs)
+            except ipc.CalledProcessTimeout as ex:
+                self._count_timeout()
+                if attempt >= n_retries:
+                    raise
+                attempt += 1
+                LOGGER.warning(f'{ex}; retrying ({attempt}/{n_retries})')
+
+    def recognize_page(self, page, image):
+        key, result = self._cache_lookup(image)
+        if result is None:
+            with self._reserve_threads(), ipc.collect_processes() as processes:
+                try:
+                    with self.timer(page, 'ocr'):
+                        result = self._run_engine(
+                            1, self._engine.recognize,
+                            image, language=self._options.language, details=self._options.details, uax29=self._options.uax29
+                        )
+                finally:
+                    self._account_processes(page, processes)
+                    for process in processes:
+                        self._trace.add_process(process)
+            self._cache_store(key, result)
+        self._save_recognized(page, result)
+        return result
+
+    def recognize_pages(self, images):
+        """
+        Recognize multiple images at once (-X batch_size=N).
+
+        Return list of results, in which exceptions stand for images that
+        couldn't be recognized. The results are not saved yet.
+        """
+        lookups = [self._cache_lookup(image) for image in images]
+        results = [result for _, result in lookups]
+        todo = [k for k, result in enumerate(results) if result is None]
+        if todo:
+
+            def recognize(image, language, **kwargs):
+                # Images that the engine falls back to recognizing one by one
+                # get the time limit and retries of a single page.
+                return self._run_engine(1, self._engine.recognize, image, language, **kwargs)
+
+            with self._reserve_threads():
+                new_results = self._run_engine(
+                    len(todo), self._engine.recognize_batch,
+                    [images[k] for k in todo],
+                    language=self._options.language, details=self._options.details, uax29=self._options.uax29,
+                    recognize=recognize,
+                )
+            for k, result in zip(todo, new_results):
+                if not isinstance(result, Exception):
+                    key, _ = lookups[k]
+                    self._cache_store(key, result)
+                results[k] = result
+        return results
+
+    def extract_page_text(self, page, result, size):
+        with self.timer(page, 'extract'):
             [text] = self._engine.extract_text(
                 result.as_stringio() if self._engine.name != 'gocr' else result.as_bytesio(),
                 rotation=page.rotation,
@@ -482,84 +1340,329 @@ class Context(djvu.decode.Context):
                 fix_utf8=self._engine.needs_utf8_fix,
                 page_size=size
             )
-            # It should be: (page 0 0 <width> <height> …):
-            assert len(text) > 5
-            return text
-
-    def page_thread(self, pages, results, condition):
-        for page in pages:
-            n = page.n
-            with condition:
-                result = results[n]
-                if result is not None:
-                    # The page is being processed or has been already processed.
+        # It should be: (page 0 0 <width> <height> …):
+        assert len(text) > 5
+        return text
+
+    def process_page(self, page):
+        page_job = self.decode_page(page)
+        size = page_job.size
+        with self.get_output_image(page, page_job) as pfile:
+            result = self.recognize_page(page, pfile)
+            return self.extract_page_text(page, result, size)
+
+    # Stages of the pipeline (--executor=pipeline):
+
+    def _pipeline_render(self, page):
+        page_job = self.decode_page(page)
+        return page_job.size, self.write_output_image(page, page_job)
+
+    def _pipeline_recognize(self, page, size, image):
+        with image:
+            result = self.recognize_page(page, image)
+        return result, size
+
+    def _pipeline_extract(self, page, result, size):
+        return self.extract_page_text(page, result, size)
+
+    def _handle_page_exception(self, i, page, ex, scheduler):
+        """
+        Log the exception that occurred while processing the page, and
+        record it in the scheduler.
+
+        Return True if processing of other pages should continue.
+        """
+        interrupted_by_user = isinstance(ex, (ipc.CalledProcessInterrupted, WorkerProcessError)) and ex.by_user
+        if isinstance(ex, WorkerProcessError):
+            # The traceback from the worker process is more useful than ours.
+            details = str(ex)
+        else:
+            details = traceback.format_exc()
+        if self._options.batch:
+            path, _ = self.get_document_info(page)
+            message = f'Exception while processing page {(page.n + 1)} of {path}:\n{details}'
+        else:
+            message = f'Exception while processing page {(page.n + 1)}:\n{details}'
+        LOGGER.error(message.rstrip())
+        self._page_done(page, 'failed')
+        if self._options.resume_on_error and not interrupted_by_user:
+            # As requested by user, do not abort on error and pretend that nothing happened.
+            scheduler.seen_exception = True
+            self._failed_pages.add(i)
+            scheduler.set_result(i, False)
+            return True
+        else:
+            # The main thread will take care of aborting the application.
+            scheduler.set_exception(i, ex)
+            return False
+
+    def _page_done(self, page, page_status):
+        """
+        Record that processing of the page completed with the status: 'ok',
+        'no-image' or 'failed'.
+        """
+        key = self._page_key(page)
+        self._report.set_status(key, page_status)
+        self._status.page_done(failed=(page_status == 'failed'))
+        start = self._page_start_times.pop(key, None)
+        duration = None if start is None else time.monotonic() - start
+        self._progress.page_done(key, page_status, duration)
+
+    def _set_page_result(self, scheduler, i, page, result):
+        self._page_done(page, 'ok' if result is not False else 'no-image')
+        page_journal = self._journals.get(page.document)
+        if page_journal is not None:
+            if result is False:
+                text = None
+            elif isinstance(result, str):
+                text = result
+            else:
+                file = io.StringIO()
+                with self.timer(page, 'serialize'):
+                    text_zones.print_sexpr(result, file)
+                text = result = file.getvalue()
+            page_journal.add(page.n, text)
+        scheduler.set_result(i, result)
+
+    def _page_taken(self, page):
+        key = self._page_key(page)
+        now = time.monotonic()
+        self._page_start_times[key] = now
+        try:
+            scheduled = self._schedule_times[page.document]
+        except KeyError:
+            return
+        self._report.add_time(key, 'queue', now - scheduled)
+
+    def page_thread(self, scheduler, process_page):
+        while True:
+            item = scheduler.take()
+            if item is None:
+                return
+            i, page = item
+            self._page_taken(page)
+            try:
+                result = process_page(page)
+            except djvu.decode.NotAvailable:
+                LOGGER.info('No image suitable for OCR.')
+                result = False
+            except Exception as ex:
+                if self._handle_page_exception(i, page, ex, scheduler):
                     continue
-                # Mark the page as taken.
-                results[n] = True
+                else:
+                    return
+            self._set_page_result(scheduler, i, page, result)
+
+    def _process_batch(self, scheduler, batch):
+        """
+        Process a batch of pages, with a single call to the OCR engine.
+
+        Return True if processing of other pages should continue.
+        """
+        ok = True
+        ready = []
+        with contextlib.ExitStack() as stack:
+            for i, page in batch:
+                try:
+                    page_job = self.decode_page(page)
+                    image = stack.enter_context(self.get_output_image(page, page_job))
+                except djvu.decode.NotAvailable:
+                    LOGGER.info('No image suitable for OCR.')
+                    self._set_page_result(scheduler, i, page, False)
+                    continue
+                except Exception as ex:
+                    ok &= self._handle_page_exception(i, page, ex, scheduler)
+                    continue
+                ready += [(i, page, page_job.size, image)]
+            start = time.monotonic()
+            with ipc.collect_processes() as processes:
+                try:
+                    results = self.recognize_pages([image for *_, image in ready])
+                except Exception as ex:
+                    results = [ex] * len(ready)
+            end = time.monotonic()
+            for _, page, _, _ in ready:
+                # There's no way to tell which page took how long.
+                self._report.add_time(self._page_key(page), 'ocr', (end - start) / len(ready))
+                self._account_processes(page, processes, share=1 / len(ready))
+            if ready:
+                self._trace.add_span('ocr', start, end, pages=[self._page_key(page) for _, page, _, _ in ready])
+            for process in processes:
+                self._trace.add_process(process)
+        # Every page of the batch must be completed, one way or another,
+        # even if the application is going to be aborted: the writer might
+        # be waiting for any of them.
+        for (i, page, size, _), result in zip(ready, results):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                self._save_recognized(page, result)
+                text = self.extract_page_text(page, result, size)
+            except Exception as ex:
+                ok &= self._handle_page_exception(i, page, ex, scheduler)
+                continue
+            self._set_page_result(scheduler, i, page, text)
+        return ok
+
+    def batch_page_thread(self, scheduler, batch_size):
+        while True:
+            item = scheduler.take()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < batch_size:
+                # Don't wait for more pages; a smaller batch is better than
+                # an idle thread.
+                item = scheduler.take(wait=False)
+                if item is None:
+                    break
+                batch += [item]
+            for _, page in batch:
+                self._page_taken(page)
+            if not self._process_batch(scheduler, batch):
+                return
+
+    def pipeline_thread(self, stage, scheduler):
+        while True:
+            if stage.first:
+                item = scheduler.take()
+                if item is not None:
+                    self._page_taken(item[1])
+                    item += ((),)
+            else:
+                item = stage.input.get()
+            if item is None:
+                stage.thread_done()
+                return
+            i, page, args = item
             try:
-                result = self.process_page(page)
+                result = stage.function(page, *args)
             except djvu.decode.NotAvailable:
                 LOGGER.info('No image suitable for OCR.')
                 result = False
-            except (SystemExit, KeyboardInterrupt):
-                with condition:
-                    condition.notify()
-                raise
             except Exception as ex:
+                # Unlike in page_thread(), don't exit even if the application is
+                # going to be aborted: the other stages would be stuck otherwise.
+                self._handle_page_exception(i, page, ex, scheduler)
+                continue
+            if result is not False and stage.output is not None:
+                stage.output.put((i, page, result))
+            else:
+                self._set_page_result(scheduler, i, page, result)
+
+    def _start_pipeline(self, scheduler):
+        options = self._options
+        stages = [
+            PipelineStage('render', self._pipeline_render, options.render_jobs),
+            PipelineStage('ocr', self._pipeline_recognize, options.ocr_jobs),
+            PipelineStage('extract', self._pipeline_extract, options.parse_jobs),
+        ]
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.connect(next_stage)
+        return [
+            threading.Thread(target=self.pipeline_thread, args=(stage, scheduler), name=f'{stage.name}-{n}')
+            for stage in stages
+            for n in range(stage.n_threads)
+        ]
+
+    def _open_document(self, job, pages, scheduler):
+        LOGGER.info(f'Opening {job.path}:' if self._options.batch else f'Processing {job.path}:')
+        try:
+            job.document = self.open_document(job.path, job.label)
+            if pages is None:
+                job.pages = list(job.document.pages)
+            else:
+                job.pages = [job.document.pages[i - 1] for i in pages]
+            journal_path = None
+            if self._options.resume:
+                journal_path = job.saver.get_journal_path(job.path)
+            if journal_path is not None:
                 try:
-                    interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
-                    message = f'Exception while processing page {(n + 1)}:\n{traceback.format_exc()}'
-                    LOGGER.error(message.rstrip())
-                    if self._options.resume_on_error and not interrupted_by_user:
-                        # As requested by user, do not abort on error and pretend that nothing happened.
-                        results[n] = False
-                        results.seen_exception = True
-                        continue
-                    else:
-                        # The main thread will take care of aborting the application.
-                        results[n] = ex
-                        return
-                finally:
-                    with condition:
-                        condition.notify()
-            with condition:
-                assert results[n] is True
-                results[n] = result
-                condition.notify()
-
-    def _process(self, path, pages=None):
-        self._engine = self._options.engine
-        LOGGER.info(f'Processing {path}:')
-        document = self.new_document(djvu.decode.FileURI(path))
-        document.decoding_job.wait()
-        if pages is None:
-            pages = list(document.pages)
-        else:
-            pages = [document.pages[i - 1] for i in pages]
-        results = Results()
-        njobs = self._options.n_jobs
-        thread_limit = utils.get_thread_limit(len(pages), njobs)
-        os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
-        condition = threading.Condition()
-        threads = [
-            threading.Thread(target=self.page_thread, args=(pages, results, condition))
-            for _ in range(njobs)
+                    job.journal = journal.Journal(journal_path, self._get_journal_key(job.path), resume=True)
+                except OSError as ex:
+                    # The journal is only a safety net; carry on without it.
+                    LOGGER.warning(f'warning: cannot create journal {journal_path!r}: {ex.strerror}')
+            scheduled_pages = [page for page in job.pages if job.journal is None or page.n not in job.journal.pages]
+            n_replayed = len(job.pages) - len(scheduled_pages)
+            if n_replayed:
+                LOGGER.info(f'Reusing {n_replayed} page(s) recorded in {journal_path}.')
+            costs = None
+            if self._options.schedule == 'cost':
+                costs = [self.estimate_page_cost(page) for page in scheduled_pages]
+        except Exception:
+            if not self._options.batch:
+                raise
+            LOGGER.error(f'Cannot open {job.path}:\n{traceback.format_exc()}'.rstrip())
+            if job.journal is not None:
+                job.journal.close()
+            job.document = job.pages = job.journal = None
+            job.status = errors.EXIT_FATAL
+            return
+        if job.journal is not None:
+            self._journals[job.document] = job.journal
+        self._thread_budget.add_pages(len(scheduled_pages))
+        if self._options.progress_file is not None:
+            # The ETA is estimated from page costs, even if they don't affect the scheduling.
+            progress_costs = costs
+            if progress_costs is None:
+                progress_costs = [self.estimate_page_cost(page) for page in scheduled_pages]
+            self._progress.add_pages([self._page_key(page) for page in scheduled_pages], costs=progress_costs)
+        self._schedule_times[job.document] = time.monotonic()
+        offset = scheduler.add_pages(scheduled_pages, costs=costs)
+        scheduled_indices = iter(range(offset, offset + len(scheduled_pages)))
+        job.indices = [
+            next(scheduled_indices) if job.journal is None or page.n not in job.journal.pages else None
+            for page in job.pages
         ]
 
-        def stop_threads():
-            with condition:
-                for page_ in pages:
-                    # Worker threads should not bother with processing other pages.
-                    # Mark them as already taken.
-                    results[page_.n] = True
+    def _get_journal_key(self, djvu_path):
+        options = self._options
+        settings = dict(
+            engine=self._engine.name,
+            properties=sorted(options.properties),
+            language=options.language,
+            details=str(options.details),
+            render_layers=str(options.render_layers),
+            uax29=options.uax29,
+            html5=options.html5,
+        )
+        if options.render_layers != djvu.decode.RENDER_MASK_ONLY:
+            settings.update(colour=options.colour)
+        return journal.make_key(djvu_path, settings)
 
-        for thread in threads:
-            thread.start()
-        sed_file = self._temp_file('ocrodjvu.djvused', auto_remove=False)
+    def _close_journal(self, job, success):
+        if job.journal is None:
+            return
+        self._journals.pop(job.document, None)
+        if success:
+            try:
+                job.journal.remove()
+            except OSError as ex:
+                LOGGER.warning(f'warning: cannot remove journal {job.journal.path!r}: {ex.strerror}')
+        else:
+            job.journal.close()
+            LOGGER.info(f'Recognized pages were recorded in {job.journal.path}; use --resume again to reuse them.')
+        job.journal = None
+
+    def _write_document(self, job, scheduler, threads):
+        """
+        Write results for pages of the document, as they become available,
+        and save them.
+
+        Return the exit status for the document.
+        """
+        if job.pages is None:
+            return job.status
+        batch = self._options.batch
+        if batch:
+            LOGGER.info(f'Processing {job.path}:')
+        indices = [i for i in job.indices if i is not None]
+        failed = False
+        sed_file = self._temp_file(f'{job.label or "ocrodjvu"}.djvused', auto_remove=False)
         try:
             if self._options.clear_text:
                 sed_file.write('remove-txt\n')
-            for page in pages:
+            for i, page in zip(job.indices, job.pages):
                 try:
                     file_id = page.file.id
                 except UnicodeError:
@@ -571,48 +1674,222 @@ class Context(djvu.decode.Context):
                         fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
                     ))
                 sed_file.write('set-txt\n')
-                result = None  # noqa: F841
-                with condition:
-                    while True:
-                        result = results[page.n]
-                        if result is None or result is True:
-                            # Result is not yet available.
-                            condition.wait()
-                            continue
-                        results[page.n] = Ellipsis  # no longer needed
-                        if isinstance(result, Exception):
-                            stop_threads()
-                        break
-                if isinstance(result, Exception):
-                    if len(threads) > 1:
-                        LOGGER.info('Waiting for other threads to finish...')
-                    for thread in threads:
-                        thread.join()
-                    self._debug = True
-                    sys.exit(errors.EXIT_FATAL)
-                if result is False:
-                    # No image suitable for OCR.
+                if i is None:
+                    # Recognized by a previous run.
+                    text = job.journal.pages[page.n]
+                    if text is not None:
+                        sed_file.write(text)
+                    sed_file.write('\n.\n\n')
+                    continue
+                with self.timer(page, 'write_wait'):
+                    future = scheduler.wait(i)
+                if failed:
+                    # Remaining pages of the document are of no use; their
+                    # results are discarded as soon as they are available.
                     pass
+                elif future.exception() is not None:
+                    if not batch:
+                        scheduler.stop()
+                        self._close_journal(job, success=False)
+                        if len(threads) > 1:
+                            LOGGER.info('Waiting for other threads to finish...')
+                        for thread in threads:
+                            thread.join()
+                        self._debug = True
+                        sys.exit(errors.EXIT_FATAL)
+                    # In the batch mode, only give up on this document.
+                    failed = True
+                    scheduler.cancel(indices)
                 else:
-                    text_zones.print_sexpr(result, sed_file)
-                result = None  # no longer needed  # noqa: F841
+                    result = future.result()
+                    if result is False:
+                        # No image suitable for OCR.
+                        pass
+                    else:
+                        with self.timer(page, 'serialize'):
+                            if isinstance(result, str):
+                                # Already serialized by a worker process.
+                                sed_file.write(result)
+                            else:
+                                text_zones.print_sexpr(result, sed_file)
+                    result = None  # no longer needed  # noqa: F841
+                future = None  # noqa: F841
+                scheduler.release(i)
                 sed_file.write('\n.\n\n')
             sed_file.flush()
-            saver = self._options.saver
+            if failed:
+                LOGGER.error(f'Results for {job.path} were not saved.')
+                self._close_journal(job, success=False)
+                self._debug = True
+                return errors.EXIT_FATAL
+            document = job.document
+            saver = job.saver
             if saver.in_place:
                 document = None
             pages_to_save = None
             if self._options.ocr_only:
-                pages_to_save = [page.n for page in pages]
-            self._options.saver.save(document, pages_to_save, path, sed_file)
+                pages_to_save = [page.n for page in job.pages]
+            start = time.monotonic()
+            with ipc.collect_processes() as processes:
+                saver.save(document, pages_to_save, job.path, sed_file)
+            end = time.monotonic()
+            self._report.add_document(job.path, end - start, [process.rusage for process in processes if process.rusage is not None])
+            self._trace.add_span('save', start, end, path=job.path)
+            for process in processes:
+                self._trace.add_process(process)
             document = None  # noqa: F841
         except Exception:
-            stop_threads()
-            raise
+            self._close_journal(job, success=False)
+            if not batch:
+                raise
+            LOGGER.error(f'Cannot save results for {job.path}:\n{traceback.format_exc()}'.rstrip())
+            self._debug = True
+            return errors.EXIT_FATAL
         finally:
             sed_file.close()
-        if results.seen_exception:
-            sys.exit(errors.EXIT_NONFATAL)
+        if not self._failed_pages.isdisjoint(indices):
+            # Keep the journal, so that only the failed pages are recognized
+            # again with --resume.
+            self._close_journal(job, success=False)
+            return errors.EXIT_NONFATAL
+        self._close_journal(job, success=True)
+        return 0
+
+    def _process(self, paths, pages=None):
+        batch = self._options.batch
+        scheduler = scheduling.PageScheduler(max_buffered=self._options.max_buffered_pages, closed=False)
+        self._status.set_scheduler(scheduler)
+        executor = self._options.executor
+        if executor == 'pipeline':
+            njobs = self._options.ocr_jobs
+        else:
+            njobs = self._options.n_jobs
+        # noinspection PyAttributeOutsideInit
+        self._thread_budget = scheduling.ThreadBudget(utils.get_cpu_count(), njobs, 0)
+        jobs = []
+        for n, path in enumerate(paths):
+            if batch:
+                job = DocumentJob(path, f'{n:04}', self._options.saver.for_document(path))
+            else:
+                job = DocumentJob(path, None, self._options.saver)
+            jobs += [job]
+        factory = None
+        workers = []
+        threads = []
+        try:
+            if executor == 'process':
+                # Fork before starting any threads.
+                factory = WorkerFactory(self)
+                factory.start()
+                workers = [PageProcess(self, self._thread_budget, factory) for _ in range(njobs)]
+                for worker in workers:
+                    worker.start()
+            self._start_status_reporting()
+            self._open_document(jobs[0], pages, scheduler)
+            if executor == 'pipeline':
+                threads = self._start_pipeline(scheduler)
+            else:
+                batch_size = getattr(self._engine, 'batch_size', None) or 1
+                if workers:
+                    page_functions = [worker.process_page for worker in workers]
+                else:
+                    page_functions = [self.process_page] * njobs
+                if batch_size > 1 and not workers:
+                    threads = [
+                        threading.Thread(target=self.batch_page_thread, args=(scheduler, batch_size), name=f'worker-{n}')
+                        for n in range(njobs)
+                    ]
+                else:
+                    threads = [
+                        threading.Thread(target=self.page_thread, args=(scheduler, process_page), name=f'worker-{n}')
+                        for n, process_page in enumerate(page_functions)
+                    ]
+            for thread in threads:
+                thread.start()
+            status = 0
+            failed_jobs = []
+            for n, job in enumerate(jobs):
+                # Pages of the next document are queued while results for the
+                # current one are being written, so that workers don't idle.
+                if n + 1 < len(jobs):
+                    self._open_document(jobs[n + 1], pages, scheduler)
+                else:
+                    scheduler.close()
+                job.status = self._write_document(job, scheduler, threads)
+                if job.status:
+                    failed_jobs += [job]
+                status = max(status, job.status)
+                if job.document is not None:
+                    self.forget_document(job.document)
+                job.document = job.pages = None
+            for thread in threads:
+                thread.join()
+            for worker in workers:
+                worker.close()
+            if factory is not None:
+                factory.close()
+            if batch and failed_jobs:
+                self._log_failed_documents(failed_jobs, len(jobs))
+            if scheduler.hol_wait_time >= 1:
+                LOGGER.info(f'Writing results was blocked by slow pages for {scheduler.hol_wait_time:.1f} s.')
+            if self._options.cache is not None:
+                ocr_cache = self._options.cache
+                LOGGER.info(f'OCR cache: {ocr_cache.hits} hit(s), {ocr_cache.misses} miss(es).')
+            if self._timeouts.value:
+                LOGGER.info(f'OCR engine timed out {self._timeouts.value} time(s).')
+        except BaseException as ex:
+            scheduler.stop()
+            if isinstance(ex, KeyboardInterrupt):
+                # Engines with a time limit run in their own process groups,
+                # so Ctrl+C didn't reach them.
+                ipc.kill_watched()
+            for job in jobs:
+                self._close_journal(job, success=False)
+            raise
+        if status:
+            sys.exit(status)
+
+    @staticmethod
+    def _log_failed_documents(failed_jobs, n_jobs):
+        lines = [f'Processing of {len(failed_jobs)} of {n_jobs} documents failed:']
+        for job in failed_jobs:
+            if job.status == errors.EXIT_NONFATAL:
+                lines += [f'- {job.path}: some pages were not recognized']
+            else:
+                lines += [f'- {job.path}: results were not saved']
+        LOGGER.error(str.join('\n', lines))
+
+    def _print_status(self, signal_id, frame):
+        # Formatting the status takes locks, which the interrupted code might
+        # hold; so leave it to the printer thread.
+        self._status_printer.request()
+
+    def _start_status_reporting(self):
+        """
+        Print the status on SIGUSR1, and write it to --status-file.
+        """
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            # Signal handlers can be only set in the main thread.
+            self._status_printer = status.StatusPrinter(self._status, sys.stderr)
+            self._status_printer.start()
+            self._old_sigusr1_handler = signal.signal(signal.SIGUSR1, self._print_status)
+        if self._options.status_file is not None:
+            self._status_writer = status.StatusWriter(self._status, self._options.status_file, STATUS_INTERVAL)
+            self._status_writer.start()
+
+    def _stop_status_reporting(self):
+        if self._old_sigusr1_handler is not None:
+            signal.signal(signal.SIGUSR1, self._old_sigusr1_handler)
+            self._old_sigusr1_handler = None
+        if self._status_printer is not None:
+            self._status_printer.stop()
+            self._status_printer = None
+        if self._status_writer is not None:
+            try:
+                self._status_writer.stop()
+            except OSError as ex:
+                LOGGER.error(f'Cannot write status to {ex.filename!r}: {ex.strerror}')
+            self._status_writer = None
 
     def process(self, *args, **kwargs):
         try:
@@ -621,6 +1898,20 @@ class Context(djvu.decode.Context):
             # The djvused script can be valuable and should not be lost in case of crash.
             self._debug = True
             raise
+        finally:
+            self._stop_status_reporting()
+            # Statistics of an unsuccessful run are no less interesting.
+            self._write_stats(self._report, self._options.report, 'report')
+            self._write_stats(self._trace, self._options.trace, 'trace')
+
+    @staticmethod
+    def _write_stats(stats, path, description):
+        if path is None:
+            return
+        try:
+            stats.write(path)
+        except OSError as ex:
+            LOGGER.error(f'Cannot write {description} to {ex.filename!r}: {ex.strerror}')
 
     def close(self):
         if self._debug:
@@ -635,7 +1926,7 @@ def main(argv=None):
     context = Context()
     context.init(options)
     try:
-        context.process(options.path, options.pages)
+        context.process(options.paths, options.pages)
     except KeyboardInterrupt:
         LOGGER.info('Interrupted by user.')
         sys.exit(errors.EXIT_FATAL)
@@ -13,9 +13,32 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import importlib
 import pkgutil
 
 
+def get_engine(name):
+    """
+    Return engine class with the name, or None if there's no such engine.
+
+    Only the module that can contain the engine is imported.
+    """
+    module_name = name.lstrip('_').replace('-', '_')
+    if not module_name.isidentifier():
+        return None
+    full_module_name = f'{__name__}.{module_name}'
+    try:
+        module = importlib.import_module(full_module_name)
+    except ModuleNotFoundError as ex:
+        if ex.name == full_module_name:
+            return None
+        raise
+    engine = getattr(module, 'Engine', None)
+    if engine is None or engine.name != name:
+        return None
+    return engine
+
+
 def get_engines():
     for importer, name, is_pkg in pkgutil.iter_modules(__path__):
         this_module = __import__('', globals=globals(), fromlist=(name,), level=1)
@@ -14,6 +14,11 @@
 # for more details.
 
 import io
+import json
+import os
+import shutil
+import tempfile
+import threading
 
 from ocrodjvu import utils
 from ocrodjvu import image_io
@@ -43,6 +48,126 @@ class Engine:
                 raise
             setattr(self, key, value)
 
+    def uses_pipes(self):
+        """
+        Return whether the engine can read images from its standard input.
+
+        If so, images passed to recognize() may be image_io.EncodedImage
+        objects, which have no file name, rather than files.
+        """
+        return False
+
+    def recognize_batch(self, images, language, recognize=None, **kwargs):
+        """
+        Recognize multiple images.
+
+        Images that are recognized one at a time are passed to
+        recognize(image, language, **kwargs), which defaults to
+        self.recognize().
+
+        Return list of results, in which exceptions stand for images that
+        couldn't be recognized.
+        """
+        if recognize is None:
+            recognize = self.recognize
+        results = []
+        for image in images:
+            try:
+                results += [recognize(image, language, **kwargs)]
+            except Exception as ex:
+                results += [ex]
+        return results
+
+    def get_version_stamp(self):
+        """
+        Return a string that changes whenever the engine executable is
+        replaced, e.g. upgraded.
+        """
+        executable = getattr(self, 'executable', None)
+        if executable is None:
+            return ''
+        return get_executable_stamp(executable) or executable
+
+
+def get_executable_stamp(executable):
+    """
+    Return a string that identifies the executable: its real path, size and
+    modification time. Return None if the executable is not found.
+    """
+    path = shutil.which(executable)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f'{path}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class ProbeCache:
+    """
+    Persistent cache of results of probing OCR engines.
+
+    There is at most one entry per engine. An entry is valid only as long as
+    its stamp (which normally identifies the engine executable) doesn't
+    change. The cache is only an optimization, so I/O errors are ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_default_path(cls):
+        cache_home = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'ocrodjvu', 'engines.json')
+
+    def _read(self):
+        try:
+            with open(self.path, 'rt', encoding='UTF-8') as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def get(self, name, stamp):
+        """
+        Return data stored for the engine, or None.
+        """
+        entry = self._read().get(name)
+        if not isinstance(entry, dict) or entry.get('stamp') != stamp:
+            return None
+        return entry.get('data')
+
+    def put(self, name, stamp, data):
+        """
+        Store data for the engine.
+
+        data must be JSON-serializable.
+        """
+        with self._lock:
+            entries = self._read()
+            entries[name] = dict(stamp=stamp, data=data)
+            directory = os.path.dirname(self.path)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix='.', dir=directory)
+                try:
+                    with os.fdopen(fd, 'wt', encoding='UTF-8') as file:
+                        json.dump(entries, file, indent=1, sort_keys=True)
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            except OSError:
+                pass
+
+
+probe_cache = ProbeCache(ProbeCache.get_default_path())
+
 
 class Output:
     format = None
@@ -54,6 +179,10 @@ class Output:
         if self.format is None:
             raise TypeError('output format is not defined')
 
+    @property
+    def contents(self):
+        return self._contents
+
     def __str__(self):
         return self._contents
 
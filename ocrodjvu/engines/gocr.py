@@ -114,6 +114,7 @@ class Engine(common.Engine):
 
     executable = utils.Property('gocr')
     extra_args = utils.Property([], shlex.split)
+    pipes = utils.Property(1, int)
 
     def __init__(self, *args, **kwargs):
         common.Engine.__init__(self, *args, **kwargs)
@@ -148,14 +149,23 @@ class Engine(common.Engine):
     def list_languages(self):
         yield self.default_language
 
+    def uses_pipes(self):
+        return bool(self.pipes)
+
     def recognize(self, image, language, details=None, uax29=None):
+        # "-" as the input file means standard input:
+        piped = image.name is None
         with ipc.Subprocess(
-                [self.executable, '-i', image.name, '-f', 'XML'] + self.extra_args,
-                stdin=ipc.DEVNULL,
+                [self.executable, '-i', image.name or '-', '-f', 'XML'] + self.extra_args,
+                stdin=ipc.PIPE if piped else ipc.DEVNULL,
                 stdout=ipc.PIPE,
         ) as worker:
+            writer = worker.feed(image.data) if piped else None
+            contents = worker.stdout.read()
+            if writer is not None:
+                writer.join()
             return common.Output(
-                worker.stdout.read(),
+                contents,
                 format_='gocr.xml',
             )
 
@@ -113,6 +113,7 @@ class Engine(common.Engine):
     executable = utils.Property('ocrad')
     extra_args = utils.Property([], shlex.split)
     replacement_character = utils.Property('\N{REPLACEMENT CHARACTER}', utils.str_as_unicode)
+    pipes = utils.Property(1, int)
 
     def __init__(self, *args, **kwargs):
         common.Engine.__init__(self, **kwargs)
@@ -156,18 +157,27 @@ class Engine(common.Engine):
     def list_languages(self):
         return iter(self._languages)
 
+    def uses_pipes(self):
+        return bool(self.pipes)
+
     def recognize(self, image, language, details=None, uax29=None):
         charset = 'iso-8859-15'
         if language == 'tur':
             charset = 'iso-8859-9'
+        # "-" as the input file means standard input:
+        piped = image.name is None
         with ipc.Subprocess(
-                [self.executable, '--charset', charset, '--format=utf8', '-x'] + self.extra_args + ['-', image.name],
-                stdin=ipc.DEVNULL,
+                [self.executable, '--charset', charset, '--format=utf8', '-x'] + self.extra_args + ['-', image.name or '-'],
+                stdin=ipc.PIPE if piped else ipc.DEVNULL,
                 stdout=ipc.PIPE,
         ) as worker:
+            writer = worker.feed(image.data) if piped else None
             stdout = codecs.getreader(sys.stdout.encoding or locale.getpreferredencoding())(worker.stdout)
+            contents = stdout.read()
+            if writer is not None:
+                writer.join()
             return common.Output(
-                stdout.read(),
+                contents,
                 format_='orf',
             )
 
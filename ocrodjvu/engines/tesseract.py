@@ -14,6 +14,7 @@
 # for more details.
 
 import codecs
+import concurrent.futures
 import glob
 import html
 import locale
@@ -21,6 +22,7 @@ import os
 import re
 import shlex
 import sys
+import threading
 import warnings
 
 from ocrodjvu.engines import common
@@ -41,6 +43,10 @@ _ERROR_PATTERN = re.compile(
     re.MULTILINE
 )
 
+_VERSION_PATTERN = re.compile(r'^tesseract\s+v?([0-9]+)[.]([0-9]+)', re.MULTILINE)
+_PAGE_NUMBER_PATTERN = re.compile('^Page [0-9]+$')
+_HOCR_PAGE_PATTERN = re.compile(r'<div\s+class=[\'"]ocr_page[\'"]')
+
 _BBOX_EXTRAS_TEMPLATE = '''\
 <!-- The following script was appended to hOCR by ocrodjvu for internal purposes. -->
 <script type='application/x-ocrodjvu-tesseract'>
@@ -57,14 +63,27 @@ def _filter_boring_stderr(stderr):
     if stderr[0].startswith('Tesseract Open Source OCR Engine'):
         # Tesseract prints its own name on standard error even if nothing went wrong.
         del stderr[0]
-    if stderr and stderr[0] == 'Page 1':
-        # We also don't want page numbers, because we always pass just a single page to Tesseract.
-        del stderr[0]
+    # We also don't want page numbers.
+    stderr[:] = [line for line in stderr if not _PAGE_NUMBER_PATTERN.match(line)]
+
+
+def _read_in_thread(file):
+    """
+    Read the file to the end in a separate thread.
+
+    Return the thread; the data is stored in its result attribute.
+    """
+    def read():
+        thread.result = file.read()
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    return thread
 
 
-def _wait_for_worker(worker):
-    stderr = codecs.getreader(sys.stderr.encoding or locale.getpreferredencoding())(worker.stderr)
-    stderr = stderr.read().splitlines()
+def _wait_for_worker(worker, stderr=None):
+    if stderr is None:
+        stderr = worker.stderr.read()
+    stderr = codecs.decode(stderr, sys.stderr.encoding or locale.getpreferredencoding()).splitlines()
 
     def print_errors():
         for line in stderr:
@@ -79,6 +98,67 @@ def _wait_for_worker(worker):
     print_errors()
 
 
+def _get_image_path(image, directory, name):
+    """
+    Return path to the image file.
+
+    Images kept only in memory are first written to the directory.
+    """
+    if image.name is not None:
+        return image.name
+    path = os.path.join(directory, f'{name}.{image.extension}')
+    with open(path, 'wb') as file:
+        file.write(image.data)
+    return path
+
+
+def parse_version(s):
+    """
+    Parse Tesseract version string, such as "tesseract 4.1.1".
+
+    Return (major, minor) tuple, or None.
+    """
+    match = _VERSION_PATTERN.search(s)
+    if match is None:
+        return None
+    return tuple(map(int, match.groups()))
+
+
+def split_hocr(contents):
+    """
+    Split multi-page hOCR document into single-page documents.
+    """
+    starts = [match.start() for match in _HOCR_PAGE_PATTERN.finditer(contents)]
+    end = contents.rfind('</body>')
+    if not starts or end < starts[-1]:
+        raise errors.MalformedHocrError('cannot split into pages')
+    header = contents[:starts[0]]
+    footer = contents[end:]
+    return [
+        header + contents[start:next_start] + footer
+        for start, next_start in zip(starts, starts[1:] + [end])
+    ]
+
+
+def split_tsv(contents):
+    """
+    Split multi-page TSV output into single-page documents.
+    """
+    lines = contents.splitlines(keepends=True)
+    header = []
+    if lines and lines[0].startswith('level\t'):
+        header = lines[:1]
+        del lines[0]
+    pages = []
+    for line in lines:
+        if line.startswith('1\t'):
+            pages += [header[:]]
+        elif not pages:
+            raise errors.MalformedOcrOutputError('cannot split into pages')
+        pages[-1] += [line]
+    return [str.join('', page) for page in pages]
+
+
 def fix_html(s):
     """
     Work around buggy hOCR output:
@@ -119,13 +199,16 @@ class Engine(common.Engine):
     extra_args = utils.Property([], shlex.split)
     use_hocr = utils.Property(None, int)
     fix_html = utils.Property(0, int)
+    use_tsv = utils.Property(0, int)
+    batch_size = utils.Property(1, int)
+    pipes = utils.Property(1, int)
 
     def __init__(self, *args, **kwargs):
         common.Engine.__init__(self, **kwargs)
-        try:
-            self._directory, self._extension = self.get_filesystem_info()
-        except errors.UnknownLanguageListError:
-            raise errors.EngineNotFoundError(self.name)
+        probe = self._get_probe()
+        self._directory = probe['directory']
+        self._extension = probe['extension']
+        self._version_info = tuple(probe['version'] or ()) or None
         if self.use_hocr is None:
             self.use_hocr = self._extension == 'traineddata'
         if self.use_hocr:
@@ -134,8 +217,118 @@ class Engine(common.Engine):
             self._hocr = hocr
         else:
             self._hocr = None
+        if self.use_tsv and self._hocr is not None:
+            # TSV output is available only in Tesseract versions that can
+            # produce hOCR, which is used anyway for character details.
+            from ocrodjvu import tsv
+            self._tsv = tsv
+        else:
+            self._tsv = None
         self._user_to_tesseract = None  # To be defined later.
-        self._languages = list(self._get_languages())
+        self._languages = list(self._get_languages(probe['languages']))
+
+    def _get_probe_stamp(self):
+        """
+        Return stamp for the probe cache, or None if probe results shouldn't
+        be cached.
+        """
+        stamp = common.get_executable_stamp(self.executable)
+        if stamp is None:
+            return None
+        # Location of language data can be overridden in the environment:
+        return [stamp, os.getenv('TESSDATA_PREFIX')]
+
+    def _get_probe(self):
+        """
+        Return information about Tesseract installation, from the probe cache
+        if possible.
+        """
+        stamp = self._get_probe_stamp()
+        if stamp is not None:
+            probe = common.probe_cache.get(self.name, stamp)
+            if probe is not None and self._is_probe_fresh(probe):
+                return probe
+        try:
+            probe = self._probe()
+        except errors.UnknownLanguageListError:
+            raise errors.EngineNotFoundError(self.name)
+        if stamp is not None:
+            common.probe_cache.put(self.name, stamp, probe)
+        return probe
+
+    @staticmethod
+    def _is_probe_fresh(probe):
+        # Installing or removing language packs changes modification time
+        # of the directory.
+        try:
+            return os.stat(probe['directory']).st_mtime_ns == probe['mtime']
+        except (OSError, LookupError, TypeError):
+            return False
+
+    def _probe(self):
+        """
+        Probe Tesseract installation.
+
+        Return JSON-serializable dictionary with the language data directory
+        and file extension, list of language data files, and version.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            # Both probes run a Tesseract process, so let them run in parallel.
+            version = executor.submit(self._probe_version)
+            directory, extension = self.get_filesystem_info()
+            version = version.result()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        languages = sorted(
+            os.path.splitext(os.path.basename(filename))[0]
+            for filename in glob.iglob(os.path.join(directory, f'*.{extension}'))
+        )
+        return dict(
+            directory=directory,
+            extension=extension,
+            mtime=mtime,
+            languages=languages,
+            version=version,
+        )
+
+    def _probe_version(self):
+        try:
+            with ipc.Subprocess(
+                    [self.executable, '--version'],
+                    stdin=ipc.DEVNULL,
+                    stdout=ipc.PIPE,
+                    stderr=ipc.STDOUT,
+            ) as tesseract:
+                # Tesseract < 4 prints version on stderr, newer versions print it on stdout.
+                version = parse_version(tesseract.stdout.read().decode('UTF-8', 'replace'))
+                tesseract.wait()
+        except (OSError, ipc.CalledProcessError):
+            return None
+        return version
+
+    def get_version(self):
+        """
+        Return Tesseract version as a (major, minor) tuple, or None if unknown.
+        """
+        return self._version_info
+
+    def has_hocr_char_boxes(self):
+        """
+        Return whether Tesseract can put bounding boxes of characters into hOCR.
+        """
+        version = self.get_version()
+        return version is not None and version >= (4, 0)
+
+    def uses_pipes(self):
+        # Reading images from stdin and writing output to stdout is supported
+        # since Tesseract 3.03. With plain text output, or when recognizing
+        # multiple pages at once, Tesseract needs files anyway.
+        if not self.pipes or self._hocr is None or self.batch_size > 1:
+            return False
+        version = self.get_version()
+        return version is not None and version >= (3, 3)
 
     def get_filesystem_info(self):
         try:
@@ -175,12 +368,9 @@ class Engine(common.Engine):
     def list_languages(self):
         return iter(self._languages)
 
-    def _get_languages(self):
+    def _get_languages(self, codes):
         self._user_to_tesseract = {}
-        wildcard = f'*.{self._extension}'
-        for filename in glob.iglob(os.path.join(self._directory, wildcard)):
-            filename = os.path.basename(filename)
-            code = os.path.splitext(filename)[0]
+        for code in codes:
             if code == 'osd':
                 continue
             try:
@@ -217,8 +407,9 @@ class Engine(common.Engine):
     def recognize_plain_text(self, image, language, details=None, uax29=None):
         language = self.user_to_tesseract(language)
         with temporary.directory() as output_dir:
+            image_path = _get_image_path(image, output_dir, 'image')
             with ipc.Subprocess(
-                    [self.executable, image.name, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args,
+                    [self.executable, image_path, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args,
                     stdin=ipc.DEVNULL,
                     stdout=ipc.DEVNULL,
                     stderr=ipc.PIPE,
@@ -230,20 +421,75 @@ class Engine(common.Engine):
                     format_='txt',
                 )
 
-    def recognize_hocr(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
+    def _run_pipe(self, image, language, config):
+        """
+        Run Tesseract on the image kept in memory, feeding it through standard
+        input; set the config variables on the command line.
+
+        Return contents of standard output.
+        """
+        commandline = [self.executable, 'stdin', 'stdout', '-l', language]
+        for line in config:
+            commandline += ['-c', line.replace(' ', '=', 1)]
+        commandline += self.extra_args
+        with ipc.Subprocess(
+                commandline,
+                stdin=ipc.PIPE,
+                stdout=ipc.PIPE,
+                stderr=ipc.PIPE,
+        ) as worker:
+            writer = worker.feed(image.data)
+            # Standard error must be drained at the same time as standard
+            # output; otherwise, Tesseract would block once the pipe buffer
+            # fills up with warnings.
+            reader = _read_in_thread(worker.stderr)
+            contents = worker.stdout.read()
+            writer.join()
+            reader.join()
+            _wait_for_worker(worker, reader.result)
+        return contents.decode('UTF-8')
+
+    def recognize_tsv(self, image, language, details=None, uax29=None):
         language = self.user_to_tesseract(language)
-        character_details = details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+        if image.name is None:
+            return common.Output(
+                self._run_pipe(image, language, ['tessedit_create_tsv 1']),
+                format_='tsv',
+            )
+        with temporary.directory() as output_dir:
+            tessconf_path = os.path.join(output_dir, 'tessconf')
+            with open(tessconf_path, 'wt') as tessconf:
+                print('tessedit_create_tsv 1', file=tessconf)
+            with ipc.Subprocess(
+                    [self.executable, image.name, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args + [tessconf_path],
+                    stdin=ipc.DEVNULL,
+                    stdout=ipc.DEVNULL,
+                    stderr=ipc.PIPE,
+            ) as worker:
+                _wait_for_worker(worker)
+            with open(os.path.join(output_dir, 'tmp.tsv'), 'r') as tsv_file:
+                return common.Output(
+                    tsv_file.read(),
+                    format_='tsv',
+                )
+
+    def _run_hocr_files(self, image, language, config, makebox):
+        """
+        Run Tesseract on the image file, with the config file lines.
+
+        Return contents of the hOCR output file, with the box file appended if
+        makebox is true.
+        """
         with temporary.directory() as output_dir:
             tessconf_path = os.path.join(output_dir, 'tessconf')
             with open(tessconf_path, 'wt') as tessconf:
-                # Tesseract 3.00 does not come with any config file to enable hOCR
-                # output. Let's create our own one.
-                print('tessedit_create_hocr T', file=tessconf)
+                for line in config:
+                    print(line, file=tessconf)
             commandline = [
-                self.executable, image.name, os.path.join(output_dir, 'tmp'),
+                self.executable, _get_image_path(image, output_dir, 'image'), os.path.join(output_dir, 'tmp'),
                 '-l', language
             ] + self.extra_args + [tessconf_path]
-            if character_details:
+            if makebox:
                 commandline += ['makebox']
             with ipc.Subprocess(
                     commandline,
@@ -257,7 +503,7 @@ class Engine(common.Engine):
                 hocr_path = hocr_path[:-4] + 'html'
             with open(os.path.join(output_dir, hocr_path), 'r') as hocr_file:
                 contents = hocr_file.read()
-            if character_details:
+            if makebox:
                 assert commandline[-1] == 'makebox'
                 assert commandline[-2] == tessconf_path
                 box_path = os.path.join(output_dir, 'tmp.box')
@@ -276,6 +522,24 @@ class Engine(common.Engine):
                         '</body>',
                         _BBOX_EXTRAS_TEMPLATE.format(box_file.read()) + '</body>'
                     )
+        return contents
+
+    def recognize_hocr(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
+        language = self.user_to_tesseract(language)
+        character_details = details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+        char_boxes = character_details and self.has_hocr_char_boxes()
+        # Tesseract ≥ 4 can put bounding boxes of characters directly into hOCR;
+        # older versions need to produce a box file.
+        makebox = character_details and not char_boxes
+        # Tesseract 3.00 does not come with any config file to enable hOCR
+        # output, so set the variable ourselves.
+        config = ['tessedit_create_hocr T']
+        if char_boxes:
+            config += ['hocr_char_boxes 1']
+        if image.name is None and not makebox:
+            contents = self._run_pipe(image, language, config)
+        else:
+            contents = self._run_hocr_files(image, language, config, makebox)
         if self.fix_html:
             contents = fix_html(contents)
         return common.Output(
@@ -283,14 +547,97 @@ class Engine(common.Engine):
             format_='html',
         )
 
+    def _run_batch(self, images, language, config, extension):
+        """
+        Run Tesseract once for all the images, with the config file lines.
+
+        Return contents of the output file with the extension.
+        """
+        language = self.user_to_tesseract(language)
+        with temporary.directory() as output_dir:
+            tessconf_path = os.path.join(output_dir, 'tessconf')
+            with open(tessconf_path, 'wt') as tessconf:
+                for line in config:
+                    print(line, file=tessconf)
+            list_path = os.path.join(output_dir, 'list')
+            with open(list_path, 'wt') as list_file:
+                for n, image in enumerate(images):
+                    print(os.path.abspath(_get_image_path(image, output_dir, f'image{n:06}')), file=list_file)
+            commandline = [
+                self.executable, list_path, os.path.join(output_dir, 'tmp'),
+                '-l', language
+            ] + self.extra_args + [tessconf_path]
+            with ipc.Subprocess(
+                    commandline,
+                    stdin=ipc.DEVNULL,
+                    stdout=ipc.DEVNULL,
+                    stderr=ipc.PIPE,
+            ) as worker:
+                _wait_for_worker(worker)
+            with open(os.path.join(output_dir, f'tmp.{extension}'), 'r') as output_file:
+                return output_file.read()
+
+    def _recognize_hocr_batch(self, images, language, char_boxes=False):
+        config = ['tessedit_create_hocr T']
+        if char_boxes:
+            config += ['hocr_char_boxes 1']
+        contents = self._run_batch(images, language, config, 'hocr')
+        pages = split_hocr(contents)
+        if len(pages) != len(images):
+            raise errors.MalformedHocrError(f'expected {len(images)} pages, got {len(pages)}')
+        if self.fix_html:
+            pages = [fix_html(page) for page in pages]
+        return [common.Output(page, format_='html') for page in pages]
+
+    def _recognize_tsv_batch(self, images, language):
+        contents = self._run_batch(images, language, ['tessedit_create_tsv 1'], 'tsv')
+        pages = split_tsv(contents)
+        if len(pages) != len(images):
+            raise errors.MalformedOcrOutputError(f'expected {len(images)} pages, got {len(pages)}')
+        return [common.Output(page, format_='tsv') for page in pages]
+
+    def recognize_batch(self, images, language, details=None, uax29=None, recognize=None):
+        if details is None:
+            details = text_zones.TEXT_DETAILS_WORD
+        character_details = details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+        if len(images) > 1 and self._hocr is not None and (not character_details or self.has_hocr_char_boxes()):
+            # Run Tesseract once for all the images, so that the language
+            # model is loaded only once.
+            try:
+                if character_details:
+                    return self._recognize_hocr_batch(images, language, char_boxes=True)
+                if self._tsv is not None:
+                    return self._recognize_tsv_batch(images, language)
+                return self._recognize_hocr_batch(images, language)
+            except ipc.CalledProcessInterrupted as ex:
+                if ex.by_user:
+                    raise
+            except ipc.CalledProcessTimeout:
+                # Let the caller count it, and retry the batch if needed.
+                raise
+            except (ipc.CalledProcessError, errors.MalformedOcrOutputError, OSError):
+                # Tesseract gives up on the whole batch if any of the images is
+                # bad. Try again one image at a time, so that the error is
+                # attributed to the right page.
+                pass
+        return common.Engine.recognize_batch(self, images, language, recognize=recognize, details=details, uax29=uax29)
+
     def recognize(self, image, language, details=None, uax29=None):
+        if details is None:
+            details = text_zones.TEXT_DETAILS_WORD
+        character_details = details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
         if self._hocr is None:
             f = self.recognize_plain_text
+        elif self._tsv is not None and not character_details:
+            # TSV has no bounding boxes of characters.
+            f = self.recognize_tsv
         else:
             f = self.recognize_hocr
         return f(image, language, details=details, uax29=uax29)
 
     def extract_text(self, stream, **kwargs):
+        if self._tsv is not None and self._tsv.is_tsv(stream):
+            return self._tsv.extract_text(stream, **kwargs)
         if self._hocr is not None:
             return self._hocr.extract_text(stream, **kwargs)
         settings = ExtractSettings(**kwargs)
@@ -0,0 +1,240 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Tesseract, running in-process through its C API.
+
+Unlike the tesseract engine, which runs the tesseract executable for every
+page, this one loads the language model once per thread, and passes the
+rendered pixel data directly to the library.
+"""
+
+import ctypes
+import ctypes.util
+import glob
+import html
+import os
+import threading
+
+from ocrodjvu.engines import common
+from ocrodjvu.engines import tesseract
+from ocrodjvu import errors
+from ocrodjvu import image_io
+from ocrodjvu import text_zones
+from ocrodjvu import utils
+
+
+# In 1-bpp images rendered by DjVuLibre, 1 is black;
+# Tesseract expects it to be white.
+_INVERT_TABLE = bytes(range(255, -1, -1))
+
+_HOCR_TEMPLATE = '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+<title></title>
+<meta http-equiv="Content-Type" content="text/html;charset=utf-8" />
+<meta name='ocr-system' content='tesseract {version}' />
+<meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word' />
+</head>
+<body>
+{page}</body>
+</html>
+'''
+
+
+def _load_library(path):
+    if path is None:
+        path = ctypes.util.find_library('tesseract')
+        if path is None:
+            raise OSError('libtesseract not found')
+    lib = ctypes.CDLL(path)
+    handle = ctypes.c_void_p
+    text = ctypes.c_void_p  # char *, to be freed with TessDeleteText()
+    for name, restype, argtypes in [
+        ('TessVersion', ctypes.c_char_p, []),
+        ('TessDeleteText', None, [text]),
+        ('TessBaseAPICreate', handle, []),
+        ('TessBaseAPIDelete', None, [handle]),
+        ('TessBaseAPIEnd', None, [handle]),
+        ('TessBaseAPIInit3', ctypes.c_int, [handle, ctypes.c_char_p, ctypes.c_char_p]),
+        ('TessBaseAPISetVariable', ctypes.c_int, [handle, ctypes.c_char_p, ctypes.c_char_p]),
+        ('TessBaseAPISetImage', None, [handle, ctypes.c_char_p] + [ctypes.c_int] * 4),
+        ('TessBaseAPISetSourceResolution', None, [handle, ctypes.c_int]),
+        ('TessBaseAPIRecognize', ctypes.c_int, [handle, ctypes.c_void_p]),
+        ('TessBaseAPIGetHOCRText', text, [handle, ctypes.c_int]),
+        ('TessBaseAPIGetBoxText', text, [handle, ctypes.c_int]),
+        ('TessBaseAPIClear', None, [handle]),
+    ]:
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    return lib
+
+
+class _Api:
+    """
+    Tesseract instance with a loaded language model.
+
+    Instances must not be shared between threads.
+    """
+
+    def __init__(self, lib, datapath, language):
+        self._lib = lib
+        self._handle = lib.TessBaseAPICreate()
+        if lib.TessBaseAPIInit3(self._handle, os.fsencode(datapath), language.encode('ASCII')) != 0:
+            self.close()
+            raise errors.EngineError('tesseract-api', f'cannot load language model for {language}')
+
+    def _get_text(self, ptr):
+        if not ptr:
+            raise errors.EngineError('tesseract-api', 'no output')
+        try:
+            return ctypes.string_at(ptr).decode('UTF-8')
+        finally:
+            self._lib.TessDeleteText(ptr)
+
+    def recognize(self, image, character_details=False, char_boxes=False):
+        """
+        Recognize the image, and return the hOCR of the page and the box file
+        contents (or None).
+
+        With char_boxes, bounding boxes of characters are put into hOCR,
+        instead of a separate box file.
+        """
+        lib = self._lib
+        data = image.data
+        if image.bpp == 1:
+            data = data.translate(_INVERT_TABLE)
+            bytes_per_pixel = 0
+        else:
+            bytes_per_pixel = image.bpp // 8
+        width, height = image.size
+        lib.TessBaseAPISetImage(self._handle, data, width, height, bytes_per_pixel, image.bytes_per_line)
+        try:
+            lib.TessBaseAPISetSourceResolution(self._handle, image.dpi)
+            if char_boxes:
+                lib.TessBaseAPISetVariable(self._handle, b'hocr_char_boxes', b'1' if character_details else b'0')
+            if lib.TessBaseAPIRecognize(self._handle, None) != 0:
+                raise errors.EngineError('tesseract-api', 'recognition failed')
+            hocr = self._get_text(lib.TessBaseAPIGetHOCRText(self._handle, 0))
+            boxes = None
+            if character_details and not char_boxes:
+                boxes = self._get_text(lib.TessBaseAPIGetBoxText(self._handle, 0))
+            return hocr, boxes
+        finally:
+            lib.TessBaseAPIClear(self._handle)
+
+    def close(self):
+        if self._handle is None:
+            return
+        self._lib.TessBaseAPIEnd(self._handle)
+        self._lib.TessBaseAPIDelete(self._handle)
+        self._handle = None
+
+    def __del__(self):
+        self.close()
+
+
+class Engine(tesseract.Engine):
+    name = 'tesseract-api'
+    image_format = image_io.Raw
+
+    library = utils.Property(None)
+    datapath = utils.Property(None)
+    # Command-line arguments make no sense here:
+    extra_args = None
+    use_hocr = None
+    use_tsv = None
+    # The language model is loaded only once anyway, and images are kept in
+    # memory, so there's nothing to gain from batches or pipes:
+    batch_size = None
+    pipes = None
+
+    def __init__(self, *args, **kwargs):
+        tesseract.Engine.__init__(self, *args, **kwargs)
+        try:
+            self._lib = _load_library(self.library)
+        except (OSError, AttributeError):
+            raise errors.EngineNotFoundError(self.name)
+        self._version = self._lib.TessVersion().decode('ASCII')
+        self._local = threading.local()
+
+    def get_version_stamp(self):
+        return f'{self._version}:{self.library}'
+
+    def get_version(self):
+        return tesseract.parse_version(f'tesseract {self._version}')
+
+    def _get_probe_stamp(self):
+        # Language data is found without running any process (usually),
+        # so there's little to be gained from caching.
+        return None
+
+    def _probe_version(self):
+        # The version is taken from the library instead.
+        return None
+
+    def get_filesystem_info(self):
+        directory = self.datapath or os.getenv('TESSDATA_PREFIX')
+        if directory is None:
+            # Ask the tesseract executable, if any.
+            directory, extension = tesseract.Engine.get_filesystem_info(self)
+            if extension != 'traineddata':
+                raise errors.UnknownLanguageListError
+            return directory, extension
+        if not glob.glob(os.path.join(directory, '*.traineddata')):
+            # Tesseract << 4 expects TESSDATA_PREFIX to point to the parent directory.
+            directory = os.path.join(directory, 'tessdata')
+        if not os.path.isdir(directory):
+            raise errors.UnknownLanguageListError
+        return directory, 'traineddata'
+
+    def _get_api(self, language):
+        try:
+            apis = self._local.apis
+        except AttributeError:
+            apis = self._local.apis = {}
+        try:
+            return apis[language]
+        except LookupError:
+            pass
+        datapath = self._directory
+        if self._version.startswith('3.'):
+            datapath = os.path.dirname(datapath)
+        api = apis[language] = _Api(self._lib, datapath, language)
+        return api
+
+    def recognize(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
+        language = self.user_to_tesseract(language)
+        character_details = details < text_zones.TEXT_DETAILS_WORD or (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+        api = self._get_api(language)
+        page, boxes = api.recognize(image, character_details=character_details, char_boxes=self.has_hocr_char_boxes())
+        contents = _HOCR_TEMPLATE.format(version=html.escape(self._version), page=page)
+        if boxes is not None:
+            contents = contents.replace(
+                '</body>',
+                tesseract._BBOX_EXTRAS_TEMPLATE.format(boxes) + '</body>'
+            )
+        if self.fix_html:
+            contents = tesseract.fix_html(contents)
+        return common.Output(
+            contents,
+            format_='html',
+        )
+
+# vim:ts=4 sts=4 sw=4 et
@@ -44,6 +44,12 @@ class EngineNotFoundError(Exception):
         Exception.__init__(self, f'OCR engine ({name}) was not found')
 
 
+class EngineError(Exception):
+
+    def __init__(self, name, message):
+        Exception.__init__(self, f'OCR engine ({name}) failed: {message}')
+
+
 class MalformedOcrOutputError(Exception):
 
     def __init__(self, message):
@@ -72,6 +78,7 @@ __all__ = [
     'InvalidLanguageIdError',
     'MissingLanguagePackError',
     'EngineNotFoundError',
+    'EngineError',
     'MalformedOcrOutputError',
     'MalformedHocrError',
     'EXIT_FATAL',
@@ -89,6 +89,15 @@ BBOXES_RE = re.compile(
         (?: ,? \s* (?: -?\d+ \s+ -?\d+ \s+ -?\d+ \s+ -?\d+) )* )
     ''', re.VERBOSE)
 
+X_BBOXES_RE = re.compile(
+    r'''
+        x_bboxes \s+
+        (?P<x0> -?\d+) \s+
+        (?P<y0> -?\d+) \s+
+        (?P<x1> -?\d+) \s+
+        (?P<y1> -?\d+)
+    ''', re.VERBOSE)
+
 TESSERACT_RSTRIP = functools.partial(
     re.compile(r'\n\s+$').sub,
     ''
@@ -299,7 +308,20 @@ def _scan(node, settings, page_size=None):
             if not bbox:
                 raise errors.MalformedHocrError("zone without bounding box information")
             text = str.join('', children)
-            children = _apply_bboxes(djvu_class, settings.bbox_data or title, text, settings, page_size)
+            bbox_data = settings.bbox_data
+            if bbox_data is None and djvu_class is const.TEXT_ZONE_WORD:
+                # Bounding boxes of characters are needed only for character
+                # zones, which UAX #29 word segmentation is based on, too.
+                need_char_bboxes = settings.details < TEXT_DETAILS_WORD or (
+                    settings.uax29 is not None and settings.details <= TEXT_DETAILS_WORD
+                )
+                cinfo_text, cinfo_bbox_data = extract_cinfo_bbox_data(node, bboxes=need_char_bboxes)
+                if cinfo_text:
+                    # Whitespace between the character spans is not a part of the word.
+                    text = cinfo_text
+                    if cinfo_bbox_data is not None:
+                        bbox_data = iter(cinfo_bbox_data)
+            children = _apply_bboxes(djvu_class, bbox_data or title, text, settings, page_size)
             if len(children) == 1 and isinstance(children[0], str):
                 result = text_zones.Zone(type_=const.TEXT_ZONE_CHARACTER, bbox=bbox, children=children)
                 # We return TEXT_ZONE_CHARACTER even it was a word according to hOCR.
@@ -336,6 +358,12 @@ def _scan(node, settings, page_size=None):
             has_string = has_char_zone = False
 
     if has_char_zone:
+        # Whitespace between words may span lines, e.g. when every word is on
+        # its own indented line, as in hOCR produced by Tesseract ≥ 3.03.
+        # It separates words, so a single space is all that is needed.
+        while children and isinstance(children[0], str):
+            del children[0]
+        children = [' ' if isinstance(child, str) else child for child in children]
         break_iterator = functools.partial(unicode_support.word_break_iterator, locale=settings.uax29)
         children = text_zones.group_words(children, settings.details, break_iterator)
         has_string = False
@@ -416,6 +444,45 @@ def extract_tesseract_bbox_data(node):
             yield ch, (x0 + w * i // n, y0, x0 + w * (i + 1) // n, y1), -1
 
 
+def extract_cinfo_bbox_data(node, bboxes=True):
+    """
+    Extract bounding boxes of characters of a word from its ocrx_cinfo
+    elements, as produced by Tesseract ≥ 4 with hocr_char_boxes enabled.
+
+    Return text of the word and a list of (character, bbox, upside_down)
+    tuples, as in extract_tesseract_bbox_data(). Unlike in box files, the
+    coordinates are the same as in the rest of hOCR, so no flipping is needed.
+    Without bboxes, the list is not built, and None is returned instead.
+    """
+    text = []
+    bbox_data = [] if bboxes else None
+    for child in node.iterdescendants():
+        if not isinstance(child.tag, str):
+            continue
+        if 'ocrx_cinfo' not in (child.get('class') or '').split():
+            continue
+        title = child.get('title') or ''
+        if 'x_bboxes' not in title:
+            # Tesseract uses ocrx_cinfo also for alternative LSTM choices,
+            # which don't have their own bounding boxes.
+            continue
+        chars = child.text or ''
+        if not chars:
+            continue
+        text += [chars]
+        if not bboxes:
+            continue
+        m = X_BBOXES_RE.search(title)
+        if m is None:
+            raise errors.MalformedHocrError('malformed x_bboxes property')
+        x0, y0, x1, y1 = (int(m.group(ident)) for ident in ('x0', 'y0', 'x1', 'y1'))
+        w = x1 - x0
+        n = len(chars)
+        for i, ch in enumerate(chars):
+            bbox_data += [(ch, (x0 + w * i // n, y0, x0 + w * (i + 1) // n, y1), 1)]
+    return str.join('', text), bbox_data
+
+
 def read_document(stream, settings):
     if settings.fix_utf8:
         # Fix UTF-8 encoding and get rid of control characters that are not
@@ -13,7 +13,12 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import contextlib
+import hashlib
+import io
+import os
 import struct
+import threading
 
 from ocrodjvu import utils
 
@@ -24,17 +29,84 @@ except ImportError as ex:
     raise
 
 
+class _BufferPool:
+    """
+    Pool of reusable render buffers.
+
+    Every worker that renders an image checks out its own buffer, so the pool
+    holds at most as many buffers as there are concurrent workers. Buffers
+    only grow, so that they're not reallocated for every page.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = []
+
+    @contextlib.contextmanager
+    def get(self, size):
+        """
+        Check out a writable buffer of the requested size.
+        """
+        with self._lock:
+            buffer = self._free.pop() if self._free else bytearray()
+        if len(buffer) < size:
+            buffer = bytearray(size)
+        view = memoryview(buffer)[:size]
+        try:
+            yield view
+        finally:
+            view.release()
+            with self._lock:
+                self._free += [buffer]
+
+
+def _write_vectored(file, chunks):
+    """
+    Write the chunks to the file, with a single writev(2) call if possible.
+    """
+    try:
+        fd = file.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fd = None
+    if fd is None or not hasattr(os, 'writev'):
+        for chunk in chunks:
+            file.write(chunk)
+        return
+    file.flush()
+    chunks = [memoryview(chunk).cast('B') for chunk in chunks]
+    while chunks:
+        n = os.writev(fd, chunks)
+        while chunks and n >= len(chunks[0]):
+            n -= len(chunks.pop(0))
+        if n > 0:
+            chunks[0] = chunks[0][n:]
+
+
 class ImageFormat:
     extension = None
+    # Whether images are kept in memory (see render_image()), rather than
+    # written to files:
+    in_memory = False
 
     _rgb = 'RGB'
 
-    def __init__(self, bpp):
+    def __init__(self, bpp, band_height=None):
+        """
+        Images written to files are rendered in horizontal bands of at most
+        band_height rows, so that the whole page doesn't have to be kept in
+        memory at once. None means the whole page at once.
+        """
         self.bpp = bpp
+        self.band_height = band_height
+        self._buffers = _BufferPool()
         if bpp == 1:
             pixel_format = djvu.decode.PixelFormatPackedBits('>')
             pixel_format.rows_top_to_bottom = 1
             pixel_format.y_top_to_bottom = 1
+        elif bpp == 8:
+            pixel_format = djvu.decode.PixelFormatGrey()
+            pixel_format.rows_top_to_bottom = 1
+            pixel_format.y_top_to_bottom = 1
         elif bpp == 24:
             pixel_format = djvu.decode.PixelFormatRgb(self._rgb)
             pixel_format.rows_top_to_bottom = 1
@@ -47,40 +119,97 @@ class ImageFormat:
     def write_image(self, page_job, render_layers, file):
         raise NotImplementedError('Cannot output images in this format')
 
+    def render_image(self, page_job, render_layers):
+        raise NotImplementedError('Cannot keep images in this format in memory')  # no coverage
+
+    def get_data_size(self, size, row_alignment=1):
+        """
+        Return size of the rendered pixel data, in bytes.
+        Headers are not included.
+        """
+        width, height = size
+        row_size = (width * self._pixel_format.bpp + 7) // 8
+        row_size = -(-row_size // row_alignment) * row_alignment
+        return row_size * height
+
+    def _write_bands(self, page_job, render_layers, file, header, row_alignment=1):
+        """
+        Render the page in horizontal bands, and write them to the file after
+        the header (a sequence of bytes-like objects).
+
+        The bands are rendered into a buffer from the pool, which is written
+        without copying; the header goes along with the first band.
+        """
+        width, height = page_job.size
+        page_rect = (0, 0, width, height)
+        band_height = min(self.band_height or height, height)
+        band_tops = range(0, height, band_height or 1)
+        if not self._pixel_format.rows_top_to_bottom:
+            band_tops = reversed(band_tops)
+        chunks = list(header)
+        with self._buffers.get(self.get_data_size((width, band_height), row_alignment)) as buffer:
+            for y in band_tops:
+                band_rect = (0, y, width, min(band_height, height - y))
+                data = buffer[:self.get_data_size(band_rect[2:], row_alignment)]
+                page_job.render(
+                    render_layers,
+                    page_rect, band_rect,
+                    self._pixel_format,
+                    row_alignment=row_alignment,
+                    buffer=data,
+                )
+                chunks += [data]
+                _write_vectored(file, chunks)
+                data.release()
+                chunks = []
+        if chunks:
+            _write_vectored(file, chunks)
+
+    def encode_image(self, page_job, render_layers):
+        """
+        Return the image encoded in this format, but kept in memory rather
+        than written to a file, so that it can be piped to the engine.
+
+        The whole image is held in memory, regardless of the band height.
+        """
+        file = io.BytesIO()
+        self.write_image(page_job, render_layers, file)
+        # Don't copy the data out of the buffer:
+        return EncodedImage(file.getbuffer(), self.extension)
+
     def __repr__(self):
         return f'{self.__module__}.{type(self).__name__}({self.bpp})'
 
 
 class PNM(ImageFormat):
     """
-    Raw PBM[0] or raw PPM[1].
+    Raw PBM[0], raw PGM[1] or raw PPM[2].
 
-    [0] https://netpbm.sourceforge.net/doc/ppm.html
-    [1] https://netpbm.sourceforge.net/doc/pbm.html
+    [0] https://netpbm.sourceforge.net/doc/pbm.html
+    [1] https://netpbm.sourceforge.net/doc/pgm.html
+    [2] https://netpbm.sourceforge.net/doc/ppm.html
     """
 
     extension = 'pnm'
 
-    def __init__(self, bpp):
-        ImageFormat.__init__(self, bpp)
+    def __init__(self, bpp, band_height=None):
+        ImageFormat.__init__(self, bpp, band_height)
         if bpp == 1:
             self.extension = 'pbm'
+        elif bpp == 8:
+            self.extension = 'pgm'
         elif bpp == 24:
             self.extension = 'ppm'
 
     def write_image(self, page_job, render_layers, file):
         size = page_job.size
-        rect = (0, 0) + size
         if self._pixel_format.bpp == 1:
-            file.write('P4 {0} {1}\n'.format(*size).encode('ASCII'))  # PBM header
+            header = 'P4 {0} {1}\n'.format(*size).encode('ASCII')  # PBM header
+        elif self._pixel_format.bpp == 8:
+            header = 'P5 {0} {1} 255\n'.format(*size).encode('ASCII')  # PGM header
         else:
-            file.write('P6 {0} {1} 255\n'.format(*size).encode('ASCII'))  # PPM header
-        data = page_job.render(
-            render_layers,
-            rect, rect,
-            self._pixel_format
-        )
-        file.write(data)
+            header = 'P6 {0} {1} 255\n'.format(*size).encode('ASCII')  # PPM header
+        self._write_bands(page_job, render_layers, file, [header])
 
 
 class BMP(ImageFormat):
@@ -94,46 +223,45 @@ class BMP(ImageFormat):
 
     _rgb = 'BGR'
 
-    def __init__(self, bpp):
-        ImageFormat.__init__(self, bpp)
+    def __init__(self, bpp, band_height=None):
+        ImageFormat.__init__(self, bpp, band_height)
         self._pixel_format.rows_top_to_bottom = 0
 
     def write_image(self, page_job, render_layers, file):
         size = page_job.size
-        rect = (0, 0) + size
         dpm = int(page_job.dpi * 39.37 + 0.5)
-        data = page_job.render(
-            render_layers,
-            rect, rect,
-            self._pixel_format,
-            row_alignment=4,
-        )
-        n_palette_colors = 2 * (self._pixel_format.bpp == 1)
+        data_size = self.get_data_size(size, row_alignment=4)
+        if self._pixel_format.bpp == 1:
+            palette = [(0xFF, 0xFF, 0xFF), (0, 0, 0)]
+        elif self._pixel_format.bpp == 8:
+            palette = [(i, i, i) for i in range(256)]
+        else:
+            palette = []
+        n_palette_colors = len(palette)
         headers_size = 54 + 4 * n_palette_colors
-        file.write(struct.pack(
+        header = []
+        header += struct.pack(
             '<ccIHHI',
             b'B', b'M',  # magic
-            len(data) + headers_size,  # whole file size
+            data_size + headers_size,  # whole file size
             0, 0,  # identification magic
             headers_size  # offset to pixel data
-        ))
-        file.write(struct.pack(
+        ),
+        header += struct.pack(
             '<IIIHHIIIIII',
             40,  # size of this header
             size[0], size[1],  # image size in pixels
             1,  # number of color planes
             self._pixel_format.bpp,  # number of bits per pixel
             0,  # compression method
-            len(data),  # size of pixel data
+            data_size,  # size of pixel data
             dpm, dpm,  # resolution in pixels/meter
             n_palette_colors,  # number of colors in the color palette
             n_palette_colors  # number of important colors
-        ))
-        if self._pixel_format.bpp == 1:
-            # palette:
-            file.write(struct.pack('<BBBB', 0xFF, 0xFF, 0xFF, 0))
-            file.write(struct.pack('<BBBB', 0, 0, 0, 0))
-        file.write(data)
+        ),
+        for color in palette:
+            header += struct.pack('<BBBB', *color, 0),
+        self._write_bands(page_job, render_layers, file, header, row_alignment=4)
 
 
 class TIFF(ImageFormat):
@@ -148,15 +276,13 @@ class TIFF(ImageFormat):
 
     def write_image(self, page_job, render_layers, file):
         size = page_job.size
-        rect = (0, 0) + size
-        data = page_job.render(
-            render_layers,
-            rect, rect,
-            self._pixel_format
-        )
+        data_size = self.get_data_size(size)
         if self._pixel_format.bpp == 1:
             interp = 0
             spp = 1
+        elif self._pixel_format.bpp == 8:
+            interp = 1
+            spp = 1
         elif self._pixel_format.bpp == 24:
             interp = 2
             spp = 3
@@ -171,21 +297,94 @@ class TIFF(ImageFormat):
         header += struct.pack('<H', n_tags),  # number of tags
         header += struct.pack('<HHII', 0x100, 4, 1, size[0]),  # ImageWidth
         header += struct.pack('<HHII', 0x101, 4, 1, size[1]),  # ImageLength
-        if interp > 0:
+        if spp > 1:
             header += struct.pack('<HHII', 0x102, 3, 3, 8),  # BitsPerSample
         else:
-            header += struct.pack('<HHII', 0x102, 3, 1, 1),  # BitsPerSample
+            header += struct.pack('<HHII', 0x102, 3, 1, self._pixel_format.bpp),  # BitsPerSample
         header += struct.pack('<HHIHxx', 0x106, 3, 1, interp),  # PhotometricInterpretation
         header += struct.pack('<HHII', 0x111, 4, 1, data_offset),  # StripOffsets
         header += struct.pack('<HHIHxx', 0x115, 3, 1, spp),  # SamplesPerPixel
-        header += struct.pack('<HHII', 0x117, 4, 1, len(data)),  # StripByteCounts
+        header += struct.pack('<HHII', 0x117, 4, 1, data_size),  # StripByteCounts
         header += struct.pack('<HHII', 0x11A, 5, 1, 14),  # XResolution
         header += struct.pack('<HHII', 0x11B, 5, 1, 14),  # YResolution
         header += struct.pack('<I', 0),  # offset to next IFD
         assert len(header) == n_tags + 5
-        header = b''.join(header)
-        assert len(header) == data_offset
-        file.write(header)
-        file.write(data)
+        assert sum(map(len, header)) == data_offset
+        # The size of pixel data is known in advance, so the bands can make
+        # up a single strip.
+        self._write_bands(page_job, render_layers, file, header)
+
+
+class _MemoryImage:
+
+    # Images kept in memory have no file name:
+    name = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def digest(self):
+        return hashlib.sha256(self.data).digest()
+
+    def close(self):
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RawImage(_MemoryImage):
+    """
+    Rendered image kept in memory.
+
+    For 1-bpp images, rows are packed, with the most significant bit first;
+    1 is black. For 8-bpp images, pixels are gray levels; 0 is black.
+    For 24-bpp images, pixels are RGB triples.
+    """
+
+    def __init__(self, data, size, bpp, dpi):
+        _MemoryImage.__init__(self, data)
+        self.size = size
+        self.bpp = bpp
+        self.dpi = dpi
+
+    @property
+    def bytes_per_line(self):
+        return (self.size[0] * self.bpp + 7) // 8
+
+
+class EncodedImage(_MemoryImage):
+    """
+    Contents of an image file kept in memory.
+    """
+
+    def __init__(self, data, extension):
+        _MemoryImage.__init__(self, data)
+        self.extension = extension
+
+
+class Raw(ImageFormat):
+    """
+    Raw pixel data, which is not written to a file at all.
+    """
+
+    extension = 'raw'
+    in_memory = True
+
+    def render_image(self, page_job, render_layers):
+        size = page_job.size
+        rect = (0, 0) + size
+        data = page_job.render(
+            render_layers,
+            rect, rect,
+            self._pixel_format
+        )
+        return RawImage(data, size, self._pixel_format.bpp, page_job.dpi)
+
+    def write_image(self, page_job, render_layers, file):
+        file.write(self.render_image(page_job, render_layers).data)
 
 # vim:ts=4 sts=4 sw=4 et
@@ -17,6 +17,7 @@
 Interprocess communication.
 """
 
+import contextlib
 import errno
 import logging
 import os
@@ -24,6 +25,8 @@ import pipes
 import re
 import signal
 import subprocess
+import threading
+import time
 
 
 # CalledProcessError, CalledProcessInterrupted
@@ -70,9 +73,113 @@ class CalledProcessInterrupted(CalledProcessError):
         return f'Command {self.args[0]!r} was interrupted by signal {signal_name}'
 
 
+class CalledProcessTimeout(CalledProcessError):
+    by_user = False
+
+    def __init__(self, timeout, command):
+        Exception.__init__(self, command, timeout)
+
+    def __str__(self):
+        return f'Command {self.args[0]!r} timed out after {self.args[1]:g} seconds'
+
+
 del get_signal_names
 
 
+# local_env()
+# ===========
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def local_env(**override):
+    """
+    Override environment variables for subprocesses started by the current
+    thread.
+    """
+    old_env = getattr(_local, 'env', {})
+    _local.env = dict(old_env, **override)
+    try:
+        yield
+    finally:
+        _local.env = old_env
+
+
+# timeout()
+# =========
+
+@contextlib.contextmanager
+def timeout(seconds):
+    """
+    Kill subprocesses started by the current thread, together with their
+    children, if they run for more than the number of seconds. Then wait()
+    raises CalledProcessTimeout.
+
+    None means no time limit.
+    """
+    old_timeout = getattr(_local, 'timeout', None)
+    _local.timeout = seconds
+    try:
+        yield
+    finally:
+        _local.timeout = old_timeout
+
+
+# collect_processes()
+# ===================
+
+@contextlib.contextmanager
+def collect_processes():
+    """
+    Collect subprocesses waited for by the current thread.
+
+    Yield a list, to which the Subprocess objects are appended. Their
+    rusage, start_time and end_time attributes tell how many resources they
+    used and when they ran.
+    """
+    old_processes = getattr(_local, 'processes', None)
+    _local.processes = processes = []
+    try:
+        yield processes
+    finally:
+        _local.processes = old_processes
+
+
+# Subprocesses with a time limit, which run in their own process groups:
+_watched = set()
+# (reentrant, so that kill_watched() can be called from a signal handler)
+_watched_lock = threading.RLock()
+
+
+def kill_watched():
+    """
+    Kill all running subprocesses that have a time limit.
+
+    Such subprocesses run in their own process groups, so they don't get
+    SIGINT when the user presses Ctrl+C.
+    """
+    with _watched_lock:
+        watched = list(_watched)
+    for process in watched:
+        process.kill_group()
+
+
+# Subprocesses that haven't been waited for yet, with names of the threads
+# that started them:
+_running = {}
+_running_lock = threading.Lock()
+
+
+def running_processes():
+    """
+    Return list of (thread name, Subprocess) pairs for subprocesses that
+    haven't been waited for yet.
+    """
+    with _running_lock:
+        return list((name, process) for process, name in _running.items())
+
+
 # Subprocess
 # ==========
 
@@ -97,7 +204,9 @@ class Subprocess(subprocess.Popen):
         return env
 
     def __init__(self, *args, **kwargs):
-        kwargs['env'] = self.override_env(kwargs.get('env'))
+        override = dict(getattr(_local, 'env', {}))
+        override.update(kwargs.get('env') or {})
+        kwargs['env'] = self.override_env(override)
         if os.name == 'posix':
             kwargs.update(close_fds=True)
         try:
@@ -108,6 +217,19 @@ class Subprocess(subprocess.Popen):
             logger.debug(str.join(' ', map(pipes.quote, commandline)))
         self.__command = commandline[0]
         self.__wait_called = False
+        self.__wait4_lock = threading.Lock()
+        # Resource usage of the terminated process, if available:
+        self.rusage = None
+        # time.monotonic() when the process was started, and reaped:
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.__timeout = getattr(_local, 'timeout', None)
+        self.__timed_out = False
+        self.__watchdog = None
+        if self.__timeout is not None and os.name == 'posix':
+            # Start a new process group, so that children of the process can
+            # be killed, too.
+            kwargs.update(start_new_session=True)
         try:
             subprocess.Popen.__init__(self, *args, **kwargs)
         except EnvironmentError as ex:
@@ -117,15 +239,132 @@ class Subprocess(subprocess.Popen):
                 ex.strerror = ex.strerror[:-len(suffix)]
             ex.filename = self.__command
             raise
-
-    def wait(self, *args, **kwargs):
-        return_code = subprocess.Popen.wait(self, *args, **kwargs)
+        with _running_lock:
+            _running[self] = threading.current_thread().name
+        if self.__timeout is not None:
+            with _watched_lock:
+                _watched.add(self)
+            self.__watchdog = threading.Timer(self.__timeout, self.__on_timeout)
+            self.__watchdog.daemon = True
+            self.__watchdog.start()
+
+    def __on_timeout(self):
+        if self.kill_group():
+            self.__timed_out = True
+
+    def kill_group(self):
+        """
+        Kill the process, and (if it was started with a time limit) its
+        process group.
+
+        Return True if the process was still there to be killed.
+        """
+        if self.returncode is not None:
+            # Already reaped; the process group ID might have been reused.
+            return False
+        try:
+            if self.__timeout is not None and os.name == 'posix':
+                os.killpg(self.pid, signal.SIGKILL)
+            else:
+                self.kill()
+        except ProcessLookupError:
+            return False
+        # Popen.kill() does nothing if the process has been reaped meanwhile.
+        return self.returncode is None
+
+    def __wait4(self, blocking):
+        # Like os.waitpid(), but resource usage of the process is recorded.
+        if not self.__wait4_lock.acquire(blocking):
+            # Another thread is waiting for the process.
+            return
+        try:
+            if self.returncode is not None:
+                return self.returncode
+            try:
+                (pid, status, rusage) = os.wait4(self.pid, 0 if blocking else os.WNOHANG)
+            except ChildProcessError:
+                # The process has been reaped by someone else,
+                # e.g. because SIGCHLD is ignored.
+                self.returncode = 0
+                return self.returncode
+            if pid != self.pid:
+                return
+            self.rusage = rusage
+            if os.WIFSIGNALED(status):
+                self.returncode = -os.WTERMSIG(status)
+            elif os.WIFEXITED(status):
+                self.returncode = os.WEXITSTATUS(status)
+            else:  # no coverage
+                return
+            return self.returncode
+        finally:
+            self.__wait4_lock.release()
+
+    def poll(self):
+        if os.name != 'posix':  # no coverage
+            return subprocess.Popen.poll(self)
+        return self.__wait4(blocking=False)
+
+    def __wait(self, timeout):
+        if os.name != 'posix':  # no coverage
+            return subprocess.Popen.wait(self, timeout)
+        if timeout is None:
+            while self.returncode is None:
+                self.__wait4(blocking=True)
+            return self.returncode
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            delay = min(delay * 2, remaining, 0.05)
+            time.sleep(delay)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return_code = self.__wait(timeout)
+        if not self.__wait_called:
+            self.end_time = time.monotonic()
+            with _running_lock:
+                _running.pop(self, None)
+            collected = getattr(_local, 'processes', None)
+            if collected is not None:
+                collected += [self]
         self.__wait_called = True
+        if self.__watchdog is not None:
+            self.__watchdog.cancel()
+            with _watched_lock:
+                _watched.discard(self)
+        if self.__timed_out:
+            raise CalledProcessTimeout(self.__timeout, self.__command)
         if return_code > 0:
             raise CalledProcessError(return_code, self.__command)
         if return_code < 0:
             raise CalledProcessInterrupted(-return_code, self.__command)
 
+    def feed(self, data):
+        """
+        Write the data to standard input of the process in a separate thread,
+        so that its output can be read at the same time; then close standard
+        input.
+
+        Return the thread.
+        """
+        def write():
+            try:
+                try:
+                    self.stdin.write(data)
+                finally:
+                    self.stdin.close()
+            except BrokenPipeError:
+                # The process exited without reading everything.
+                # Its exit status will tell whether it was an error.
+                pass
+        thread = threading.Thread(target=write, daemon=True)
+        thread.start()
+        return thread
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         # Calling `self.wait` twice will always result in a return code > 0.
         # For this reason, use a patched `__exit__` method if we already have called `self.wait` before.
@@ -156,6 +395,11 @@ class Subprocess(subprocess.Popen):
 
 PIPE = subprocess.PIPE
 
+# STDOUT
+# ======
+
+STDOUT = subprocess.STDOUT
+
 # DEVNULL
 # =======
 
@@ -187,8 +431,9 @@ logger = logging.getLogger('ocrodjvu.ipc')
 # =======
 
 __all__ = [
-    'CalledProcessError', 'CalledProcessInterrupted',
-    'Subprocess', 'PIPE', 'DEVNULL',
+    'CalledProcessError', 'CalledProcessInterrupted', 'CalledProcessTimeout',
+    'Subprocess', 'PIPE', 'STDOUT', 'DEVNULL',
+    'local_env', 'timeout', 'kill_watched', 'collect_processes', 'running_processes',
     'require',
 ]
 
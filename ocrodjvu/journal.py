@@ -0,0 +1,144 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Persistent journal of recognized pages.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from ocrodjvu import utils
+
+VERSION = 1
+
+
+def make_key(djvu_path, settings):
+    """
+    Return journal key for the document and OCR settings.
+
+    settings must be JSON-serializable.
+    """
+    data = json.dumps([utils.file_digest(djvu_path).hex(), settings], sort_keys=True)
+    return hashlib.sha256(data.encode('UTF-8')).hexdigest()
+
+
+class Journal:
+    """
+    Append-only journal of recognized pages.
+
+    Every line of the journal file is a JSON document. The first line holds
+    the key, which identifies the document and the OCR settings; every other
+    line holds the page number and the serialized text of the page (or null,
+    if the page had no image suitable for OCR). Each record is flushed to the
+    disk as soon as it is written, so that it survives a crash of the program
+    or the whole machine. An incomplete or corrupted record is ignored, and so
+    is anything after it.
+    """
+
+    def __init__(self, path, key, resume=False):
+        self.path = path
+        self.key = key
+        self.pages = {}
+        self._lock = threading.Lock()
+        if resume:
+            self.pages = self._read()
+        # Rewrite the journal from scratch, dropping records that can't be
+        # used, and then atomically replace the old one.
+        tmp_path = path + '.tmp'
+        self._file = open(tmp_path, 'wt', encoding='UTF-8')
+        try:
+            self._write(dict(version=VERSION, key=key), sync=False)
+            for n, text in sorted(self.pages.items()):
+                self._write(dict(page=n, text=text), sync=False)
+            self._sync()
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._file.close()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _read(self):
+        """
+        Read pages recorded in the existing journal, if it matches the key.
+        """
+        pages = {}
+        try:
+            file = open(self.path, 'rt', encoding='UTF-8')
+        except FileNotFoundError:
+            return pages
+        with file:
+            try:
+                header = json.loads(file.readline())
+            except ValueError:
+                return pages
+            if header != dict(version=VERSION, key=self.key):
+                return pages
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                    n = record['page']
+                    text = record['text']
+                except (ValueError, TypeError, KeyError):
+                    break
+                if not isinstance(n, int) or not isinstance(text, (str, type(None))):
+                    # Corrupted record; ignore it and anything after it.
+                    break
+                pages[n] = text
+        return pages
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _write(self, record, sync=True):
+        self._file.write(json.dumps(record) + '\n')
+        if sync:
+            self._sync()
+
+    def add(self, n, text):
+        """
+        Record the serialized text of the n-th page.
+
+        Do nothing if the journal is already closed.
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write(dict(page=n, text=text))
+            self.pages[n] = text
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def remove(self):
+        """
+        Close and remove the journal.
+        """
+        self.close()
+        os.remove(self.path)
+
+
+__all__ = ['Journal', 'make_key']
+
+# vim:ts=4 sts=4 sw=4 et
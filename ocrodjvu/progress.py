@@ -0,0 +1,110 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Machine-readable progress of an ocrodjvu run, as a stream of JSON lines.
+"""
+
+import json
+import threading
+import time
+
+
+class Progress:
+    """
+    Writer of progress events: one JSON object per line, for every
+    completed page.
+
+    Pages are identified by (path, page number) pairs.
+    All the methods are thread-safe.
+
+    The estimated time of arrival is based on relative costs of the pages:
+    the remaining pages are expected to be processed at the same rate (cost
+    per second) as the pages completed so far.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._costs = {}
+        self._n_pages = 0
+        self._n_done = 0
+        self._total_cost = 0
+        self._done_cost = 0
+
+    def add_pages(self, keys, costs=None):
+        """
+        Add pages to be processed, together with their estimated costs.
+        """
+        keys = list(keys)
+        if costs is None or not any(costs):
+            # Nothing is known about the pages, so let's assume they are all
+            # alike.
+            costs = [1] * len(keys)
+        with self._lock:
+            for key, cost in zip(keys, costs):
+                self._costs[key] = cost
+                self._total_cost += cost
+            self._n_pages += len(keys)
+
+    def page_done(self, key, status, duration=None):
+        """
+        Write an event for the completed page.
+
+        status is one of: 'ok', 'no-image', 'failed'.
+        duration is the time spent on the page, in seconds, if known.
+        """
+        path, page_number = key
+        with self._lock:
+            elapsed = time.monotonic() - self._start_time
+            self._done_cost += self._costs.pop(key, 0)
+            self._n_done += 1
+            eta = None
+            if self._done_cost > 0:
+                eta = elapsed * (self._total_cost - self._done_cost) / self._done_cost
+            event = dict(
+                event='page',
+                path=path,
+                page=page_number,
+                status=status,
+                duration=duration,
+                pages_done=self._n_done,
+                pages_total=self._n_pages,
+                pages_per_second=self._n_done / elapsed if elapsed > 0 else None,
+                eta=eta,
+            )
+            self._file.write(json.dumps(event) + '\n')
+            self._file.flush()
+
+
+class NullProgress(Progress):
+    """
+    Progress that doesn't write anything.
+    """
+
+    def __init__(self):
+        Progress.__init__(self, None)
+
+    def add_pages(self, keys, costs=None):
+        pass
+
+    def page_done(self, key, status, duration=None):
+        pass
+
+
+__all__ = ['Progress', 'NullProgress']
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,241 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Machine-readable report of where the time went.
+"""
+
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # no coverage
+    resource = None
+
+VERSION = 1
+
+# Stages of processing a page, in order:
+STAGES = (
+    'queue',  # waiting for a worker
+    'decode',  # decoding the page
+    'render',  # rendering the image and writing it for the engine
+    'ocr',  # running the OCR engine
+    'extract',  # extracting text from the OCR output
+    'write_wait',  # the writer waiting for the page, while the following ones may be ready
+    'serialize',  # writing the text as djvused script
+)
+
+
+def _get_rusage():
+    if resource is None:
+        return None  # no coverage
+    return resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def rusage_to_dict(rusages, share=1.0):
+    """
+    Convert resource usage of subprocesses to a JSON-serializable dictionary.
+
+    Only the share of CPU time and I/O is taken into account, e.g. if the
+    process worked on multiple pages.
+    """
+    return dict(
+        processes=len(rusages),
+        user_time=share * sum(r.ru_utime for r in rusages),
+        system_time=share * sum(r.ru_stime for r in rusages),
+        # in KiB:
+        max_rss=max((r.ru_maxrss for r in rusages), default=0),
+        # in 512-byte blocks:
+        in_blocks=share * sum(r.ru_inblock for r in rusages),
+        out_blocks=share * sum(r.ru_oublock for r in rusages),
+    )
+
+
+def _add_rusage(total, usage):
+    for key, value in usage.items():
+        if key == 'max_rss':
+            total[key] = max(total.get(key, 0), value)
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def _summarize(values):
+    if not values:
+        return dict(total=0.0, mean=0.0, max=0.0)
+    total = sum(values)
+    return dict(total=total, mean=total / len(values), max=max(values))
+
+
+class Report:
+    """
+    Statistics of an ocrodjvu run.
+
+    Pages are identified by (path, page number) pairs.
+    All the methods are thread-safe.
+
+    Resource usage of the OCR engine processes is aggregated per engine and
+    language, as given to the constructor.
+    """
+
+    def __init__(self, engine=None, language=None):
+        self._engine = engine
+        self._language = language
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._documents = []
+        self._start_time = time.monotonic()
+        self._start_rusage = _get_rusage()
+
+    def _get_page(self, key):
+        page = self._pages.get(key)
+        if page is None:
+            page = self._pages[key] = dict(status=None, stages={}, image_bytes=0, rusage={})
+        return page
+
+    def add_time(self, key, stage, seconds):
+        with self._lock:
+            stages = self._get_page(key)['stages']
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def add_image_bytes(self, key, n):
+        with self._lock:
+            self._get_page(key)['image_bytes'] += n
+
+    def set_status(self, key, status):
+        with self._lock:
+            self._get_page(key)['status'] = status
+
+    def add_rusage(self, key, rusages, share=1.0):
+        """
+        Add resource usage (resource.struct_rusage objects) of the OCR engine
+        processes that recognized the page.
+        """
+        if not rusages:
+            return
+        usage = rusage_to_dict(rusages, share)
+        with self._lock:
+            _add_rusage(self._get_page(key)['rusage'], usage)
+
+    def pop(self, key):
+        """
+        Remove the statistics of the page, and return them.
+        """
+        with self._lock:
+            return self._pages.pop(key, None)
+
+    def merge(self, key, page):
+        """
+        Add statistics of the page returned by pop(), possibly by another
+        process.
+        """
+        if page is None:
+            return
+        with self._lock:
+            own = self._get_page(key)
+            for stage, seconds in page['stages'].items():
+                own['stages'][stage] = own['stages'].get(stage, 0.0) + seconds
+            own['image_bytes'] += page['image_bytes']
+            _add_rusage(own['rusage'], page['rusage'])
+            if page['status'] is not None:
+                own['status'] = page['status']
+
+    def add_document(self, path, save_time, rusages=()):
+        """
+        Add statistics of saving the document, including resource usage of
+        the subprocesses (e.g. djvused).
+        """
+        with self._lock:
+            self._documents += [dict(path=path, save=save_time, rusage=rusage_to_dict(rusages))]
+
+    def as_dict(self):
+        with self._lock:
+            pages = [
+                dict(path=path, page=page_number, **page)
+                for (path, page_number), page in self._pages.items()
+            ]
+            documents = list(self._documents)
+        stages = {}
+        for stage in STAGES + tuple(sorted({s for page in pages for s in page['stages']} - set(STAGES))):
+            values = [page['stages'][stage] for page in pages if stage in page['stages']]
+            if values:
+                stages[stage] = _summarize(values)
+        engine_usage = {}
+        for page in pages:
+            if page['rusage']:
+                _add_rusage(engine_usage, dict(page['rusage'], pages=1))
+        data = dict(
+            version=VERSION,
+            wall_time=time.monotonic() - self._start_time,
+            pages=pages,
+            documents=documents,
+            stages=stages,
+            image_bytes=sum(page['image_bytes'] for page in pages),
+            engines=[dict(engine=self._engine, language=self._language, **engine_usage)] if engine_usage else [],
+        )
+        rusage = _get_rusage()
+        if rusage is not None:
+            self_usage, children_usage = rusage
+            _, start_children_usage = self._start_rusage
+            children_cpu_time = children_usage.ru_utime + children_usage.ru_stime
+            start_children_cpu_time = start_children_usage.ru_utime + start_children_usage.ru_stime
+            data.update(
+                # CPU time of subprocesses, mostly of the OCR engine:
+                engine_cpu_time=children_cpu_time - start_children_cpu_time,
+                cpu_time=self_usage.ru_utime + self_usage.ru_stime,
+                # Peak resident set sizes, in KiB:
+                max_rss=self_usage.ru_maxrss,
+                max_rss_children=children_usage.ru_maxrss,
+            )
+        return data
+
+    def write(self, path):
+        data = self.as_dict()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt', encoding='UTF-8') as file:
+            json.dump(data, file, indent=1)
+            file.write('\n')
+        os.replace(tmp_path, path)
+
+
+class NullReport(Report):
+    """
+    Report that doesn't collect anything.
+    """
+
+    def add_time(self, key, stage, seconds):
+        pass
+
+    def add_image_bytes(self, key, n):
+        pass
+
+    def set_status(self, key, status):
+        pass
+
+    def add_rusage(self, key, rusages, share=1.0):
+        pass
+
+    def merge(self, key, page):
+        pass
+
+    def add_document(self, path, save_time, rusages=()):
+        pass
+
+
+__all__ = ['Report', 'NullReport', 'STAGES']
+
+# vim:ts=4 sts=4 sw=4 et
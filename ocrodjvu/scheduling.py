@@ -0,0 +1,279 @@
+# encoding=UTF-8
+
+# Copyright © 2008-2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Scheduling of per-page jobs.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+
+class PageScheduler:
+    """
+    Hand out pages to worker threads, and pass their results to the writer in
+    page order.
+
+    Every page has a future, which is completed by the worker that took the
+    page. At most max_buffered pages can be completed but not yet released by
+    the writer; when this limit is reached, workers are only allowed to take
+    the page the writer is waiting for.
+
+    Pages are handed out in order, unless their estimated costs are provided,
+    in which case the most expensive pages are handed out first.
+
+    More pages can be added later with add_pages(), unless the scheduler was
+    created with closed=True (the default) or close() was called. Workers of an
+    open scheduler wait for more pages instead of finishing.
+    """
+
+    def __init__(self, pages=(), max_buffered=None, costs=None, closed=True):
+        self._pages = []
+        self._futures = []
+        self._queue = collections.deque()
+        self._untaken = set()
+        self._max_buffered = max_buffered
+        self._n_buffered = 0
+        self._next = 0
+        self._stopped = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self.seen_exception = False
+        self.wait_time = 0.0
+        self.hol_wait_time = 0.0
+        self.add_pages(pages, costs=costs)
+        self._closed = closed
+
+    def add_pages(self, pages, costs=None):
+        """
+        Add more pages; return index of the first of them.
+
+        Costs are only compared within the same call.
+        """
+        pages = list(pages)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('cannot add pages to a closed scheduler')
+            offset = len(self._pages)
+            order = range(offset, offset + len(pages))
+            if costs is not None:
+                costs = list(costs)
+                if len(costs) != len(pages):
+                    raise ValueError('number of costs does not match number of pages')
+                order = sorted(order, key=lambda i: -costs[i - offset])
+            self._pages += pages
+            self._futures += [concurrent.futures.Future() for _ in pages]
+            self._queue += order
+            self._untaken.update(order)
+            self._condition.notify_all()
+            return offset
+
+    def close(self):
+        """
+        Don't accept any more pages.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get_counts(self):
+        """
+        Return numbers of pages: all of them (total), not taken yet (queued),
+        completed but not released yet (buffered), and released (written).
+        """
+        with self._condition:
+            return dict(
+                total=len(self._pages),
+                queued=len(self._untaken),
+                buffered=self._n_buffered,
+                max_buffered=self._max_buffered,
+                written=self._next,
+            )
+
+    def _full(self):
+        return self._max_buffered is not None and self._n_buffered >= self._max_buffered
+
+    def _pop(self):
+        while True:
+            i = self._queue.popleft()
+            if i in self._untaken:
+                return i
+
+    def take(self, wait=True):
+        """
+        Take a page for processing.
+
+        Return an (index, page) pair, or None if there are no more pages to
+        process. If wait is false, return None also if no page can be taken
+        right now.
+        """
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return
+                if not self._untaken:
+                    if self._closed or not wait:
+                        return
+                    self._condition.wait()
+                    continue
+                if not self._full():
+                    i = self._pop()
+                    break
+                if self._next in self._untaken:
+                    # The writer is stuck on a page that nobody has taken yet.
+                    i = self._next
+                    break
+                if not wait:
+                    return
+                self._condition.wait()
+            self._untaken.remove(i)
+            future = self._futures[i]
+            if not future.set_running_or_notify_cancel():  # no coverage
+                raise RuntimeError(f'page {i} was cancelled')
+            return i, self._pages[i]
+
+    def _complete(self, i, method, value):
+        with self._condition:
+            method(self._futures[i], value)
+            self._n_buffered += 1
+            self._condition.notify_all()
+
+    def set_result(self, i, result):
+        self._complete(i, concurrent.futures.Future.set_result, result)
+
+    def set_exception(self, i, exception):
+        self._complete(i, concurrent.futures.Future.set_exception, exception)
+
+    def wait(self, i):
+        """
+        Wait until the i-th page is completed, and return its future.
+
+        The time spent waiting is added to wait_time; the part of it when
+        results of other pages were ready to be written is also added to
+        hol_wait_time.
+        """
+        future = self._futures[i]
+        with self._condition:
+            while not future.done():
+                blocked = self._n_buffered > 0
+                start = time.monotonic()
+                self._condition.wait()
+                duration = time.monotonic() - start
+                self.wait_time += duration
+                if blocked:
+                    self.hol_wait_time += duration
+        return future
+
+    def release(self, i):
+        """
+        Mark the i-th page as written.
+        """
+        with self._condition:
+            assert i == self._next
+            if not self._futures[i].cancelled():
+                self._n_buffered -= 1
+            self._futures[i] = None
+            self._next += 1
+            self._condition.notify_all()
+
+    def cancel(self, indices):
+        """
+        Don't hand out these pages, if they haven't been taken yet.
+        """
+        with self._condition:
+            for i in indices:
+                if i in self._untaken:
+                    self._untaken.remove(i)
+                    self._futures[i].cancel()
+            self._condition.notify_all()
+
+    def stop(self):
+        """
+        Don't hand out any more pages.
+        """
+        with self._condition:
+            self._stopped = True
+            self._closed = True
+            for i in self._untaken:
+                self._futures[i].cancel()
+            self._untaken.clear()
+            self._condition.notify_all()
+
+
+class ThreadBudget:
+    """
+    Distribute CPUs between concurrently running OCR engine processes.
+
+    Every engine process gets its share of the CPUs that are free at the time
+    it is started. While there are many pages to be processed, the share is
+    small, because there are many jobs competing for the CPUs; near the end of
+    the document the remaining engine processes get more of them.
+    """
+
+    def __init__(self, n_cpus, n_jobs, n_pages):
+        self._n_cpus = n_cpus
+        self._n_jobs = n_jobs
+        self._n_pages = n_pages
+        self._n_started = 0
+        self._n_running = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            free = self._n_cpus - self._in_use
+            # Jobs that could start an engine process in the near future,
+            # including the current one:
+            n_pending = max(1, self._n_pages - self._n_started)
+            n_contenders = max(1, min(self._n_jobs - self._n_running, n_pending))
+            n = max(1, free // n_contenders)
+            self._n_started += 1
+            self._n_running += 1
+            self._in_use += n
+            return n
+
+    def add_pages(self, n):
+        """
+        Account for n more pages to be processed.
+        """
+        with self._lock:
+            self._n_pages += n
+
+    def _release(self, n):
+        with self._lock:
+            self._n_running -= 1
+            self._in_use -= n
+
+    @contextlib.contextmanager
+    def reserve(self):
+        """
+        Reserve CPUs for an engine process; yield their number.
+        """
+        n = self._acquire()
+        try:
+            yield n
+        finally:
+            self._release(n)
+
+
+__all__ = ['PageScheduler', 'ThreadBudget']
+
+# vim:ts=4 sts=4 sw=4 et
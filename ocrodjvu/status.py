@@ -0,0 +1,214 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Live state of an ocrodjvu run, for diagnosing slow or hung jobs.
+"""
+
+import contextlib
+import datetime
+import os
+import shlex
+import threading
+import time
+
+from ocrodjvu import ipc
+
+
+def _format_page(key):
+    path, page_number = key
+    return f'page {page_number} of {path}'
+
+
+def _format_command(args):
+    if isinstance(args, (str, bytes)):
+        args = [args]
+    return str.join(' ', (shlex.quote(os.fsdecode(arg)) for arg in args))
+
+
+class Status:
+    """
+    What every thread is doing, and how far the run got.
+
+    Pages are identified by (path, page number) pairs, as in the report.
+    All the methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # thread name -> (page, stage, start time, pid of a worker process)
+        self._threads = {}
+        self._start_time = time.monotonic()
+        self._n_done = 0
+        self._n_failed = 0
+        self._scheduler = None
+
+    def set_scheduler(self, scheduler):
+        with self._lock:
+            self._scheduler = scheduler
+
+    @contextlib.contextmanager
+    def working(self, key, stage, pid=None):
+        """
+        Record that the current thread is at the stage of processing the page.
+
+        pid is the process identifier of the worker process that does the
+        actual work, if any.
+        """
+        name = threading.current_thread().name
+        with self._lock:
+            old = self._threads.get(name)
+            self._threads[name] = (key, stage, time.monotonic(), pid)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[name] = old or (None, None, time.monotonic(), None)
+
+    def page_done(self, failed=False):
+        with self._lock:
+            self._n_done += 1
+            if failed:
+                self._n_failed += 1
+
+    def format(self):
+        """
+        Return the status as human-readable text.
+        """
+        now = time.monotonic()
+        processes = {}
+        for thread_name, process in ipc.running_processes():
+            processes.setdefault(thread_name, []).append(process)
+        with self._lock:
+            elapsed = now - self._start_time
+            threads = dict(self._threads)
+            n_done = self._n_done
+            n_failed = self._n_failed
+            scheduler = self._scheduler
+        timestamp = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+        lines = [f'ocrodjvu (pid {os.getpid()}) status at {timestamp}, after {elapsed:.1f} s:']
+        throughput = n_done / elapsed if elapsed > 0 else 0.0
+        summary = f'pages: {n_done} done ({n_failed} failed), {throughput:.2f} pages/s'
+        if scheduler is not None:
+            counts = scheduler.get_counts()
+            max_buffered = counts['max_buffered']
+            max_buffered = 'unlimited' if max_buffered is None else max_buffered
+            summary += (
+                f'; {counts["queued"]} queued, {counts["written"]} written, '
+                f'{counts["buffered"]} in the reorder buffer (max: {max_buffered})'
+            )
+        lines += [summary]
+        for name in sorted(set(threads) | set(processes)):
+            key, stage, start, pid = threads.get(name, (None, None, None, None))
+            if key is None:
+                line = f'{name}: idle'
+            else:
+                line = f'{name}: {_format_page(key)}: {stage}'
+            if start is not None:
+                line += f' for {now - start:.1f} s'
+            lines += [line]
+            if pid is not None:
+                lines += [f'    worker process {pid}']
+            for process in processes.get(name, ()):
+                lines += [f'    pid {process.pid}, running for {now - process.start_time:.1f} s: {_format_command(process.args)}']
+        return str.join('\n', lines) + '\n'
+
+    def write(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt', encoding='UTF-8') as file:
+            file.write(self.format())
+        os.replace(tmp_path, path)
+
+
+class StatusPrinter:
+    """
+    Thread that prints the status to a file on request.
+
+    request() is safe to call from a signal handler: it only wakes up the
+    thread, which formats and prints the status.
+    """
+
+    def __init__(self, status, file):
+        self._status = status
+        self._file = file
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._write_fd, False)
+        self._thread = threading.Thread(target=self._run, name='status-printer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def request(self):
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            # Plenty of requests are pending already.
+            pass
+
+    def _run(self):
+        while os.read(self._read_fd, 4096):
+            self._file.write(self._status.format())
+            self._file.flush()
+
+    def stop(self):
+        """
+        Stop the thread, after it has printed the pending requests.
+        """
+        os.close(self._write_fd)
+        self._thread.join()
+        os.close(self._read_fd)
+
+
+class StatusWriter:
+    """
+    Thread that writes the status to a file periodically.
+    """
+
+    def __init__(self, status, path, interval):
+        self._status = status
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='status-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def write(self):
+        self._status.write(self._path)
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError:
+                # Perhaps the directory is temporarily unavailable; the next
+                # attempt might succeed.
+                pass
+            if self._stopped.wait(self._interval):
+                return
+
+    def stop(self):
+        """
+        Stop the thread, and write the final status.
+        """
+        self._stopped.set()
+        self._thread.join()
+        self.write()
+
+
+__all__ = ['Status', 'StatusPrinter', 'StatusWriter']
+
+# vim:ts=4 sts=4 sw=4 et
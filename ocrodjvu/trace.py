@@ -0,0 +1,130 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Timeline of an ocrodjvu run, in the Chrome trace event format.
+
+The trace can be viewed with https://ui.perfetto.dev/ or chrome://tracing.
+Every thread has its own track. Timestamps are taken from the monotonic
+clock, which is shared by all processes, so traces of worker processes can
+be merged into the main one.
+"""
+
+import json
+import os
+import threading
+
+try:
+    _get_thread_id = threading.get_native_id
+except AttributeError:  # no coverage
+    # Only Python identifiers of threads are available. They are still
+    # unique within a process, which is enough for the trace.
+    _get_thread_id = threading.get_ident
+
+
+class Trace:
+    """
+    Collector of trace events.
+
+    All the methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = set()
+
+    def _get_ids(self):
+        """
+        Return (pid, tid) of the current thread, registering its name if
+        needed. The lock must be held.
+        """
+        ids = os.getpid(), _get_thread_id()
+        if ids not in self._threads:
+            self._threads.add(ids)
+            pid, tid = ids
+            self._events += [dict(name='thread_name', ph='M', pid=pid, tid=tid, args=dict(name=threading.current_thread().name))]
+        return ids
+
+    def add_span(self, name, start, end, **args):
+        """
+        Add a span of the current thread.
+
+        start and end are time.monotonic() values.
+        """
+        with self._lock:
+            pid, tid = self._get_ids()
+            self._events += [dict(name=name, ph='X', pid=pid, tid=tid, ts=start * 1e6, dur=(end - start) * 1e6, args=args)]
+
+    def add_process(self, process):
+        """
+        Add a span for the subprocess (ipc.Subprocess) run by the current
+        thread.
+        """
+        if process.end_time is None:
+            return
+        command = process.args
+        if isinstance(command, (str, bytes)):
+            command = [command]
+        command = [os.fsdecode(arg) for arg in command]
+        self.add_span(os.path.basename(command[0]), process.start_time, process.end_time, pid=process.pid, command=command)
+
+    def pop_events(self):
+        """
+        Remove the events collected so far, and return them.
+
+        Thread names are registered only in the first batch of events of
+        every thread, so all batches should be merged into the same trace.
+        """
+        with self._lock:
+            events = self._events
+            self._events = []
+        return events
+
+    def merge_events(self, events):
+        """
+        Add events returned by pop_events(), possibly by another process.
+        """
+        with self._lock:
+            self._events += events
+
+    def write(self, path):
+        with self._lock:
+            events = list(self._events)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt', encoding='UTF-8') as file:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), file)
+            file.write('\n')
+        os.replace(tmp_path, path)
+
+
+class NullTrace(Trace):
+    """
+    Trace that doesn't collect anything.
+    """
+
+    def add_span(self, name, start, end, **args):
+        pass
+
+    def add_process(self, process):
+        pass
+
+    def merge_events(self, events):
+        pass
+
+
+__all__ = ['Trace', 'NullTrace']
+
+# vim:ts=4 sts=4 sw=4 et
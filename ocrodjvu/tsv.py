@@ -0,0 +1,183 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+"""
+Process TSV output of Tesseract.
+
+Every line of the output describes one element of the page layout: its
+level (page, block, paragraph, line or word), its position in the layout
+tree, its bounding box, recognition confidence and (for words) text. The
+lines are in document order, so the text zones can be built in a single
+pass, without constructing any intermediate tree.
+"""
+
+import functools
+
+from ocrodjvu import errors
+from ocrodjvu import text_zones
+from ocrodjvu import unicode_support
+
+
+const = text_zones.const
+
+TEXT_DETAILS_LINE = const.TEXT_ZONE_LINE
+TEXT_DETAILS_WORD = const.TEXT_ZONE_WORD
+TEXT_DETAILS_CHARACTER = const.TEXT_ZONE_CHARACTER
+
+HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext'
+
+LEVEL_PAGE = 1
+LEVEL_WORD = 5
+
+LEVEL_TO_DJVU = {
+    LEVEL_PAGE: const.TEXT_ZONE_PAGE,
+    2: const.TEXT_ZONE_COLUMN,
+    3: const.TEXT_ZONE_PARAGRAPH,
+    4: const.TEXT_ZONE_LINE,
+}
+
+
+class ExtractSettings:
+
+    def __init__(self, rotation=0, details=TEXT_DETAILS_WORD, uax29=None, **kwargs):
+        self.rotation = rotation
+        self.details = details
+        if uax29 is not None:
+            icu = unicode_support.get_icu()
+            if uax29 is True:
+                uax29 = icu.Locale('en-US-POSIX')
+            else:
+                uax29 = icu.Locale(uax29)
+        self.uax29 = uax29
+
+
+def is_tsv(stream):
+    """
+    Check if the (seekable) stream contains Tesseract TSV output.
+    """
+    position = stream.tell()
+    line = stream.readline()
+    stream.seek(position)
+    return line.rstrip('\r\n') == HEADER
+
+
+def _parse_row(line):
+    fields = line.rstrip('\r\n').split('\t', 11)
+    if len(fields) == 11:
+        # Some Tesseract versions omit empty text.
+        fields += ['']
+    if len(fields) != 12:
+        raise errors.MalformedOcrOutputError(f'unexpected number of TSV fields: {len(fields)}')
+    # Confidence is validated, but otherwise unused,
+    # as there's no place for it in the DjVu text layer.
+    try:
+        level = int(fields[0])
+        x0, y0, w, h = map(int, fields[6:10])
+        conf = float(fields[10])
+    except ValueError:
+        raise errors.MalformedOcrOutputError('non-numeric TSV field')
+    return level, text_zones.BBox(x0, y0, x0 + w, y0 + h), conf, fields[11]
+
+
+class _Builder:
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.break_iterator = functools.partial(unicode_support.word_break_iterator, locale=settings.uax29)
+        self.pages = []
+        # Stack of (level, bbox, children) of the currently open zones:
+        self.stack = []
+
+    def open(self, level, bbox):
+        while self.stack and self.stack[-1][0] >= level:
+            self.close()
+        if level == LEVEL_PAGE:
+            if (bbox.x0, bbox.y0) != (0, 0):
+                raise errors.MalformedOcrOutputError("page's bounding box should start with (0, 0)")
+        elif not self.stack:
+            raise errors.MalformedOcrOutputError('text zone outside of a page')
+        self.stack += [(level, bbox, [])]
+
+    def add_word(self, bbox, text):
+        if not self.stack or self.stack[-1][0] != LEVEL_WORD - 1:
+            raise errors.MalformedOcrOutputError('word outside of a line')
+        if not text:
+            return
+        children = self.stack[-1][2]
+        # Words need to be regrouped anyway, just like in hOCR.
+        children += [text_zones.Zone(type_=const.TEXT_ZONE_CHARACTER, bbox=bbox, children=[text]), ' ']
+
+    def close(self):
+        level, bbox, children = self.stack.pop()
+        djvu_class = LEVEL_TO_DJVU[level]
+        if djvu_class is const.TEXT_ZONE_PAGE:
+            # Bounding box of the whole page is not affected by its children.
+            self.pages += [text_zones.Zone(type_=djvu_class, bbox=bbox, children=children)]
+            return
+        if not children:
+            return
+        for child in children:
+            if isinstance(child, text_zones.Zone):
+                bbox.update(child.bbox)
+        if djvu_class is const.TEXT_ZONE_LINE:
+            del children[-1]
+            children = text_zones.group_words(children, self.settings.details, self.break_iterator)
+            if not children:
+                return
+        self.stack[-1][2].append(text_zones.Zone(type_=djvu_class, bbox=bbox, children=children))
+
+    def finish(self):
+        while self.stack:
+            self.close()
+        return self.pages
+
+
+def scan(stream, settings):
+    builder = _Builder(settings)
+    for n, line in enumerate(stream):
+        if n == 0 and line.rstrip('\r\n') == HEADER:
+            continue
+        if not line.strip():
+            continue
+        level, bbox, _, text = _parse_row(line)
+        if level == LEVEL_WORD:
+            builder.add_word(bbox, text)
+        elif level in LEVEL_TO_DJVU:
+            builder.open(level, bbox)
+        else:
+            raise errors.MalformedOcrOutputError(f'unknown TSV level: {level}')
+    pages = builder.finish()
+    for zone in pages:
+        zone.rotate(settings.rotation)
+    return pages
+
+
+def extract_text(stream, **kwargs):
+    """
+    Extract DjVu text from a Tesseract TSV stream.
+
+    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
+    uax29: None or a PyICU locale
+    """
+    settings = ExtractSettings(**kwargs)
+    return [zone.sexpr for zone in scan(stream, settings)]
+
+
+__all__ = [
+    'extract_text', 'is_tsv',
+    'TEXT_DETAILS_LINE', 'TEXT_DETAILS_WORD', 'TEXT_DETAILS_CHARACTER'
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -14,7 +14,9 @@
 # for more details.
 
 import functools
+import hashlib
 import locale
+import math
 import os
 import re
 import warnings
@@ -176,21 +178,130 @@ class Property:
         return
 
 
-def get_cpu_count():
+def _read_cgroup_file(path):
     try:
-        import multiprocessing
-        return multiprocessing.cpu_count()
-    except (ImportError, NotImplementedError):  # no coverage
-        pass
-    try:  # no coverage
-        return os.sysconf('SC_NPROCESSORS_ONLN')
-    except (ValueError, OSError, AttributeError):  # no coverage
-        return 1
+        with open(path, 'rt') as file:
+            return file.read()
+    except (OSError, UnicodeError):
+        return
 
 
-def get_thread_limit(nitems, njobs):
-    if nitems == 0:
-        return 1
-    return max(1, njobs // nitems)
+def _get_cgroup_hierarchies(root, proc_path):
+    """
+    Return a list of (mount point, cgroup directory, v1?) tuples
+    for the cgroup hierarchies that can control CPU usage of this process.
+    """
+    v1 = v2 = None
+    for line in (_read_cgroup_file(proc_path) or '').splitlines():
+        try:
+            [hierarchy_id, controllers, path] = line.split(':', 2)
+        except ValueError:
+            continue
+        if hierarchy_id == '0' and not controllers:
+            v2 = (root, path, False)
+        elif 'cpu' in controllers.split(','):
+            v1 = (os.path.join(root, controllers), path, True)
+    # On hybrid systems, the cpu controller can be bound only to the v1 hierarchy.
+    hierarchy = v1 or v2
+    if hierarchy is None:
+        # /proc/self/cgroup is not available; look at the top-level cgroup only.
+        return [
+            (root, root, False),
+            (os.path.join(root, 'cpu'), os.path.join(root, 'cpu'), True),
+            (os.path.join(root, 'cpu,cpuacct'), os.path.join(root, 'cpu,cpuacct'), True),
+        ]
+    mount_point, path, v1 = hierarchy
+    directory = os.path.join(mount_point, path.lstrip('/'))
+    if not os.path.isdir(directory):
+        # The path is relative to a different cgroup namespace,
+        # as it happens in some containers.
+        directory = mount_point
+    return [(mount_point, directory, v1)]
+
+
+def _get_cgroup_cpu_quota(directory, v1):
+    if v1:
+        quota = _read_cgroup_file(os.path.join(directory, 'cpu.cfs_quota_us'))
+        period = _read_cgroup_file(os.path.join(directory, 'cpu.cfs_period_us'))
+        if quota is None or period is None:
+            return
+        fields = (quota + period).split()
+    else:
+        fields = (_read_cgroup_file(os.path.join(directory, 'cpu.max')) or '').split()
+    try:
+        quota, period = fields
+        if quota == 'max':
+            return
+        quota = int(quota)
+        period = int(period)
+    except ValueError:
+        return
+    if quota <= 0 or period <= 0:
+        return
+    return quota / period
+
+
+def get_cpu_quota(root='/sys/fs/cgroup', proc_path='/proc/self/cgroup'):
+    """
+    Return the CPU quota (as the number of CPUs, not necessarily integer)
+    imposed on the cgroup of the current process or any of its ancestors,
+    or None if there is no quota.
+    """
+    quotas = []
+    for mount_point, directory, v1 in _get_cgroup_hierarchies(root, proc_path):
+        mount_point = os.path.normpath(mount_point)
+        directory = os.path.normpath(directory)
+        while True:
+            quota = _get_cgroup_cpu_quota(directory, v1)
+            if quota is not None:
+                quotas += [quota]
+            parent = os.path.dirname(directory)
+            if directory == mount_point or parent == directory:
+                break
+            directory = parent
+    if not quotas:
+        return
+    return min(quotas)
+
+
+def file_digest(path):
+    """
+    Return SHA-256 of the file contents, as bytes.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def get_cpu_count():
+    """
+    Return the number of CPUs the current process can use, taking CPU
+    affinity and cgroup CPU quota into account.
+    """
+    n = None
+    try:
+        n = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):  # no coverage
+        pass
+    if not n:  # no coverage
+        try:
+            import multiprocessing
+            n = multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError):
+            pass
+    if not n:  # no coverage
+        try:
+            n = os.sysconf('SC_NPROCESSORS_ONLN')
+        except (ValueError, OSError, AttributeError):
+            n = 1
+    quota = get_cpu_quota()
+    if quota is not None:
+        n = min(n, math.ceil(quota))
+    return max(n, 1)
 
 # vim:ts=4 sts=4 sw=4 et
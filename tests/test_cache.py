@@ -0,0 +1,117 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import errno
+import os
+
+from ocrodjvu import cache
+from ocrodjvu import temporary
+
+from tests.tools import mock, TestCase
+
+
+class MakeKeyTestCase(TestCase):
+
+    def test_make_key(self):
+        key = cache.make_key(b'eggs', 'ham')
+        self.assertEqual(key, cache.make_key('eggs', b'ham'))
+        self.assertNotEqual(key, cache.make_key('eggsham'))
+        self.assertNotEqual(key, cache.make_key('egg', 'sham'))
+
+
+class CacheTestCase(TestCase):
+
+    def test_get_put(self):
+        with temporary.directory() as tmpdir:
+            ocr_cache = cache.Cache(tmpdir, 1 << 20)
+            key = cache.make_key('eggs')
+            self.assertIsNone(ocr_cache.get(key))
+            ocr_cache.put(key, b'ham')
+            self.assertEqual(ocr_cache.get(key), b'ham')
+            self.assertEqual((ocr_cache.hits, ocr_cache.misses), (1, 1))
+            # The cache is persistent:
+            ocr_cache = cache.Cache(tmpdir, 1 << 20)
+            self.assertEqual(ocr_cache.get(key), b'ham')
+
+    def test_eviction(self):
+        with temporary.directory() as tmpdir:
+            ocr_cache = cache.Cache(tmpdir, 30)
+            keys = [cache.make_key(str(i)) for i in range(3)]
+            for i, key in enumerate(keys):
+                ocr_cache.put(key, b'x' * 10)
+                # Make sure modification times are distinct.
+                os.utime(ocr_cache._path(key), ns=(i, i))
+            # Use the oldest entry, so that it's no longer the least recently used one.
+            self.assertIsNotNone(ocr_cache.get(keys[0]))
+            ocr_cache.put(cache.make_key('3'), b'x' * 10)
+            self.assertIsNotNone(ocr_cache.get(keys[0]))
+            self.assertIsNone(ocr_cache.get(keys[1]))
+            self.assertIsNone(ocr_cache.get(keys[2]))
+            self.assertIsNotNone(ocr_cache.get(cache.make_key('3')))
+
+    def test_overwrite(self):
+        with temporary.directory() as tmpdir:
+            ocr_cache = cache.Cache(tmpdir, 30)
+            key = cache.make_key('eggs')
+            for i in range(5):
+                ocr_cache.put(key, b'x' * 10)
+            self.assertEqual(ocr_cache._size, 10)
+            ocr_cache.put(cache.make_key('ham'), b'x' * 10)
+            self.assertIsNotNone(ocr_cache.get(key))
+
+    def test_size_shared(self):
+        with temporary.directory() as tmpdir:
+            ocr_cache = cache.Cache(tmpdir, 30)
+            keys = [cache.make_key(str(i)) for i in range(3)]
+            ocr_cache.put(keys[0], b'x' * 14)
+            # Removed by another process:
+            os.unlink(ocr_cache._path(keys[0]))
+            ocr_cache.put(keys[1], b'x' * 14)
+            ocr_cache.put(keys[2], b'x' * 14)
+            # The local size counter was too high, but nothing needed to be evicted:
+            self.assertEqual(ocr_cache._size, 28)
+            self.assertIsNotNone(ocr_cache.get(keys[1]))
+            self.assertIsNotNone(ocr_cache.get(keys[2]))
+
+    def test_discard(self):
+        with temporary.directory() as tmpdir:
+            ocr_cache = cache.Cache(tmpdir, 1 << 20)
+            key = cache.make_key('eggs')
+            ocr_cache.put(key, b'ham')
+            self.assertEqual(ocr_cache.get(key), b'ham')
+            with self.assertLogs('ocrodjvu.main', level='WARNING'):
+                ocr_cache.discard(key)
+            self.assertEqual((ocr_cache.hits, ocr_cache.misses), (0, 1))
+            self.assertIsNone(ocr_cache.get(key))
+
+    def test_io_errors(self):
+        with temporary.directory() as tmpdir:
+            ocr_cache = cache.Cache(tmpdir, 1 << 20)
+            key = cache.make_key('eggs')
+            with mock.patch('tempfile.mkstemp', side_effect=OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))):
+                with self.assertLogs('ocrodjvu.main', level='WARNING') as logs:
+                    ocr_cache.put(key, b'ham')
+            [message] = logs.output
+            self.assertIn(os.strerror(errno.ENOSPC), message)
+            self.assertIsNone(ocr_cache.get(key))
+            ocr_cache.put(key, b'ham')
+            with mock.patch('os.utime', side_effect=PermissionError(errno.EPERM, os.strerror(errno.EPERM))):
+                self.assertEqual(ocr_cache.get(key), b'ham')
+            with mock.patch('builtins.open', side_effect=PermissionError(errno.EACCES, os.strerror(errno.EACCES))):
+                with self.assertLogs('ocrodjvu.main', level='WARNING'):
+                    self.assertIsNone(ocr_cache.get(key))
+            self.assertEqual((ocr_cache.hits, ocr_cache.misses), (1, 2))
+
+# vim:ts=4 sts=4 sw=4 et
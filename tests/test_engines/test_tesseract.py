@@ -0,0 +1,278 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import os
+import shutil
+
+from ocrodjvu.engines import common
+from ocrodjvu.engines import tesseract
+from ocrodjvu import engines
+from ocrodjvu import errors
+from ocrodjvu import image_io
+from ocrodjvu import ipc
+from ocrodjvu import temporary
+from ocrodjvu import text_zones
+
+from tests.tools import mock, TestCase
+
+
+class ParseVersionTestCase(TestCase):
+
+    def test_parse(self):
+        self.assertEqual(tesseract.parse_version('tesseract 3.02.01\n'), (3, 2))
+        self.assertEqual(tesseract.parse_version('tesseract 4.1.1\n leptonica-1.79.0\n'), (4, 1))
+        self.assertEqual(tesseract.parse_version('tesseract v5.0.0-alpha.20201127\n'), (5, 0))
+        self.assertIsNone(tesseract.parse_version('tesseract: command not found\n'))
+
+
+class GetEngineTestCase(TestCase):
+
+    def test_get_engine(self):
+        self.assertIs(engines.get_engine('tesseract'), tesseract.Engine)
+        for name in 'common', 'nonexistent', '../tesseract', 'tesseract_api':
+            with self.subTest(name=name):
+                self.assertIsNone(engines.get_engine(name))
+
+
+class ProbeCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        self.tessdata = os.path.join(self.tmpdir, 'tessdata')
+        os.mkdir(self.tessdata)
+        self._add_language('eng')
+        self.probe_cache = common.ProbeCache(os.path.join(self.tmpdir, 'cache', 'engines.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _add_language(self, language):
+        with open(os.path.join(self.tessdata, f'{language}.traineddata'), 'wb'):
+            pass
+        # Make sure that the directory modification time changes:
+        stat = os.stat(self.tessdata)
+        os.utime(self.tessdata, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    def _make_engine(self, stamp='tesseract:1:1'):
+        with mock.patch.object(common, 'probe_cache', self.probe_cache), \
+                mock.patch.object(common, 'get_executable_stamp', return_value=stamp), \
+                mock.patch.object(tesseract.Engine, '_probe_version', return_value=(4, 1)), \
+                mock.patch.object(tesseract.Engine, 'get_filesystem_info', return_value=(self.tessdata, 'traineddata')) as probe:
+            engine = tesseract.Engine()
+        return engine, probe.call_count
+
+    def test_cache(self):
+        engine, n_probes = self._make_engine()
+        self.assertEqual(n_probes, 1)
+        self.assertEqual(list(engine.list_languages()), ['eng'])
+        self.assertEqual(engine.get_version(), (4, 1))
+        engine, n_probes = self._make_engine()
+        self.assertEqual(n_probes, 0)
+        self.assertEqual(list(engine.list_languages()), ['eng'])
+        self.assertEqual(engine.get_version(), (4, 1))
+        # The executable changed:
+        engine, n_probes = self._make_engine(stamp='tesseract:2:2')
+        self.assertEqual(n_probes, 1)
+        # A language pack was installed:
+        self._add_language('deu')
+        engine, n_probes = self._make_engine(stamp='tesseract:2:2')
+        self.assertEqual(n_probes, 1)
+        self.assertEqual(sorted(engine.list_languages()), ['deu', 'eng'])
+
+    def test_no_executable(self):
+        for i in range(2):
+            engine, n_probes = self._make_engine(stamp=None)
+            self.assertEqual(n_probes, 1)
+        self.assertFalse(os.path.exists(self.probe_cache.path))
+
+
+class SplitHocrTestCase(TestCase):
+
+    header = "<html><head><meta name='ocr-system' content='tesseract 5.0.0' /></head>\n<body>\n"
+    footer = '</body>\n</html>\n'
+
+    def test_split(self):
+        pages = [
+            f"<div class='ocr_page' id='page_{n}' title='image \"{n}.tif\"; bbox 0 0 1 1'>\n</div>\n"
+            for n in (1, 2, 3)
+        ]
+        result = tesseract.split_hocr(self.header + ''.join(pages) + self.footer)
+        self.assertEqual(result, [self.header + page + self.footer for page in pages])
+
+    def test_no_pages(self):
+        with self.assertRaises(errors.MalformedHocrError):
+            tesseract.split_hocr(self.header + self.footer)
+
+
+class SplitTsvTestCase(TestCase):
+
+    header = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+
+    def test_split(self):
+        pages = [
+            f'1\t{n}\t0\t0\t0\t0\t0\t0\t10\t10\t-1\t\n' + f'2\t{n}\t1\t0\t0\t0\t1\t1\t5\t5\t-1\t\n'
+            for n in (1, 2, 3)
+        ]
+        result = tesseract.split_tsv(self.header + ''.join(pages))
+        self.assertEqual(result, [self.header + page for page in pages])
+
+    def test_no_pages(self):
+        self.assertEqual(tesseract.split_tsv(self.header), [])
+        with self.assertRaises(errors.MalformedOcrOutputError):
+            tesseract.split_tsv(self.header + '2\t1\t1\t0\t0\t0\t1\t1\t5\t5\t-1\t\n')
+
+
+def _make_engine(tmpdir):
+    # Neither use the user's probe cache, nor run Tesseract:
+    probe_cache = common.ProbeCache(os.path.join(tmpdir, 'cache', 'engines.json'))
+    with mock.patch.object(common, 'probe_cache', probe_cache), \
+            mock.patch.object(common, 'get_executable_stamp', return_value=None), \
+            mock.patch.object(tesseract.Engine, '_probe_version', return_value=None), \
+            mock.patch.object(tesseract.Engine, 'get_filesystem_info', return_value=('/nonexistent', 'traineddata')):
+        return tesseract.Engine()
+
+
+class RecognizeBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = temporary.raw.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.engine = _make_engine(self.tmpdir)
+        self.images = [mock.Mock(name=f'{n}.tif') for n in range(3)]
+
+    def test_batch(self):
+        outputs = [common.Output(str(n), format_='html') for n in range(3)]
+        with mock.patch.object(self.engine, '_recognize_hocr_batch', return_value=outputs) as batch:
+            with mock.patch.object(self.engine, 'recognize') as recognize:
+                results = self.engine.recognize_batch(self.images, 'eng')
+        self.assertEqual(results, outputs)
+        batch.assert_called_once_with(self.images, 'eng')
+        recognize.assert_not_called()
+
+    def test_batch_char_boxes(self):
+        outputs = [common.Output(str(n), format_='html') for n in range(3)]
+        with mock.patch.object(self.engine, 'get_version', return_value=(4, 1)):
+            with mock.patch.object(self.engine, '_recognize_hocr_batch', return_value=outputs) as batch:
+                results = self.engine.recognize_batch(self.images, 'eng', details=text_zones.TEXT_DETAILS_CHARACTER)
+        self.assertEqual(results, outputs)
+        batch.assert_called_once_with(self.images, 'eng', char_boxes=True)
+
+    def test_no_batch_makebox(self):
+        outputs = [common.Output(str(n), format_='html') for n in range(3)]
+        with mock.patch.object(self.engine, 'get_version', return_value=(3, 5)):
+            with mock.patch.object(self.engine, '_recognize_hocr_batch') as batch:
+                with mock.patch.object(self.engine, 'recognize', side_effect=outputs):
+                    results = self.engine.recognize_batch(self.images, 'eng', details=text_zones.TEXT_DETAILS_CHARACTER)
+        self.assertEqual(results, outputs)
+        batch.assert_not_called()
+
+    def test_batch_tsv(self):
+        self.engine._tsv = mock.Mock()
+        outputs = [common.Output(str(n), format_='tsv') for n in range(3)]
+        with mock.patch.object(self.engine, '_recognize_tsv_batch', return_value=outputs) as batch:
+            results = self.engine.recognize_batch(self.images, 'eng')
+        self.assertEqual(results, outputs)
+        batch.assert_called_once_with(self.images, 'eng')
+
+    def test_error_attribution(self):
+        error = ipc.CalledProcessError(1, 'tesseract')
+
+        def recognize(image, language, **kwargs):
+            if image is self.images[1]:
+                raise error
+            return common.Output('', format_='html')
+
+        with mock.patch.object(self.engine, '_recognize_hocr_batch', side_effect=error):
+            with mock.patch.object(self.engine, 'recognize', side_effect=recognize):
+                results = self.engine.recognize_batch(self.images, 'eng')
+        self.assertIsInstance(results[0], common.Output)
+        self.assertIs(results[1], error)
+        self.assertIsInstance(results[2], common.Output)
+
+    def test_fallback_recognize(self):
+        error = errors.MalformedOcrOutputError('expected 3 pages, got 2')
+        outputs = [common.Output(str(n), format_='html') for n in range(3)]
+        recognize = mock.Mock(side_effect=outputs)
+        with mock.patch.object(self.engine, '_recognize_hocr_batch', side_effect=error):
+            with mock.patch.object(self.engine, 'recognize') as engine_recognize:
+                results = self.engine.recognize_batch(self.images, 'eng', recognize=recognize)
+        self.assertEqual(results, outputs)
+        self.assertEqual([args[0] for args, _ in recognize.call_args_list], self.images)
+        engine_recognize.assert_not_called()
+
+    def test_timeout(self):
+        error = ipc.CalledProcessTimeout(10, 'tesseract')
+        with mock.patch.object(self.engine, '_recognize_hocr_batch', side_effect=error):
+            with mock.patch.object(self.engine, 'recognize') as recognize:
+                with self.assertRaises(ipc.CalledProcessTimeout):
+                    self.engine.recognize_batch(self.images, 'eng')
+        recognize.assert_not_called()
+
+
+class PipeTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = temporary.raw.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.engine = _make_engine(self.tmpdir)
+        self.engine._user_to_tesseract = dict(eng='eng')
+
+    def test_uses_pipes(self):
+        for version, batch_size, pipes, expected in [
+            ((4, 1), 1, 1, True),
+            ((3, 3), 1, 1, True),
+            ((3, 2), 1, 1, False),
+            (None, 1, 1, False),
+            ((4, 1), 2, 1, False),
+            ((4, 1), 1, 0, False),
+        ]:
+            with self.subTest(version=version, batch_size=batch_size, pipes=pipes):
+                self.engine.batch_size = batch_size
+                self.engine.pipes = pipes
+                with mock.patch.object(self.engine, 'get_version', return_value=version):
+                    self.assertIs(self.engine.uses_pipes(), expected)
+
+    def test_recognize(self):
+        # Fake Tesseract that prints its arguments and then the image:
+        executable = os.path.join(self.tmpdir, 'tesseract')
+        with open(executable, 'wt') as file:
+            file.write('#!/bin/sh\necho "$@"\nexec cat\n')
+        os.chmod(executable, 0o755)
+        self.engine.executable = executable
+        image = image_io.EncodedImage(b'<image>', 'tif')
+        with mock.patch.object(self.engine, 'get_version', return_value=(4, 1)):
+            result = self.engine.recognize_hocr(image, 'eng')
+            self.assertEqual(str(result), 'stdin stdout -l eng -c tessedit_create_hocr=T\n<image>')
+            result = self.engine.recognize_hocr(image, 'eng', details=text_zones.TEXT_DETAILS_CHARACTER)
+            self.assertEqual(str(result), 'stdin stdout -l eng -c tessedit_create_hocr=T -c hocr_char_boxes=1\n<image>')
+            result = self.engine.recognize_tsv(image, 'eng')
+            self.assertEqual(str(result), 'stdin stdout -l eng -c tessedit_create_tsv=1\n<image>')
+
+    def test_many_warnings(self):
+        # Fake Tesseract that fills the stderr pipe before printing anything:
+        executable = os.path.join(self.tmpdir, 'tesseract')
+        with open(executable, 'wt') as file:
+            file.write('#!/bin/sh\nyes Warning | head -n 100000 >&2\nexec cat\n')
+        os.chmod(executable, 0o755)
+        self.engine.executable = executable
+        image = image_io.EncodedImage(b'<image>', 'tif')
+        with mock.patch.object(self.engine, 'get_version', return_value=(4, 1)):
+            with mock.patch('sys.stderr', io.StringIO()) as stderr:
+                result = self.engine.recognize_hocr(image, 'eng')
+        self.assertEqual(str(result), '<image>')
+        self.assertEqual(stderr.getvalue().count('tesseract: Warning\n'), 100000)
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,115 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import ctypes
+import os
+import shutil
+
+from ocrodjvu.engines import tesseract_api
+from ocrodjvu import errors
+from ocrodjvu import image_io
+from ocrodjvu import temporary
+from ocrodjvu import text_zones
+
+from tests.tools import mock, TestCase
+
+
+class TesseractApiTestCase(TestCase):
+
+    hocr_page = "<div class='ocr_page' id='page_1' title='bbox 0 0 8 1'></div>\n"
+
+    def setUp(self):
+        self.tmpdir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        for language in 'eng', 'deu':
+            with open(os.path.join(self.tmpdir, f'{language}.traineddata'), 'wb'):
+                pass
+        self.buffers = []
+        lib = self.lib = mock.Mock()
+        lib.TessVersion.return_value = b'5.0.0'
+        lib.TessBaseAPIInit3.return_value = 0
+        lib.TessBaseAPIRecognize.return_value = 0
+        lib.TessBaseAPIGetHOCRText.side_effect = lambda handle, n: self._make_text(self.hocr_page)
+        lib.TessBaseAPIGetBoxText.side_effect = lambda handle, n: self._make_text('x 0 0 1 1 0\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _make_text(self, s):
+        buffer = ctypes.create_string_buffer(s.encode('UTF-8'))
+        self.buffers += [buffer]
+        return ctypes.addressof(buffer)
+
+    def _make_engine(self):
+        with mock.patch.object(tesseract_api, '_load_library', return_value=self.lib):
+            return tesseract_api.Engine(datapath=self.tmpdir)
+
+    def test_not_found(self):
+        with self.assertRaises(errors.EngineNotFoundError):
+            tesseract_api.Engine(datapath=self.tmpdir, library='/nonexistent/libtesseract.so')
+
+    def test_languages(self):
+        engine = self._make_engine()
+        self.assertEqual(sorted(engine.list_languages()), ['deu', 'eng'])
+        engine.check_language('ger')
+        with self.assertRaises(errors.MissingLanguagePackError):
+            engine.check_language('tlh')
+
+    def test_recognize(self):
+        engine = self._make_engine()
+        image = image_io.RawImage(b'\x0F', (8, 1), 1, 300)
+        for details in text_zones.TEXT_DETAILS_WORD, text_zones.TEXT_DETAILS_CHARACTER:
+            with self.subTest(details=details):
+                result = engine.recognize(image, 'eng', details=details)
+                self.assertEqual(result.format, 'html')
+                contents = str(result)
+                self.assertIn(self.hocr_page, contents)
+                self.assertIn("content='tesseract 5.0.0'", contents)
+                # Bounding boxes of characters are in hOCR itself:
+                self.assertNotIn('x-ocrodjvu-tesseract', contents)
+                char_boxes = b'1' if details == text_zones.TEXT_DETAILS_CHARACTER else b'0'
+                self.lib.TessBaseAPISetVariable.assert_called_with(mock.ANY, b'hocr_char_boxes', char_boxes)
+        self.lib.TessBaseAPIGetBoxText.assert_not_called()
+        # The language model is loaded only once:
+        self.assertEqual(self.lib.TessBaseAPIInit3.call_count, 1)
+        [args, _] = self.lib.TessBaseAPISetImage.call_args
+        # Pixels are inverted for Tesseract:
+        self.assertEqual(args[1:], (b'\xF0', 8, 1, 0, 1))
+
+    def test_recognize_box_file(self):
+        self.lib.TessVersion.return_value = b'3.05.02'
+        engine = self._make_engine()
+        image = image_io.RawImage(b'\0\0\0', (1, 1), 24, 300)
+        for details in text_zones.TEXT_DETAILS_WORD, text_zones.TEXT_DETAILS_CHARACTER:
+            with self.subTest(details=details):
+                contents = str(engine.recognize(image, 'eng', details=details))
+                self.assertEqual('x-ocrodjvu-tesseract' in contents, details == text_zones.TEXT_DETAILS_CHARACTER)
+        self.lib.TessBaseAPISetVariable.assert_not_called()
+
+    def test_no_batches(self):
+        with self.assertRaises(AttributeError):
+            with mock.patch.object(tesseract_api, '_load_library', return_value=self.lib):
+                tesseract_api.Engine(datapath=self.tmpdir, batch_size=2)
+        engine = self._make_engine()
+        self.assertIsNone(engine.batch_size)
+        self.assertFalse(engine.uses_pipes())
+
+    def test_init_failure(self):
+        self.lib.TessBaseAPIInit3.return_value = -1
+        engine = self._make_engine()
+        image = image_io.RawImage(b'\0\0\0', (1, 1), 24, 300)
+        with self.assertRaises(errors.EngineError):
+            engine.recognize(image, 'eng')
+
+# vim:ts=4 sts=4 sw=4 et
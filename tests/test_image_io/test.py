@@ -21,6 +21,7 @@ from PIL import Image
 import djvu.decode
 
 from ocrodjvu import image_io
+from ocrodjvu import temporary
 
 from tests.tools import sorted_glob, TestCase
 
@@ -72,4 +73,103 @@ class ImageIoTestCase(TestCase):
                     with self.subTest(base_filename=base_filename, image_format=image_format, bpp=bits_per_pixel):
                         self._test_from_file(base_filename=base_filename, image_format=image_format(bits_per_pixel))
 
+    def test_bands(self):
+        djvu_filename = os.path.join(self.here, 'whirl.djvu')
+        context = djvu.decode.Context()
+        document = context.new_document(djvu.decode.FileUri(djvu_filename))
+        page_job = document.pages[0].decode(wait=True)
+        for image_format in self.formats:
+            for bits_per_pixel, layers in (1, djvu.decode.RENDER_MASK_ONLY), (8, djvu.decode.RENDER_COLOR), (24, djvu.decode.RENDER_COLOR):
+                fd = io.BytesIO()
+                image_format(bits_per_pixel).write_image(page_job, layers, fd)
+                expected = fd.getvalue()
+                for band_height in 1, 7, page_job.size[1], page_job.size[1] + 1:
+                    with self.subTest(image_format=image_format, bpp=bits_per_pixel, band_height=band_height):
+                        fd = io.BytesIO()
+                        image_format(bits_per_pixel, band_height=band_height).write_image(page_job, layers, fd)
+                        self.assertEqual(fd.getvalue(), expected)
+
+    def test_gray(self):
+        djvu_filename = os.path.join(self.here, 'whirl.djvu')
+        context = djvu.decode.Context()
+        document = context.new_document(djvu.decode.FileUri(djvu_filename))
+        page_job = document.pages[0].decode(wait=True)
+        self.assertEqual(image_io.PNM(8).extension, 'pgm')
+        expected = None
+        for image_format in self.formats:
+            with self.subTest(image_format=image_format):
+                fd = io.BytesIO()
+                image_format(8).write_image(page_job, djvu.decode.RENDER_COLOR, fd)
+                fd.seek(0)
+                with Image.open(fd) as image:
+                    self.assertEqual(image.size, page_job.size)
+                    self.assertEqual(image.mode, 'L')
+                    data = list(image.getdata())
+                if expected is None:
+                    expected = data
+                else:
+                    self.assertEqual(data, expected)
+
+    def test_buffer_reuse(self):
+        djvu_filename = os.path.join(self.here, 'whirl.djvu')
+        context = djvu.decode.Context()
+        document = context.new_document(djvu.decode.FileUri(djvu_filename))
+        page_job = document.pages[0].decode(wait=True)
+        image_format = image_io.TIFF(24, band_height=7)
+        results = []
+        for i in range(2):
+            fd = io.BytesIO()
+            image_format.write_image(page_job, djvu.decode.RENDER_COLOR, fd)
+            results += [fd.getvalue()]
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(image_format._buffers._free), 1)
+
+    def test_write_vectored(self):
+        chunks = [b'P4 ', memoryview(b'2 2\n'), bytearray(b'\x00\xC0')]
+        fd = io.BytesIO()
+        image_io._write_vectored(fd, chunks)
+        self.assertEqual(fd.getvalue(), b'P4 2 2\n\x00\xC0')
+        with temporary.file(mode='w+b') as fd:
+            fd.write(b'#')
+            image_io._write_vectored(fd, chunks)
+            self.assertEqual(fd.tell(), 10)
+            fd.seek(0)
+            self.assertEqual(fd.read(), b'#P4 2 2\n\x00\xC0')
+
+    def test_raw(self):
+        djvu_filename = os.path.join(self.here, 'whirl.djvu')
+        context = djvu.decode.Context()
+        document = context.new_document(djvu.decode.FileUri(djvu_filename))
+        page_job = document.pages[0].decode(wait=True)
+        for bits_per_pixel, layers in (1, djvu.decode.RENDER_MASK_ONLY), (24, djvu.decode.RENDER_COLOR):
+            with self.subTest(bpp=bits_per_pixel):
+                pnm_format = image_io.PNM(bits_per_pixel)
+                pnm_filename = os.path.join(self.here, f'whirl_{bits_per_pixel}bpp.{pnm_format.extension}')
+                if bits_per_pixel == 1:
+                    header = 'P4 {0} {1}\n'.format(*page_job.size)
+                else:
+                    header = 'P6 {0} {1} 255\n'.format(*page_job.size)
+                with open(pnm_filename, 'rb') as fd:
+                    expected = fd.read()
+                self.assertTrue(expected.startswith(header.encode('ASCII')))
+                expected = expected[len(header):]
+                with image_io.Raw(bits_per_pixel).render_image(page_job, layers) as image:
+                    self.assertEqual(image.size, page_job.size)
+                    self.assertEqual(image.bytes_per_line * image.size[1], len(image.data))
+                    self.assertEqual(image.data, expected)
+                self.assertIsNone(image.data)
+
+    def test_encoded(self):
+        djvu_filename = os.path.join(self.here, 'whirl.djvu')
+        context = djvu.decode.Context()
+        document = context.new_document(djvu.decode.FileUri(djvu_filename))
+        page_job = document.pages[0].decode(wait=True)
+        image_format = image_io.PNM(1)
+        with open(os.path.join(self.here, 'whirl_1bpp.pbm'), 'rb') as fd:
+            expected = fd.read()
+        with image_format.encode_image(page_job, djvu.decode.RENDER_MASK_ONLY) as image:
+            self.assertIsNone(image.name)
+            self.assertEqual(image.extension, 'pbm')
+            self.assertEqual(image.data, expected)
+
 # vim:ts=4 sts=4 sw=4 et
@@ -16,6 +16,9 @@
 import errno
 import os
 import signal
+import subprocess
+import threading
+import time
 
 from ocrodjvu import ipc
 from ocrodjvu import temporary
@@ -85,6 +88,118 @@ class WaitTestCase(TestCase):
                 self._test_signal(name)
 
 
+class FeedTestCase(TestCase):
+
+    def test_feed(self):
+        data = b'eggs\n' * 100000
+        with ipc.Subprocess(['cat'], stdin=ipc.PIPE, stdout=ipc.PIPE) as child:
+            writer = child.feed(data)
+            self.assertEqual(child.stdout.read(), data)
+            writer.join()
+            child.wait()
+
+    def test_broken_pipe(self):
+        with ipc.Subprocess(['true'], stdin=ipc.PIPE) as child:
+            writer = child.feed(b'eggs\n' * 100000)
+            writer.join()
+            child.wait()
+
+
+class TimeoutTestCase(TestCase):
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with ipc.timeout(0.2):
+            # The shell would wait for its child, which should be killed, too:
+            child = ipc.Subprocess(['sh', '-c', 'sleep 10 & wait'], stdout=ipc.PIPE)
+        with child:
+            self.assertEqual(child.stdout.read(), b'')
+            with self.assertRaises(ipc.CalledProcessTimeout) as ecm:
+                child.wait()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(str(ecm.exception), "Command 'sh' timed out after 0.2 seconds")
+        self.assertFalse(ecm.exception.by_user)
+
+    def test_no_timeout(self):
+        with ipc.timeout(10):
+            child = ipc.Subprocess(['true'])
+        child.wait()
+        self.assertNotIn(child, ipc._watched)
+
+    def test_exited_before_timeout(self):
+        with ipc.timeout(0.2):
+            child = ipc.Subprocess(['true'])
+        while child.poll() is None:
+            time.sleep(0.01)
+        # Let the watchdog fire:
+        time.sleep(0.4)
+        child.wait()
+
+    def test_kill_group(self):
+        with ipc.timeout(10):
+            child = ipc.Subprocess(['sleep', '10'])
+        self.assertTrue(child.kill_group())
+        with self.assertRaises(ipc.CalledProcessInterrupted):
+            child.wait()
+        self.assertFalse(child.kill_group())
+
+    def test_kill_watched(self):
+        with ipc.timeout(10):
+            child = ipc.Subprocess(['sleep', '10'])
+        ipc.kill_watched()
+        with self.assertRaises(ipc.CalledProcessInterrupted):
+            child.wait()
+
+
+class CollectProcessesTestCase(TestCase):
+
+    def test_collect(self):
+        with ipc.collect_processes() as processes:
+            with ipc.Subprocess(['sh', '-c', 'true']):
+                pass
+            child = ipc.Subprocess(['false'])
+            with self.assertRaises(ipc.CalledProcessError):
+                child.wait()
+        self.assertEqual(len(processes), 2)
+        self.assertIs(processes[1], child)
+        self.assertGreater(child.rusage.ru_maxrss, 0)
+        self.assertLessEqual(child.start_time, child.end_time)
+        with ipc.Subprocess(['true']) as child:
+            pass
+        self.assertIsNotNone(child.rusage)
+        self.assertEqual(len(processes), 2)
+
+    def test_poll(self):
+        child = ipc.Subprocess(['true'])
+        while child.poll() is None:
+            time.sleep(0.01)
+        self.assertEqual(child.returncode, 0)
+        self.assertIsNotNone(child.rusage)
+        with ipc.collect_processes() as processes:
+            child.wait()
+        self.assertEqual(processes, [child])
+
+    def test_wait_timeout(self):
+        with ipc.Subprocess(['cat'], stdin=ipc.PIPE) as child:
+            with self.assertRaises(subprocess.TimeoutExpired):
+                child.wait(timeout=0.1)
+            self.assertIsNone(child.rusage)
+            child.stdin.close()
+            child.wait(timeout=10)
+        self.assertIsNotNone(child.rusage)
+
+
+class RunningProcessesTestCase(TestCase):
+
+    def test_running(self):
+        with ipc.Subprocess(['cat'], stdin=ipc.PIPE) as child:
+            running = ipc.running_processes()
+            self.assertIn((threading.current_thread().name, child), running)
+            child.stdin.close()
+            child.wait()
+            self.assertNotIn(child, [process for _, process in ipc.running_processes()])
+
+
 class EnvironmentTestCase(TestCase):
     """
     https://bugs.debian.org/594385
@@ -122,6 +237,18 @@ class EnvironmentTestCase(TestCase):
             self.assertEqual(stdout, b'24')
             self.assertEqual(stderr, b'')
 
+    def test_local_env(self):
+        with interim_environ(ocrodjvu='42'):
+            with ipc.local_env(ocrodjvu='24'):
+                child = ipc.Subprocess(
+                    ['sh', '-c', 'printf $ocrodjvu'],
+                    stdout=ipc.PIPE, stderr=ipc.PIPE,
+                )
+                stdout, stderr = child.communicate()
+                self.assertEqual(stdout, b'24')
+                self.assertEqual(stderr, b'')
+            self.assertEqual(os.environ['ocrodjvu'], '42')
+
     def test_path(self):
         path = os.getenv('PATH')
         with temporary.directory() as tmpdir:
@@ -0,0 +1,119 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+
+from ocrodjvu import journal
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class MakeKeyTestCase(TestCase):
+
+    def test_make_key(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs.djvu')
+            with open(path, 'wb') as file:
+                file.write(b'eggs')
+            key = journal.make_key(path, dict(language='eng'))
+            self.assertEqual(key, journal.make_key(path, dict(language='eng')))
+            self.assertNotEqual(key, journal.make_key(path, dict(language='deu')))
+            with open(path, 'wb') as file:
+                file.write(b'ham')
+            self.assertNotEqual(key, journal.make_key(path, dict(language='eng')))
+
+
+class JournalTestCase(TestCase):
+
+    def test_resume(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            jnl = journal.Journal(path, 'eggs')
+            self.assertEqual(jnl.pages, {})
+            jnl.add(2, '(page 0 0 1 1)')
+            jnl.add(0, None)
+            jnl.close()
+            jnl.add(1, '(page 0 0 2 2)')
+            jnl = journal.Journal(path, 'eggs', resume=True)
+            self.assertEqual(jnl.pages, {0: None, 2: '(page 0 0 1 1)'})
+            jnl.add(1, '(page 0 0 2 2)')
+            jnl.close()
+            jnl = journal.Journal(path, 'eggs', resume=True)
+            self.assertEqual(len(jnl.pages), 3)
+            jnl.remove()
+            self.assertFalse(os.path.exists(path))
+
+    def test_no_resume(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            jnl = journal.Journal(path, 'eggs')
+            jnl.add(0, None)
+            jnl.close()
+            jnl = journal.Journal(path, 'eggs')
+            self.assertEqual(jnl.pages, {})
+            jnl.close()
+            jnl = journal.Journal(path, 'eggs', resume=True)
+            self.assertEqual(jnl.pages, {})
+            jnl.close()
+
+    def test_key_mismatch(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            jnl = journal.Journal(path, 'eggs')
+            jnl.add(0, None)
+            jnl.close()
+            jnl = journal.Journal(path, 'ham', resume=True)
+            self.assertEqual(jnl.pages, {})
+            jnl.close()
+
+    def test_truncated(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            jnl = journal.Journal(path, 'eggs')
+            jnl.add(0, None)
+            jnl.add(1, '(page 0 0 1 1)')
+            jnl.close()
+            with open(path, 'r+b') as file:
+                file.truncate(os.path.getsize(path) - 2)
+            jnl = journal.Journal(path, 'eggs', resume=True)
+            self.assertEqual(jnl.pages, {0: None})
+            jnl.close()
+            with open(path, 'rt') as file:
+                self.assertEqual(len(file.readlines()), 2)
+
+    def test_corrupted(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal')
+            for record in '[1, null]', '{"page": 1}', '{"page": "1", "text": null}', '{"page": 1, "text": 42}', 'null':
+                with self.subTest(record=record):
+                    jnl = journal.Journal(path, 'eggs')
+                    jnl.add(0, None)
+                    jnl.close()
+                    with open(path, 'at') as file:
+                        file.write(record + '\n')
+                        file.write('{"page": 2, "text": null}\n')
+                    jnl = journal.Journal(path, 'eggs', resume=True)
+                    self.assertEqual(jnl.pages, {0: None})
+                    jnl.close()
+
+    def test_cannot_create(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'nonexistent', 'journal')
+            with self.assertRaises(OSError):
+                journal.Journal(path, 'eggs')
+            self.assertEqual(os.listdir(tmpdir), [])
+
+# vim:ts=4 sts=4 sw=4 et
@@ -15,18 +15,83 @@
 
 import contextlib
 import io
+import json
 import os
 import shutil
+import signal
+import threading
+import types
 
 from ocrodjvu import errors
+from ocrodjvu import ipc
+from ocrodjvu import status
 from ocrodjvu import temporary
 from ocrodjvu.cli import ocrodjvu
+from ocrodjvu.engines import dummy
 
 from tests.tools import mock, remove_logging_handlers, require_locale_encoding, try_run, TestCase
 
 
+def _echo_process_main(connection, options, temp_dir, timeouts):
+    # Stand-in for ocrodjvu._page_process_main(); dies on page 666.
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        (path, label, n), n_threads = message
+        if n == 666:
+            os._exit(1)
+        connection.send(('ok', os.getpid(), None))
+
+
+class WorkerFactoryTestCase(TestCase):
+
+    def test_restart(self):
+        context = mock.MagicMock(options=None, temp_dir=None, timeouts=None)
+        context.get_document_info.return_value = ('test.djvu', None)
+        thread_budget = mock.MagicMock()
+        thread_budget.reserve.return_value.__enter__.return_value = 1
+        with mock.patch.object(ocrodjvu, '_page_process_main', _echo_process_main):
+            factory = ocrodjvu.WorkerFactory(context)
+            factory.start()
+            try:
+                worker = ocrodjvu.PageProcess(context, thread_budget, factory)
+                worker.start()
+                pid = worker.process_page(types.SimpleNamespace(n=0))
+                with self.assertRaises(ocrodjvu.WorkerProcessError):
+                    worker.process_page(types.SimpleNamespace(n=666))
+                new_pid = worker.process_page(types.SimpleNamespace(n=0))
+                self.assertNotEqual(new_pid, pid)
+                worker.close()
+            finally:
+                factory.close()
+
+
+class KillEnginesTestCase(TestCase):
+
+    def test_sigint(self):
+        with mock.patch.object(ipc, 'kill_watched') as kill_watched:
+            with self.assertRaises(KeyboardInterrupt):
+                ocrodjvu._kill_engines(signal.SIGINT, None)
+        kill_watched.assert_called_once_with()
+
+    def test_sigterm(self):
+        with mock.patch.object(ipc, 'kill_watched') as kill_watched, \
+                mock.patch.object(signal, 'signal') as set_handler, \
+                mock.patch.object(os, 'kill') as kill:
+            ocrodjvu._kill_engines(signal.SIGTERM, None)
+        kill_watched.assert_called_once_with()
+        set_handler.assert_called_once_with(signal.SIGTERM, signal.SIG_DFL)
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+
 class OcrodjvuTestCase(TestCase):
     engines = []
+    _expected_script = None
+
+    def setUp(self):
+        # Some tests patch the engine, so compute the expected script upfront.
+        self._get_expected_script()
 
     def test_help(self):
         stdout = io.StringIO()
@@ -114,4 +179,389 @@ class OcrodjvuTestCase(TestCase):
         self.assertEqual(rc, 0)
         self.assertEqual(stdout.getvalue(), '')
 
+    def _test_executor(self, executor, *args, expected_stderr=''):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            script_path = os.path.join(tmpdir, 'tmp.djvused')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                rc = try_run(ocrodjvu.main, [
+                    '', '--engine', '_dummy', '--executor', executor, '-j', '2', *args, '--save-script', script_path, path
+                ])
+            with open(script_path, 'rt') as file:
+                script = file.read()
+        self.assertEqual(stderr.getvalue(), expected_stderr)
+        self.assertEqual(rc, 0)
+        self.assertEqual(stdout.getvalue(), '')
+        return script
+
+    def _get_expected_script(self):
+        """
+        Return the script for alice.djvu produced with the default options.
+        """
+        cls = type(self)
+        if cls._expected_script is None:
+            cls._expected_script = self._test_executor('thread')
+        return cls._expected_script
+
+    def _test_same_script(self, executor, *args, expected_stderr=''):
+        """
+        Check that the options don't change the script for alice.djvu.
+        """
+        script = self._test_executor(executor, *args, expected_stderr=expected_stderr)
+        self.assertMultiLineEqual(script, self._get_expected_script())
+
+    def test_process_executor(self):
+        self.assertIn('set-txt', self._get_expected_script())
+        self._test_same_script('process')
+
+    def test_batch_size(self):
+        with mock.patch.object(dummy.Engine, 'batch_size', 3, create=True):
+            self._test_same_script('thread')
+
+    def test_batch_size_bad_executor(self):
+        for executor in 'process', 'pipeline':
+            with self.subTest(executor=executor):
+                stdout = io.StringIO()
+                stderr = io.StringIO()
+                with mock.patch.object(dummy.Engine, 'batch_size', 3, create=True):
+                    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                        rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--executor', executor, '--dry-run', 'dummy.djvu'])
+                self.assertEqual(rc, errors.EXIT_FATAL)
+                self.assertIn('-X batch_size=N is supported only with --executor=thread', stderr.getvalue())
+                self.assertEqual(stdout.getvalue(), '')
+
+    def test_batch_retries(self):
+        recognize = dummy.Engine.recognize
+        n_calls = 0
+
+        def recognize_timeout_once(*args, **kwargs):
+            nonlocal n_calls
+            n_calls += 1
+            if n_calls == 1:
+                raise ipc.CalledProcessTimeout(1, 'dummy')
+            return recognize(*args, **kwargs)
+
+        with mock.patch.object(dummy.Engine, 'batch_size', 3, create=True), \
+                mock.patch.object(dummy.Engine, 'recognize', recognize_timeout_once):
+            self._test_same_script(
+                'thread', '--retries', '1',
+                expected_stderr="Command 'dummy' timed out after 1 seconds; retrying (1/1)\n",
+            )
+        # Only the page that timed out was recognized again.
+        self.assertEqual(n_calls, self._get_expected_script().count('select ') + 1)
+
+    def test_cost_schedule(self):
+        for executor in 'thread', 'pipeline':
+            with self.subTest(executor=executor):
+                self._test_same_script(executor, '--schedule', 'cost')
+
+    def test_pipeline_executor(self):
+        for n in 1, 3:
+            with self.subTest(n=n):
+                self._test_same_script('pipeline', '--render-jobs', str(n), '--parse-jobs', str(n))
+
+    def _record_images(self, record):
+        """
+        Make the dummy engine call record(image) for every image it's given.
+        """
+        recognize = dummy.Engine.recognize
+
+        def recognize_and_record(self, image, *args, **kwargs):
+            record(image)
+            return recognize(self, image, *args, **kwargs)
+
+        return mock.patch.object(dummy.Engine, 'recognize', recognize_and_record)
+
+    def test_pipe_size_limit(self):
+        piped = []
+        for limit, expected_piped in [(ocrodjvu.MAX_PIPED_IMAGE_SIZE, True), (0, False)]:
+            with self.subTest(limit=limit):
+                del piped[:]
+                with mock.patch.object(dummy.Engine, 'uses_pipes', return_value=True), \
+                        self._record_images(lambda image: piped.append(image.name is None)), \
+                        mock.patch.object(ocrodjvu, 'MAX_PIPED_IMAGE_SIZE', limit):
+                    self._test_same_script('thread')
+                self.assertTrue(piped)
+                self.assertEqual(set(piped), {expected_piped})
+
+    def test_colour(self):
+        headers = set()
+
+        def record_header(image):
+            with open(image.name, 'rb') as file:
+                headers.add(file.read(2))
+
+        for args, expected_header in [
+            ((), b'P4'),
+            (('--render', 'all'), b'P5'),
+            (('--render', 'all', '--colour', 'gray'), b'P5'),
+            (('--render', 'foreground', '--colour', 'rgb'), b'P6'),
+        ]:
+            with self.subTest(args=args):
+                headers.clear()
+                with self._record_images(record_header):
+                    self._test_same_script('thread', *args)
+                self.assertEqual(headers, {expected_header})
+
+    def test_resume(self):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            script_path = os.path.join(tmpdir, 'tmp.djvused')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--resume', '--save-script', script_path, path])
+            with open(script_path, 'rt') as file:
+                script = file.read()
+            # The journal is removed once the results are saved.
+            self.assertEqual(os.listdir(tmpdir), ['tmp.djvused'])
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertEqual(rc, 0)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertMultiLineEqual(script, self._get_expected_script())
+
+    def test_resume_interrupted(self):
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        # This document has two pages:
+        path = os.path.join(here, '..', 'data', 'bad-page-id.djvu')
+        recognize = dummy.Engine.recognize
+        n_calls = 0
+
+        def recognize_once(*args, **kwargs):
+            # Fail on every page but the first one.
+            nonlocal n_calls
+            n_calls += 1
+            if n_calls > 1:
+                raise RuntimeError('interrupted')
+            return recognize(*args, **kwargs)
+
+        def run(*args):
+            stderr = io.StringIO()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+                return try_run(ocrodjvu.main, [
+                    '', '--engine', '_dummy', '-j', '1', *args, '--save-script', script_path, path
+                ])
+
+        with temporary.directory() as tmpdir:
+            script_path = os.path.join(tmpdir, 'tmp.djvused')
+            journal_path = script_path + '.ocrodjvu-journal'
+            with mock.patch.object(dummy.Engine, 'recognize', recognize_once):
+                rc = run()
+            self.assertEqual(rc, errors.EXIT_FATAL)
+            # There is no journal without --resume.
+            self.assertFalse(os.path.exists(journal_path))
+            n_calls = 0
+            with mock.patch.object(dummy.Engine, 'recognize', recognize_once):
+                rc = run('--resume')
+            self.assertEqual(rc, errors.EXIT_FATAL)
+            self.assertTrue(os.path.exists(journal_path))
+            self.assertEqual(n_calls, 2)
+            n_calls = 0
+            with mock.patch.object(dummy.Engine, 'recognize', recognize_once):
+                rc = run('--resume')
+            self.assertEqual(rc, 0)
+            # Only the second page was recognized again.
+            self.assertEqual(n_calls, 1)
+            self.assertFalse(os.path.exists(journal_path))
+            with open(script_path, 'rt') as file:
+                script = file.read()
+        self.assertEqual(script.count('set-txt'), 2)
+
+    def test_cache(self):
+        n_pages = self._get_expected_script().count('set-txt')
+        with temporary.directory() as cache_dir:
+            for executor, hits, misses in [('thread', 0, n_pages), ('process', n_pages, 0)]:
+                with self.subTest(executor=executor):
+                    with mock.patch.object(ocrodjvu.LOGGER, 'info') as log_info:
+                        self._test_same_script(executor, '--cache-dir', cache_dir)
+                    log_info.assert_any_call(f'OCR cache: {hits} hit(s), {misses} miss(es).')
+            self.assertNotEqual(os.listdir(cache_dir), [])
+            # Malformed entries are treated as misses, and removed:
+            entry_paths = [
+                os.path.join(dirpath, filename)
+                for dirpath, _, filenames in os.walk(cache_dir)
+                for filename in filenames
+                if not filename.startswith('.')
+            ]
+            self.assertEqual(len(entry_paths), n_pages)
+            for path in entry_paths:
+                with open(path, 'wb') as file:
+                    file.write(b'garbage')
+            with mock.patch.object(ocrodjvu.LOGGER, 'info') as log_info, mock.patch.object(ocrodjvu.LOGGER, 'warning') as log_warning:
+                self._test_same_script('thread', '--cache-dir', cache_dir)
+            log_info.assert_any_call(f'OCR cache: 0 hit(s), {n_pages} miss(es).')
+            self.assertEqual(log_warning.call_count, n_pages)
+            for path in entry_paths:
+                with open(path, 'rb') as file:
+                    self.assertNotEqual(file.read(), b'garbage')
+
+    def test_report(self):
+        with temporary.directory() as tmpdir:
+            report_path = os.path.join(tmpdir, 'report.json')
+            for executor in 'thread', 'process', 'pipeline':
+                with self.subTest(executor=executor):
+                    self._test_same_script(executor, '--report', report_path)
+                    with open(report_path, 'rt', encoding='UTF-8') as file:
+                        data = json.load(file)
+                    self.assertEqual(len(data['documents']), 1)
+                    self.assertNotEqual(data['pages'], [])
+                    for page in data['pages']:
+                        self.assertIn(page['status'], ('ok', 'no-image'))
+                    self.assertIn('decode', data['stages'])
+                    self.assertIn('ocr', data['stages'])
+
+    def test_progress(self):
+        for executor in 'thread', 'process':
+            with self.subTest(executor=executor):
+                read_fd, write_fd = os.pipe()
+                try:
+                    self._test_same_script(executor, f'--progress=jsonl:{write_fd}')
+                finally:
+                    os.close(write_fd)
+                with open(read_fd, 'rt', encoding='UTF-8') as file:
+                    events = [json.loads(line) for line in file]
+                self.assertNotEqual(events, [])
+                for n, event in enumerate(events, start=1):
+                    self.assertEqual(event['event'], 'page')
+                    self.assertIn(event['status'], ('ok', 'no-image'))
+                    self.assertGreaterEqual(event['duration'], 0)
+                    self.assertEqual(event['pages_done'], n)
+                    self.assertEqual(event['pages_total'], len(events))
+                self.assertEqual(events[-1]['eta'], 0)
+
+    def test_status_file(self):
+        with temporary.directory() as tmpdir:
+            status_path = os.path.join(tmpdir, 'status')
+            for executor in 'thread', 'process':
+                with self.subTest(executor=executor):
+                    self._test_same_script(executor, '--status-file', status_path)
+                    with open(status_path, 'rt', encoding='UTF-8') as file:
+                        text = file.read()
+                    self.assertRegex(text, r'\npages: [1-9][0-9]* done [(]0 failed[)]')
+                    self.assertRegex(text, r'\nworker-[0-9]+: idle')
+
+    def test_sigusr1(self):
+        signalled = False
+
+        def signal_once(image):
+            nonlocal signalled
+            if not signalled:
+                signalled = True
+                signal.pthread_kill(threading.main_thread().ident, signal.SIGUSR1)
+
+        with self._record_images(signal_once), \
+                mock.patch.object(status.Status, 'format', return_value='<status>\n'):
+            self._test_same_script('thread', '-j', '1', expected_stderr='<status>\n')
+
+    def test_trace(self):
+        with temporary.directory() as tmpdir:
+            trace_path = os.path.join(tmpdir, 'trace.json')
+            for executor in 'thread', 'process':
+                with self.subTest(executor=executor):
+                    self._test_same_script(executor, '--trace', trace_path)
+                    with open(trace_path, 'rt', encoding='UTF-8') as file:
+                        data = json.load(file)
+                    spans = {event['name'] for event in data['traceEvents'] if event['ph'] == 'X'}
+                    self.assertLessEqual({'decode', 'render', 'ocr', 'extract', 'serialize', 'write_wait', 'save'}, spans)
+                    # Every thread is named only once:
+                    threads = [(event['pid'], event['tid']) for event in data['traceEvents'] if event['ph'] == 'M']
+                    self.assertEqual(len(threads), len(set(threads)))
+
+    def test_batch(self):
+        expected = self._get_expected_script()
+        remove_logging_handlers('ocrodjvu.')
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        paths = [os.path.join(here, '..', 'data', name) for name in ('alice.djvu', 'empty.djvu')]
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        for executor in 'thread', 'process', 'pipeline':
+            with self.subTest(executor=executor), temporary.directory() as tmpdir:
+                list_path = os.path.join(tmpdir, 'list')
+                with open(list_path, 'wt') as file:
+                    file.write(paths[1] + '\n')
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    rc = try_run(ocrodjvu.main, [
+                        '', '--engine', '_dummy', '--executor', executor, '-j', '2',
+                        '--batch-list', list_path, '--save-script', tmpdir, paths[0]
+                    ])
+                self.assertEqual(stderr.getvalue(), '')
+                self.assertEqual(rc, 0)
+                self.assertEqual(stdout.getvalue(), '')
+                with open(os.path.join(tmpdir, 'alice.djvused'), 'rt') as file:
+                    self.assertMultiLineEqual(file.read(), expected)
+                self.assertTrue(os.path.exists(os.path.join(tmpdir, 'empty.djvused')))
+
+    def test_batch_bad_save_path(self):
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            script_path = os.path.join(tmpdir, 'tmp.djvused')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                rc = try_run(ocrodjvu.main, [
+                    '', '--engine', '_dummy', '--batch', '--save-script', script_path, path, path
+                ])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertNotEqual(stderr.getvalue(), '')
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_batch_same_name(self):
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        for saver in '--save-bundled', '--save-script', '--in-place':
+            with self.subTest(saver=saver), temporary.directory() as tmpdir:
+                other_path = os.path.join(tmpdir, 'alice.djvu')
+                shutil.copy(path, other_path)
+                paths = [path, other_path] if saver != '--in-place' else [path, path]
+                stdout = io.StringIO()
+                stderr = io.StringIO()
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    args = [saver, tmpdir] if saver != '--in-place' else [saver]
+                    rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--batch', *args, *paths])
+                self.assertEqual(rc, errors.EXIT_FATAL)
+                self.assertIn('would be saved to the same file', stderr.getvalue())
+                self.assertEqual(stdout.getvalue(), '')
+                self.assertEqual(os.listdir(tmpdir), ['alice.djvu'])
+
+    def test_batch_failed_documents(self):
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        path = os.path.join(here, '..', 'data', 'alice.djvu')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with temporary.directory() as tmpdir:
+            missing_path = os.path.join(tmpdir, 'missing.djvu')
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                with self.assertLogs('ocrodjvu.main', level='ERROR') as log:
+                    rc = try_run(ocrodjvu.main, [
+                        '', '--engine', '_dummy', '--batch', '--save-script', tmpdir, path, missing_path
+                    ])
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, 'alice.djvused')))
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertEqual(log.records[-1].getMessage(), f'Processing of 1 of 2 documents failed:\n- {missing_path}: results were not saved')
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_multiple_files_without_batch(self):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', 'a.djvu', 'b.djvu'])
+        self.assertEqual(rc, errors.EXIT_FATAL)
+        self.assertNotEqual(stderr.getvalue(), '')
+        self.assertEqual(stdout.getvalue(), '')
+
 # vim:ts=4 sts=4 sw=4 et
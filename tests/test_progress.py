@@ -0,0 +1,63 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+import io
+import json
+
+from ocrodjvu import progress
+
+from tests.tools import mock, TestCase
+
+
+class ProgressTestCase(TestCase):
+
+    def test_events(self):
+        file = io.StringIO()
+        prg = progress.Progress(file)
+        prg.add_pages([('a.djvu', 1), ('a.djvu', 2), ('a.djvu', 3)], costs=[1, 3, 4])
+        with mock.patch('time.monotonic', return_value=prg._start_time + 2.0):
+            prg.page_done(('a.djvu', 2), 'ok', 1.5)
+            prg.page_done(('a.djvu', 1), 'failed')
+        events = [json.loads(line) for line in file.getvalue().splitlines()]
+        self.assertEqual(events, [
+            dict(
+                event='page', path='a.djvu', page=2, status='ok', duration=1.5,
+                pages_done=1, pages_total=3, pages_per_second=0.5,
+                # 3 cost units took 2 seconds; 5 are left:
+                eta=2.0 * 5 / 3,
+            ),
+            dict(
+                event='page', path='a.djvu', page=1, status='failed', duration=None,
+                pages_done=2, pages_total=3, pages_per_second=1.0,
+                eta=2.0 * 4 / 4,
+            ),
+        ])
+
+    def test_unknown_costs(self):
+        file = io.StringIO()
+        prg = progress.Progress(file)
+        prg.add_pages([('a.djvu', 1), ('a.djvu', 2)], costs=[0, 0])
+        prg.add_pages([('b.djvu', 1), ('b.djvu', 2)])
+        with mock.patch('time.monotonic', return_value=prg._start_time + 3.0):
+            prg.page_done(('b.djvu', 1), 'no-image', 0.5)
+        [event] = [json.loads(line) for line in file.getvalue().splitlines()]
+        self.assertEqual(event['pages_total'], 4)
+        self.assertEqual(event['eta'], 9.0)
+
+    def test_null(self):
+        prg = progress.NullProgress()
+        prg.add_pages([('a.djvu', 1)])
+        prg.page_done(('a.djvu', 1), 'ok')
+
+# vim:ts=4 sts=4 sw=4 et
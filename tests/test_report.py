@@ -0,0 +1,109 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+import json
+import os
+
+from ocrodjvu import ipc
+from ocrodjvu import report
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class ReportTestCase(TestCase):
+
+    def test_report(self):
+        rpt = report.Report()
+        rpt.add_time(('eggs.djvu', 1), 'decode', 0.5)
+        rpt.add_time(('eggs.djvu', 1), 'decode', 0.25)
+        rpt.add_time(('eggs.djvu', 2), 'ocr', 2.0)
+        rpt.add_time(('eggs.djvu', 2), 'decode', 0.25)
+        rpt.add_image_bytes(('eggs.djvu', 1), 42)
+        rpt.set_status(('eggs.djvu', 1), 'ok')
+        rpt.set_status(('eggs.djvu', 2), 'failed')
+        rpt.add_document('eggs.djvu', 1.0)
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'report.json')
+            rpt.write(path)
+            self.assertEqual(os.listdir(tmpdir), ['report.json'])
+            with open(path, 'rt', encoding='UTF-8') as file:
+                data = json.load(file)
+        self.assertEqual(data['version'], report.VERSION)
+        [page1, page2] = data['pages']
+        self.assertEqual(page1, dict(path='eggs.djvu', page=1, status='ok', stages=dict(decode=0.75), image_bytes=42, rusage={}))
+        self.assertEqual(page2['status'], 'failed')
+        self.assertEqual(set(page2['stages']), {'decode', 'ocr'})
+        self.assertEqual(data['stages']['decode'], dict(total=1.0, mean=0.5, max=0.75))
+        self.assertEqual(list(data['stages']), ['decode', 'ocr'])
+        self.assertEqual(data['image_bytes'], 42)
+        [document] = data['documents']
+        self.assertEqual(document['path'], 'eggs.djvu')
+        self.assertEqual(document['save'], 1.0)
+        self.assertEqual(document['rusage']['processes'], 0)
+        self.assertEqual(data['engines'], [])
+        self.assertGreaterEqual(data['engine_cpu_time'], 0)
+        self.assertGreater(data['max_rss'], 0)
+
+    def test_merge(self):
+        worker = report.Report()
+        worker.add_time(('eggs.djvu', 1), 'ocr', 2.0)
+        worker.add_image_bytes(('eggs.djvu', 1), 42)
+        worker.set_status(('eggs.djvu', 1), 'ok')
+        stats = worker.pop(('eggs.djvu', 1))
+        self.assertEqual(worker.as_dict()['pages'], [])
+        rpt = report.Report()
+        rpt.add_time(('eggs.djvu', 1), 'queue', 1.0)
+        rpt.merge(('eggs.djvu', 1), stats)
+        rpt.merge(('eggs.djvu', 1), None)
+        [page] = rpt.as_dict()['pages']
+        self.assertEqual(page['stages'], dict(queue=1.0, ocr=2.0))
+        self.assertEqual(page['image_bytes'], 42)
+        self.assertEqual(page['status'], 'ok')
+
+    def test_rusage(self):
+        with ipc.collect_processes() as processes:
+            for _ in range(2):
+                with ipc.Subprocess(['true']):
+                    pass
+        rusages = [process.rusage for process in processes]
+        rpt = report.Report(engine='tesseract', language='eng')
+        rpt.add_rusage(('eggs.djvu', 1), rusages)
+        rpt.add_rusage(('eggs.djvu', 2), rusages[:1], share=0.5)
+        # No subprocesses at all:
+        rpt.add_rusage(('eggs.djvu', 3), [])
+        rpt.add_document('eggs.djvu', 1.0, rusages[:1])
+        data = rpt.as_dict()
+        [page1, page2] = data['pages']
+        self.assertEqual(page1['rusage']['processes'], 2)
+        self.assertGreater(page1['rusage']['max_rss'], 0)
+        self.assertAlmostEqual(page2['rusage']['user_time'], rusages[0].ru_utime / 2)
+        [engine] = data['engines']
+        self.assertEqual(engine['engine'], 'tesseract')
+        self.assertEqual(engine['language'], 'eng')
+        self.assertEqual(engine['pages'], 2)
+        self.assertEqual(engine['processes'], 3)
+        self.assertEqual(engine['max_rss'], max(r.ru_maxrss for r in rusages))
+        [document] = data['documents']
+        self.assertEqual(document['rusage']['processes'], 1)
+
+    def test_null(self):
+        rpt = report.NullReport()
+        rpt.add_time(('eggs.djvu', 1), 'ocr', 1.0)
+        rpt.add_image_bytes(('eggs.djvu', 1), 42)
+        rpt.set_status(('eggs.djvu', 1), 'ok')
+        self.assertEqual(rpt.as_dict()['pages'], [])
+        self.assertIsNone(rpt.pop(('eggs.djvu', 1)))
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,215 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import threading
+
+from ocrodjvu import scheduling
+
+from tests.tools import TestCase
+
+
+class PageSchedulerTestCase(TestCase):
+
+    pages = list('abcdef')
+
+    def test_order(self):
+        scheduler = scheduling.PageScheduler(self.pages)
+        taken = []
+        while True:
+            item = scheduler.take()
+            if item is None:
+                break
+            taken += [item]
+        self.assertEqual(taken, list(enumerate(self.pages)))
+        for i, page in reversed(taken):
+            scheduler.set_result(i, page.upper())
+        for i, page in enumerate(self.pages):
+            future = scheduler.wait(i)
+            self.assertEqual(future.result(), page.upper())
+            scheduler.release(i)
+
+    def test_costs(self):
+        costs = [1, 5, 2, 5, 0, 3]
+        scheduler = scheduling.PageScheduler(self.pages, costs=costs)
+        taken = []
+        while True:
+            item = scheduler.take()
+            if item is None:
+                break
+            i, page = item
+            taken += [page]
+            scheduler.set_result(i, page)
+        self.assertEqual(taken, list('bdfcae'))
+        for i, page in enumerate(self.pages):
+            self.assertEqual(scheduler.wait(i).result(), page)
+            scheduler.release(i)
+
+    def test_counts(self):
+        scheduler = scheduling.PageScheduler(self.pages, max_buffered=3)
+        self.assertEqual(scheduler.get_counts(), dict(total=6, queued=6, buffered=0, max_buffered=3, written=0))
+        for _ in range(2):
+            i, page = scheduler.take()
+            scheduler.set_result(i, page)
+        scheduler.take()
+        self.assertEqual(scheduler.get_counts(), dict(total=6, queued=3, buffered=2, max_buffered=3, written=0))
+        scheduler.wait(0)
+        scheduler.release(0)
+        self.assertEqual(scheduler.get_counts(), dict(total=6, queued=3, buffered=1, max_buffered=3, written=1))
+
+    def test_bad_costs(self):
+        with self.assertRaises(ValueError):
+            scheduling.PageScheduler(self.pages, costs=[1, 2])
+
+    def test_exception(self):
+        scheduler = scheduling.PageScheduler(self.pages)
+        i, _ = scheduler.take()
+        ex = ValueError('eggs')
+        scheduler.set_exception(i, ex)
+        self.assertIs(scheduler.wait(i).exception(), ex)
+
+    def test_stop(self):
+        scheduler = scheduling.PageScheduler(self.pages)
+        self.assertEqual(scheduler.take(), (0, 'a'))
+        scheduler.stop()
+        self.assertIsNone(scheduler.take())
+
+    def test_backpressure(self):
+        scheduler = scheduling.PageScheduler(self.pages, max_buffered=2)
+        head = scheduler.take()
+        for _ in range(2):
+            i, page = scheduler.take()
+            scheduler.set_result(i, page)
+        # The buffer is full, and the head page is being processed:
+        # taking another page must block.
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(scheduler.take()))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(taken, [])
+        (i, page) = head
+        scheduler.set_result(i, page)
+        for i in range(2):
+            scheduler.wait(i)
+            scheduler.release(i)
+        thread.join()
+        self.assertEqual(taken, [(3, 'd')])
+
+    def test_backpressure_head(self):
+        scheduler = scheduling.PageScheduler(self.pages, max_buffered=1)
+        # Simulate pages being completed out of order:
+        scheduler._queue.rotate(-1)
+        i, page = scheduler.take()
+        self.assertEqual(i, 1)
+        scheduler.set_result(i, page)
+        # The buffer is full, but the writer waits for the page that hasn't
+        # been taken yet.
+        self.assertEqual(scheduler.take(), (0, 'a'))
+
+    def test_hol_wait_time(self):
+        scheduler = scheduling.PageScheduler(self.pages)
+        head = scheduler.take()
+        i, page = scheduler.take()
+        scheduler.set_result(i, page)
+        timer = threading.Timer(0.1, scheduler.set_result, head)
+        timer.start()
+        scheduler.wait(0)
+        timer.join()
+        self.assertGreater(scheduler.wait_time, 0)
+        self.assertEqual(scheduler.hol_wait_time, scheduler.wait_time)
+
+    def test_take_nowait(self):
+        scheduler = scheduling.PageScheduler(self.pages[:2], max_buffered=1, closed=False)
+        i, page = scheduler.take(wait=False)
+        scheduler.set_result(i, page)
+        # The buffer is full:
+        self.assertIsNone(scheduler.take(wait=False))
+        scheduler.wait(i)
+        scheduler.release(i)
+        self.assertEqual(scheduler.take(wait=False), (1, 'b'))
+        # No more pages, but the scheduler is still open:
+        self.assertIsNone(scheduler.take(wait=False))
+
+    def test_add_pages(self):
+        scheduler = scheduling.PageScheduler(self.pages[:2], closed=False)
+        self.assertEqual(scheduler.take(), (0, 'a'))
+        self.assertEqual(scheduler.take(), (1, 'b'))
+        # No more pages yet, but the scheduler is still open:
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(scheduler.take()))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(scheduler.add_pages(self.pages[2:4], costs=[1, 2]), 2)
+        thread.join()
+        self.assertEqual(taken, [(3, 'd')])
+        self.assertEqual(scheduler.take(), (2, 'c'))
+        scheduler.close()
+        self.assertIsNone(scheduler.take())
+        with self.assertRaises(RuntimeError):
+            scheduler.add_pages(self.pages[4:])
+
+    def test_cancel(self):
+        scheduler = scheduling.PageScheduler(self.pages, max_buffered=1)
+        i, page = scheduler.take()
+        scheduler.cancel(range(4))
+        scheduler.set_result(i, page)
+        for i in range(4):
+            future = scheduler.wait(i)
+            self.assertEqual(future.cancelled(), i > 0)
+            scheduler.release(i)
+        # Cancelled pages don't count as buffered:
+        self.assertEqual(scheduler._n_buffered, 0)
+        self.assertEqual(scheduler.take(), (4, 'e'))
+
+
+class ThreadBudgetTestCase(TestCase):
+
+    def test_many_pages(self):
+        budget = scheduling.ThreadBudget(n_cpus=8, n_jobs=8, n_pages=100)
+        with budget.reserve() as n:
+            self.assertEqual(n, 1)
+
+    def test_few_pages(self):
+        budget = scheduling.ThreadBudget(n_cpus=8, n_jobs=8, n_pages=3)
+        with budget.reserve() as n1:
+            self.assertEqual(n1, 2)
+            with budget.reserve() as n2:
+                self.assertEqual(n2, 3)
+                with budget.reserve() as n3:
+                    self.assertEqual(n3, 3)
+
+    def test_tail(self):
+        budget = scheduling.ThreadBudget(n_cpus=4, n_jobs=4, n_pages=5)
+        result = []
+        for _ in range(5):
+            with budget.reserve() as n:
+                result += [n]
+        # The fewer pages are left, the more CPUs they can use.
+        self.assertEqual(result, [1, 1, 1, 2, 4])
+
+    def test_overcommit(self):
+        budget = scheduling.ThreadBudget(n_cpus=2, n_jobs=4, n_pages=100)
+        with budget.reserve(), budget.reserve():
+            with budget.reserve() as n:
+                self.assertEqual(n, 1)
+
+    def test_add_pages(self):
+        budget = scheduling.ThreadBudget(n_cpus=4, n_jobs=4, n_pages=0)
+        budget.add_pages(100)
+        with budget.reserve() as n:
+            self.assertEqual(n, 1)
+
+# vim:ts=4 sts=4 sw=4 et
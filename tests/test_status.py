@@ -0,0 +1,82 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+import io
+import os
+import threading
+
+from ocrodjvu import ipc
+from ocrodjvu import scheduling
+from ocrodjvu import status
+from ocrodjvu import temporary
+
+from tests.tools import TestCase
+
+
+class StatusTestCase(TestCase):
+
+    def test_format(self):
+        sts = status.Status()
+        scheduler = scheduling.PageScheduler('abc', max_buffered=2)
+        sts.set_scheduler(scheduler)
+        i, page = scheduler.take()
+        scheduler.set_result(i, page)
+        sts.page_done()
+        thread_name = threading.current_thread().name
+        with sts.working(('doc.djvu', 2), 'ocr'):
+            with ipc.Subprocess(['cat'], stdin=ipc.PIPE) as child:
+                text = sts.format()
+                child.stdin.close()
+        lines = text.splitlines()
+        self.assertRegex(lines[0], r'^ocrodjvu [(]pid [0-9]+[)] status at .*:$')
+        self.assertRegex(lines[1], r'^pages: 1 done [(]0 failed[)], [0-9.]+ pages/s; ')
+        self.assertTrue(lines[1].endswith('; 2 queued, 0 written, 1 in the reorder buffer (max: 2)'))
+        self.assertRegex(lines[2], rf'^{thread_name}: page 2 of doc[.]djvu: ocr for [0-9.]+ s$')
+        self.assertRegex(lines[3], rf'^    pid {child.pid}, running for [0-9.]+ s: cat$')
+        self.assertEqual(len(lines), 4)
+        text = sts.format()
+        self.assertRegex(text.splitlines()[2], rf'^{thread_name}: idle for [0-9.]+ s$')
+
+    def test_worker_process(self):
+        sts = status.Status()
+        sts.page_done(failed=True)
+        with sts.working(('doc.djvu', 1), 'worker process', pid=42):
+            lines = sts.format().splitlines()
+        self.assertRegex(lines[1], r'^pages: 1 done [(]1 failed[)], [0-9.]+ pages/s$')
+        self.assertEqual(lines[3], '    worker process 42')
+
+    def test_printer(self):
+        sts = status.Status()
+        file = io.StringIO()
+        printer = status.StatusPrinter(sts, file)
+        printer.start()
+        sts.page_done()
+        printer.request()
+        printer.stop()
+        self.assertIn('pages: 1 done', file.getvalue())
+
+    def test_writer(self):
+        sts = status.Status()
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'status')
+            writer = status.StatusWriter(sts, path, interval=60)
+            writer.start()
+            sts.page_done()
+            writer.stop()
+            self.assertEqual(os.listdir(tmpdir), ['status'])
+            with open(path, 'rt', encoding='UTF-8') as file:
+                text = file.read()
+        self.assertIn('pages: 1 done', text)
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,79 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+import json
+import os
+import threading
+
+from ocrodjvu import ipc
+from ocrodjvu import temporary
+from ocrodjvu import trace
+
+from tests.tools import TestCase
+
+
+class TraceTestCase(TestCase):
+
+    def test_trace(self):
+        trc = trace.Trace()
+        trc.add_span('decode', 1.0, 1.5, page=1)
+
+        def thread_main():
+            with ipc.collect_processes() as processes:
+                with ipc.Subprocess(['true']):
+                    pass
+            trc.add_process(processes[0])
+
+        thread = threading.Thread(target=thread_main, name='worker-0')
+        thread.start()
+        thread.join()
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'trace.json')
+            trc.write(path)
+            self.assertEqual(os.listdir(tmpdir), ['trace.json'])
+            with open(path, 'rt', encoding='UTF-8') as file:
+                data = json.load(file)
+        events = data['traceEvents']
+        names = [event['args']['name'] for event in events if event['ph'] == 'M']
+        self.assertEqual(names, [threading.current_thread().name, 'worker-0'])
+        [decode, process] = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(decode['name'], 'decode')
+        self.assertEqual(decode['args'], dict(page=1))
+        self.assertEqual((decode['ts'], decode['dur']), (1e6, 0.5e6))
+        self.assertEqual(process['name'], 'true')
+        self.assertEqual(process['args']['command'], ['true'])
+        self.assertNotEqual(process['tid'], decode['tid'])
+
+    def test_pop_merge(self):
+        worker = trace.Trace()
+        worker.add_span('ocr', 1.0, 2.0)
+        events = worker.pop_events()
+        self.assertEqual([event['ph'] for event in events], ['M', 'X'])
+        self.assertEqual(worker.pop_events(), [])
+        worker.add_span('ocr', 2.0, 3.0)
+        # The thread name is not registered again:
+        more_events = worker.pop_events()
+        self.assertEqual([event['ph'] for event in more_events], ['X'])
+        trc = trace.Trace()
+        trc.merge_events(events)
+        trc.merge_events(more_events)
+        self.assertEqual(trc.pop_events(), events + more_events)
+
+    def test_null(self):
+        trc = trace.NullTrace()
+        trc.add_span('ocr', 1.0, 2.0)
+        trc.merge_events([dict(ph='X')])
+        self.assertEqual(trc.pop_events(), [])
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,142 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import os
+
+from lxml import etree
+
+from ocrodjvu import errors
+from ocrodjvu import hocr
+from ocrodjvu import text_zones
+from ocrodjvu import tsv
+
+from tests.tools import sorted_glob, TestCase
+
+here = os.path.dirname(__file__)
+
+HOCR_CLASS_TO_LEVEL = dict(
+    ocr_page=1,
+    ocr_carea=2,
+    ocr_par=3,
+    ocr_line=4,
+    ocr_word=5,
+    ocrx_word=5,
+)
+
+
+def get_bbox(element):
+    """
+    Return bounding box of the element as (x0, y0, x1, y1),
+    computing it from the descendants if the element doesn't have one;
+    or None if neither has.
+    """
+    m = hocr.BBOX_RE.search(element.get('title') or '')
+    if m is not None:
+        return tuple(int(m.group(ident)) for ident in ('x0', 'y0', 'x1', 'y1'))
+    bboxes = [
+        get_bbox(child)
+        for child in element.iterdescendants()
+        if isinstance(child.tag, str) and hocr.BBOX_RE.search(child.get('title') or '')
+    ]
+    if not bboxes:
+        return
+    return (
+        min(x0 for (x0, y0, x1, y1) in bboxes),
+        min(y0 for (x0, y0, x1, y1) in bboxes),
+        max(x1 for (x0, y0, x1, y1) in bboxes),
+        max(y1 for (x0, y0, x1, y1) in bboxes),
+    )
+
+
+def hocr_to_tsv(path):
+    """
+    Convert hOCR to TSV, as if it was produced by Tesseract directly.
+    """
+    rows = [tsv.HEADER]
+    doc = etree.parse(path, etree.HTMLParser())
+    for element in doc.iter():
+        if not isinstance(element.tag, str):
+            continue
+        level = HOCR_CLASS_TO_LEVEL.get(element.get('class'))
+        if level is None:
+            continue
+        bbox = get_bbox(element)
+        if bbox is None:
+            # Tesseract 3.00 puts bbox-less ocrx_word inside ocr_word.
+            continue
+        x0, y0, x1, y1 = bbox
+        if level == tsv.LEVEL_WORD:
+            text = str.join('', str.join('', element.itertext()).split())
+            conf = '95.5'
+        else:
+            text = ''
+            conf = '-1'
+        rows += [str.join('\t', map(str, [level, 1, 0, 0, 0, 0, x0, y0, x1 - x0, y1 - y0, conf, text]))]
+    return str.join('\n', rows) + '\n'
+
+
+def strip_bboxes(value):
+    """
+    Strip bounding boxes from the text zone (as returned by Expression.value).
+    """
+    if isinstance(value, str):
+        return value
+    return (value[0],) + tuple(map(strip_bboxes, value[5:]))
+
+
+class TsvTestCase(TestCase):
+
+    def _test_same_as_hocr(self, path):
+        base_filename = os.path.basename(path)[:-5]
+        tsv_contents = hocr_to_tsv(path)
+        for details in [tsv.TEXT_DETAILS_LINE, tsv.TEXT_DETAILS_WORD, tsv.TEXT_DETAILS_CHARACTER]:
+            with self.subTest(base_filename=base_filename, details=details):
+                with open(path, 'rb') as file:
+                    expected = hocr.extract_text(file, details=details)
+                result = tsv.extract_text(io.StringIO(tsv_contents), details=details)
+                if details == tsv.TEXT_DETAILS_CHARACTER and base_filename.endswith('+charboxes'):
+                    # hOCR has real bounding boxes of characters here, TSV doesn't.
+                    # (That's why TSV is not used when character details are needed.)
+                    expected = [strip_bboxes(page.value) for page in expected]
+                    result = [strip_bboxes(page.value) for page in result]
+                self.assertEqual(result, expected)
+
+    def test_same_as_hocr(self):
+        for path in sorted_glob(os.path.join(here, 'test_hocr2djvused', '*_tesseract*.html')):
+            self._test_same_as_hocr(path)
+
+    def test_is_tsv(self):
+        stream = io.StringIO(tsv.HEADER + '\n1\t1\t0\t0\t0\t0\t0\t0\t10\t10\t-1\t\n')
+        self.assertTrue(tsv.is_tsv(stream))
+        self.assertEqual(stream.tell(), 0)
+        self.assertFalse(tsv.is_tsv(io.StringIO('<html>\n')))
+
+    def test_empty_page(self):
+        [page] = tsv.extract_text(io.StringIO('1\t1\t0\t0\t0\t0\t0\t0\t10\t20\t-1\n'))
+        self.assertEqual(page, text_zones.sexpr.Expression([text_zones.const.TEXT_ZONE_PAGE, 0, 0, 10, 20, '']))
+
+    def test_malformed(self):
+        for contents in [
+            '5\t1\t1\t1\t1\t1\t0\t0\t10\t20\t95\tword\n',
+            '1\t1\t0\t0\t0\t0\t0\t0\t10\t20\n',
+            '1\t1\t0\t0\t0\t0\t0\t0\t10\tx\t-1\t\n',
+            '7\t1\t0\t0\t0\t0\t0\t0\t10\t20\t-1\t\n',
+        ]:
+            with self.subTest(contents=contents):
+                with self.assertRaises(errors.MalformedOcrOutputError):
+                    tsv.extract_text(io.StringIO(contents))
+
+# vim:ts=4 sts=4 sw=4 et
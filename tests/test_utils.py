@@ -13,10 +13,13 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import hashlib
+import os
 import sys
 import warnings
 from ast import literal_eval
 
+from ocrodjvu import temporary
 from ocrodjvu import utils
 
 from tests.tools import mock, TestCase
@@ -274,25 +277,101 @@ class PropertyTestCase(TestCase):
         self.assertEqual(dummy.ham, 42)
 
 
+class FileDigestTestCase(TestCase):
+
+    def test_file_digest(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            with open(path, 'wb') as file:
+                file.write(b'ham')
+            self.assertEqual(utils.file_digest(path), hashlib.sha256(b'ham').digest())
+
+
 class GetCpuCountTestCase(TestCase):
     def test_get_cpu_count(self):
         n = utils.get_cpu_count()
         self.assertIsInstance(n, int)
         self.assertGreaterEqual(n, 1)
 
+    def test_quota(self):
+        with mock.patch.object(utils, 'get_cpu_quota', return_value=0.5):
+            self.assertEqual(utils.get_cpu_count(), 1)
+        with mock.patch.object(utils, 'get_cpu_quota', return_value=1e6):
+            self.assertEqual(utils.get_cpu_count(), len(os.sched_getaffinity(0)))
+
+
+class GetCpuQuotaTestCase(TestCase):
+
+    def _test(self, files, expected, proc_cgroup=None):
+        with temporary.directory() as tmpdir:
+            root = os.path.join(tmpdir, 'cgroup')
+            os.mkdir(root)
+            for path, contents in files.items():
+                path = os.path.join(root, path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wt') as file:
+                    file.write(contents)
+            proc_path = os.path.join(tmpdir, 'proc-self-cgroup')
+            if proc_cgroup is not None:
+                with open(proc_path, 'wt') as file:
+                    file.write(proc_cgroup)
+            self.assertEqual(utils.get_cpu_quota(root, proc_path), expected)
+
+    def test_none(self):
+        self._test({}, None)
+
+    def test_v2(self):
+        self._test({'cpu.max': '250000 100000\n'}, 2.5)
+
+    def test_v2_max(self):
+        self._test({'cpu.max': 'max 100000\n'}, None)
 
-class GetThreadLimitTestCase(TestCase):
-    def test_get_thread_limit(self):
-        for item_count in range(0, 10):
-            for job_count in range(1, 10):
-                with self.subTest(item_count=item_count, job_count=job_count):
-                    limit = utils.get_thread_limit(item_count, job_count)
-                    self.assertIsInstance(limit, int)
-                    if item_count == 0:
-                        self.assertEqual(limit, 1)
-                    else:
-                        npitems = min(item_count, job_count)
-                        self.assertLessEqual(limit * npitems, job_count)
-                        self.assertGreater((limit + 1) * npitems, job_count)
+    def test_v1(self):
+        self._test({'cpu,cpuacct/cpu.cfs_quota_us': '150000\n', 'cpu,cpuacct/cpu.cfs_period_us': '100000\n'}, 1.5)
+
+    def test_v1_unlimited(self):
+        self._test({'cpu/cpu.cfs_quota_us': '-1\n', 'cpu/cpu.cfs_period_us': '100000\n'}, None)
+
+    def test_v2_nested(self):
+        self._test(
+            {
+                'cpu.max': '800000 100000\n',
+                'user.slice/cpu.max': '300000 100000\n',
+                'user.slice/job.scope/cpu.max': 'max 100000\n',
+            },
+            3.0,
+            proc_cgroup='0::/user.slice/job.scope\n',
+        )
+
+    def test_v2_nested_innermost(self):
+        self._test(
+            {
+                'user.slice/cpu.max': '300000 100000\n',
+                'user.slice/job.scope/cpu.max': '50000 100000\n',
+            },
+            0.5,
+            proc_cgroup='0::/user.slice/job.scope\n',
+        )
+
+    def test_v2_other_namespace(self):
+        # The cgroup path is relative to the host's cgroup namespace,
+        # which is not what's mounted in the container:
+        self._test({'cpu.max': '200000 100000\n'}, 2.0, proc_cgroup='0::/docker/0123456789abcdef\n')
+
+    def test_v1_nested(self):
+        self._test(
+            {
+                'cpu,cpuacct/docker/cpu.cfs_quota_us': '150000\n',
+                'cpu,cpuacct/docker/cpu.cfs_period_us': '100000\n',
+                'cpu,cpuacct/docker/job/cpu.cfs_quota_us': '-1\n',
+                'cpu,cpuacct/docker/job/cpu.cfs_period_us': '100000\n',
+                # ignored, not in this cgroup:
+                'cpu,cpuacct/other/cpu.cfs_quota_us': '10000\n',
+                'cpu,cpuacct/other/cpu.cfs_period_us': '100000\n',
+                'cpu.max': '10000 100000\n',
+            },
+            1.5,
+            proc_cgroup='12:memory:/docker/job\n4:cpu,cpuacct:/docker/job\n0::/docker/job\n',
+        )
 
 # vim:ts=4 sts=4 sw=4 et